@@ -0,0 +1,593 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Python 3 benchmarks of the RU module, not packaged with the Lambda
+# function (CodeUri is src/).
+#
+# Usage:
+#   python3 bench/bench_ru.py --bench-codecs FILE...
+#   python3 bench/bench_ru.py --bench-header [SIZE...]
+#   python3 bench/bench_ru.py --bench-decode FILE...
+#   python3 bench/bench_ru.py --bench-numpy [ELEMENTS...]
+#   python3 bench/bench_ru.py --bench-types FILE...
+#   python3 bench/bench_ru.py --bench-reader FILE...
+#   python3 bench/bench_ru.py --bench-size-members [RECORDS...]
+#   python3 bench/bench_ru.py --bench-format
+#   python3 bench/bench_ru.py --bench-parallel FILE...
+#
+import datetime
+import io
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "src"))
+
+from utils.RU import (BodyReader, CODECS, DecompressReader, FormatParser,
+                      Header, ParallelRUDecoder, PushbackReader, RU,
+                      _import_numpy, parse_format)
+
+#
+# ベンチマーク用のデータ
+#
+def _make_bench_header(format_, header_comment = "benchmark"):
+    "Make the header of the Reusable for the benchmarks."
+    header = Header()
+    header.announced = datetime.datetime(2024, 1, 1)
+    header.created = datetime.datetime(2024, 1, 1)
+    header.global_id = "BNCH"
+    header.category = "BNCH"
+    header.data_id = "00000000"
+    header.data_name = "benchmark"
+    header.format = format_
+    header.header_comment = header_comment
+    header.header_version = "1.0"
+    header.revision = "1"
+    return header
+
+class _BenchStream(object):
+    """
+    Non-seekable stream for the benchmarks, like botocore's StreamingBody.
+    """
+    def __init__(self, data):
+        "Initialize this instance."
+        self._io = io.BytesIO(data)
+
+    def read(self, size = -1):
+        "Read up to size bytes."
+        return self._io.read(size)
+
+class _BenchBytesIO(io.BytesIO):
+    "io.BytesIO counting the bytes objects copied by read()."
+    def __init__(self, *args):
+        "Initialize this instance."
+        super().__init__(*args)
+        self.copies = 0
+
+    def read(self, size = -1):
+        "Read up to size bytes and count the copy."
+        self.copies += 1
+        return super().read(size)
+
+#
+# 圧縮コーデック
+#
+def benchmark_codecs(paths, compress_levels = None, repeat = 3):
+    """
+    Measure the compressed size, the compress and decompress time of the
+    RU files' bodies by every codec.
+    compress_levels maps the compress_type to the list of levels, the
+    codec's default level is used for the compress_type not in it.
+    Return the list of (path, compress_type, level, raw size, compressed
+    size, compress seconds, decompress seconds), the sizes and seconds are
+    None if the codec is not available.
+    """
+    import time
+
+    if compress_levels is None:
+        compress_levels = {}
+    rows = []
+    for path in paths:
+        fp = open(path, "rb")
+        ru = RU()
+        ru.load(fp)
+        fp.close()
+        body_io = io.BytesIO()
+        ru.get_root().write(ru, body_io)
+        body_part = body_io.getvalue()
+        for compress_type in sorted(CODECS.keys()):
+            codec = CODECS[compress_type]
+            for level in compress_levels.get(compress_type, [None]):
+                if not codec.is_available():
+                    rows.append((path, compress_type, level, len(body_part),
+                                 None, None, None))
+                    continue
+                compress_time = None
+                for i in range(repeat):
+                    start = time.perf_counter()
+                    data = codec.compress(body_part, level)
+                    elapsed = time.perf_counter() - start
+                    if compress_time is None or elapsed < compress_time:
+                        compress_time = elapsed
+                decompress_time = None
+                for i in range(repeat):
+                    start = time.perf_counter()
+                    reader = DecompressReader(io.BytesIO(data), len(data),
+                                              codec.decompressor)
+                    if len(reader.read()) != len(body_part):
+                        raise RuntimeError("%s: broken %s data" %
+                                           (path, compress_type))
+                    elapsed = time.perf_counter() - start
+                    if decompress_time is None or elapsed < decompress_time:
+                        decompress_time = elapsed
+                rows.append((path, compress_type, level, len(body_part),
+                             len(data), compress_time, decompress_time))
+    return rows
+
+#
+# ボディの読み込み
+#
+def benchmark_reader(paths, repeat = 3):
+    """
+    Measure the recursive Type.read() of the RU files' bodies on
+    BodyReader (the memoryview without the copies) and on io.BytesIO
+    (read() copies every value).
+    Return the list of (path, body size, BodyReader seconds, BodyReader
+    peak bytes, BodyReader copies, BytesIO seconds, BytesIO peak bytes,
+    BytesIO copies). The peak bytes are the peak of the memory traced
+    (tracemalloc) over the memory held by the decoded tree, and the copies
+    are the bytes objects made by read() of the reader.
+    """
+    import time
+    import tracemalloc
+
+    rows = []
+    for path in paths:
+        ru = RU()
+        fp = open(path, "rb")
+        header = ru.load_header(fp)
+        body_part = bytes(ru._read_body(fp, header))
+        fp.close()
+        row = [path, len(body_part)]
+        for make_io in (BodyReader, _BenchBytesIO):
+            best = None
+            for i in range(repeat + 1):
+                if i == repeat:
+                    tracemalloc.start()
+                root, size_members = parse_format(header["format"])
+                ru._init_size_members(size_members)
+                ru.encoding_cache.clear()
+                io_obj = make_io(body_part)
+                start = time.perf_counter()
+                root.read(ru, io_obj)
+                elapsed = time.perf_counter() - start
+                if i == repeat:
+                    held, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                elif best is None or elapsed < best:
+                    best = elapsed
+                del root
+            row.extend([best, peak - held, getattr(io_obj, "copies", 0)])
+        rows.append(tuple(row))
+    return rows
+
+#
+# ヘッダーの読み込み
+#
+def benchmark_header(sizes = (1024, 10 * 1024, 100 * 1024), repeat = 3):
+    """
+    Measure Header.load on the headers of about sizes bytes, read from
+    io.BytesIO, the non-seekable stream in PushbackReader and the stream
+    which can't push back the bytes read ahead (wrapped by Header.load).
+    Return the list of (header size, BytesIO seconds, PushbackReader
+    seconds, stream seconds).
+    """
+    import time
+
+    rows = []
+    for size in sizes:
+        header = _make_bench_header("a:INT8", "c" * size)
+        header_io = io.BytesIO()
+        header.save(header_io)
+        data = header_io.getvalue() + b"\x00"
+        row = [len(data) - 1]
+        for make_io in (io.BytesIO,
+                        lambda data: PushbackReader(_BenchStream(data)),
+                        _BenchStream):
+            best = None
+            for i in range(repeat):
+                start = time.perf_counter()
+                Header().load(make_io(data))
+                elapsed = time.perf_counter() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            row.append(best)
+        rows.append(tuple(row))
+    return rows
+
+#
+# 型のインスタンス
+#
+def _get_instances(obj, instances):
+    "Append the type instances in the tree of obj to the list."
+    instances.append(obj)
+    if obj.is_struct():
+        for member in obj.members:
+            _get_instances(member, instances)
+    elif obj.is_array():
+        for member in obj.value:
+            _get_instances(member, instances)
+    return instances
+
+def benchmark_types(paths, repeat = 3):
+    """
+    Measure the memory and copy() of the type instances decoded from the
+    RU files. numpy and the columns are not used, so that every element is
+    an instance.
+    Return the list of (path, instances, bytes per instance held by the
+    loaded Reusable (tracemalloc), seconds of copy() per instance).
+    """
+    import time
+    import tracemalloc
+
+    rows = []
+    for path in paths:
+        fp = open(path, "rb")
+        data = fp.read()
+        fp.close()
+        tracemalloc.start()
+        ru = RU()
+        ru.use_numpy = False
+        ru.columnar = False
+        root = ru.load(io.BytesIO(data))
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        instances = _get_instances(root, [])
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            for obj in instances:
+                obj.copy()
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        rows.append((path, len(instances), float(held) / len(instances),
+                     best / len(instances)))
+    return rows
+
+def benchmark_numpy(sizes = (1000000,), repeat = 3):
+    """
+    Measure RU.load of the FLOAT32 array of sizes elements into
+    numpy.ndarray (use_numpy) and into the list of the member's copy.
+    Return the list of (elements, numpy seconds, numpy bytes, list seconds,
+    list bytes), the bytes are the memory held by the loaded Reusable
+    (tracemalloc) and the numpy's are None if numpy is not available.
+    """
+    import time
+    import tracemalloc
+
+    rows = []
+    for size in sizes:
+        body_part = struct.pack("!I", size) + \
+            struct.pack("!%df" % size, *[float(i) for i in range(size)])
+        header = _make_bench_header("n:UINT32,v:{n}FLOAT32")
+        header.data_size = len(body_part)
+        data_io = io.BytesIO()
+        header.save(data_io)
+        data_io.write(body_part)
+        data = data_io.getvalue()
+        row = [size]
+        for use_numpy in (True, False):
+            if use_numpy and _import_numpy() is None:
+                row.extend([None, None])
+                continue
+            best = None
+            for i in range(repeat):
+                ru = RU()
+                ru.use_numpy = use_numpy
+                start = time.perf_counter()
+                ru.load(io.BytesIO(data))
+                elapsed = time.perf_counter() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+                del ru
+            tracemalloc.start()
+            ru = RU()
+            ru.use_numpy = use_numpy
+            ru.load(io.BytesIO(data))
+            held = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del ru
+            row.extend([best, held])
+        rows.append(tuple(row))
+    return rows
+
+#
+# フォーマット文字列の解析
+#
+BENCH_FORMAT_TYPES = ("INT8", "UINT16", "INT32", "FLOAT32", "FLOAT64",
+                      "STR", "USTR", "<4>NSTR", "<16>NESTR")
+
+def _make_bench_fields(rnd, count, depth):
+    "Make the field list of count fields nested to depth for the benchmark."
+    fields = []
+    for i in range(count):
+        r = rnd.random()
+        if depth > 0 and r < 0.1:
+            fields.append("s%d:[%s]" % (
+                i, _make_bench_fields(rnd, count // 4 + 1, depth - 1)))
+        elif depth > 0 and r < 0.2:
+            fields.append("c%d:UINT16,a%d:{c%d}[%s]" % (
+                i, i, i, _make_bench_fields(rnd, count // 4 + 1, depth - 1)))
+        elif r < 0.3:
+            fields.append("field_%d:{%d}%s" % (
+                i, rnd.randint(1, 99), rnd.choice(BENCH_FORMAT_TYPES)))
+        else:
+            fields.append("field_number_%d : %s" % (
+                i, rnd.choice(BENCH_FORMAT_TYPES)))
+    return ",".join(fields)
+
+def benchmark_format(repeat = 3, seed = 0):
+    """
+    Measure FormatParser.parse on the long synthetic format strings: flat
+    (2000 fields), nested (the structs and the {count} arrays at depth 3),
+    wide (300 fields at depth 1) and the structs nested at depth 600.
+    Return the list of (name, length, seconds).
+    """
+    import random
+    import time
+
+    rnd = random.Random(seed)
+    formats = [
+        ("flat", _make_bench_fields(rnd, 2000, 0)),
+        ("nested", _make_bench_fields(rnd, 60, 3)),
+        ("wide", _make_bench_fields(rnd, 300, 1)),
+    ]
+    deep = "x:INT8"
+    for i in range(600):
+        deep = "d%d:[%s,n%d:INT8]" % (i, deep, i)
+    formats.append(("depth 600", deep))
+    rows = []
+    for name, format_ in formats:
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            FormatParser().parse(format_)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        rows.append((name, len(format_), best))
+    return rows
+
+#
+# デコードプラン
+#
+def benchmark_decode(paths, fields = None, repeat = 3):
+    """
+    Measure RU.load of the RU files in memory by the DecodePlan (compiled)
+    and by the recursive Type.read().
+    Return the list of (path, size, compiled seconds, recursive seconds).
+    """
+    import time
+
+    rows = []
+    for path in paths:
+        fp = open(path, "rb")
+        data = fp.read()
+        fp.close()
+        row = [path, len(data)]
+        for compiled in (True, False):
+            best = None
+            for i in range(repeat):
+                ru = RU()
+                ru.compiled = compiled
+                start = time.perf_counter()
+                ru.load(io.BytesIO(data), fields = fields)
+                elapsed = time.perf_counter() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            row.append(best)
+        rows.append(tuple(row))
+    return rows
+
+#
+# サイズメンバー
+#
+BENCH_SIZE_FORMAT = ("n:INT16,"
+                     "a:{n}[k:INT8,w:INT16,b:{k}[j:INT8,c:{j}[i:INT8,"
+                     "d:{i}INT16,x:INT32,e:[h:INT8,f:{h}[g:INT8,"
+                     "y:{g}UINT8]]]]]")
+
+def _make_bench_size_members(records, seed = 0):
+    "Make the Reusable of the nested {count} arrays for the benchmark."
+    import random
+
+    rnd = random.Random(seed)
+    ru = RU()
+    root = ru.create(_make_bench_header(BENCH_SIZE_FORMAT))
+    root["n"] = records
+    root["a"].resize(records)
+    for a in root["a"]:
+        a["k"] = k = rnd.randint(1, 4)
+        a["b"].resize(k)
+        for b in a["b"]:
+            b["j"] = j = rnd.randint(1, 4)
+            b["c"].resize(j)
+            for c in b["c"]:
+                c["i"] = i = rnd.randint(0, 3)
+                c["d"].resize(i)
+                for index in range(i):
+                    c["d"][index] = index
+                e = c["e"]
+                e["h"] = h = rnd.randint(1, 3)
+                e["f"].resize(h)
+                for f in e["f"]:
+                    f["g"] = g = rnd.randint(0, 3)
+                    f["y"].resize(g)
+                    for index in range(g):
+                        f["y"][index] = index
+    data = io.BytesIO()
+    ru.save(data)
+    return data.getvalue()
+
+def benchmark_size_members(records = (3000,), repeat = 3):
+    """
+    Measure RU.load of the Reusables of records structs with the {count}
+    arrays nested at depth 4 (BENCH_SIZE_FORMAT), by the DecodePlan
+    (compiled) and by the recursive Type.read(), and 20000 rounds of the
+    size member's bookkeeping alone (_enter_struct, _set_array_size and
+    _get_array_size at 4 levels, then _leave_struct).
+    Return the list of (records, size, compiled seconds, recursive seconds,
+    bookkeeping seconds).
+    """
+    import time
+
+    rows = []
+    for count in records:
+        data = _make_bench_size_members(count)
+        row = [count, len(data)]
+        for compiled in (True, False):
+            best = None
+            for i in range(repeat):
+                ru = RU()
+                ru.compiled = compiled
+                start = time.perf_counter()
+                ru.load(io.BytesIO(data))
+                elapsed = time.perf_counter() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            row.append(best)
+        names = ["k", "j", "i", "h"]
+        best = None
+        for i in range(repeat):
+            ru._init_size_members(dict.fromkeys(names + ["n", "g"]))
+            start = time.perf_counter()
+            for j in range(20000):
+                for name in names:
+                    ru._enter_struct()
+                    ru._set_array_size(name, 3)
+                    ru._get_array_size(name)
+                for name in names:
+                    ru._leave_struct()
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        row.append(best)
+        rows.append(tuple(row))
+    return rows
+
+#
+# 複数プロセスでの一括読み込み
+#
+def benchmark_parallel(inputs, workers = None, fields = None, repeat = 3):
+    """
+    Measure ParallelRUDecoder on 1 to the number of CPUs (or the list of
+    workers) processes.
+    Return the list of (workers, best seconds, Reusables per second,
+    speedup to the first workers).
+    """
+    import os
+    import time
+
+    inputs = list(inputs)
+    if workers is None:
+        workers = range(1, (os.cpu_count() or 1) + 1)
+    rows = []
+    for max_workers in workers:
+        decoder = ParallelRUDecoder(max_workers, fields,
+                                    max(1, len(inputs) // (max_workers * 4)))
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            decoder.decode(inputs)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        speedup = 1.0
+        if len(rows) > 0:
+            speedup = rows[0][1] / best
+        rows.append((max_workers, best, len(inputs) / best, speedup))
+    return rows
+
+#
+#
+#
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--bench-codecs":
+        print("%-24s %-6s %5s %10s %10s %6s %10s %10s" %
+              ("file", "codec", "level", "raw", "size", "ratio",
+               "comp ms", "decomp ms"))
+        for row in benchmark_codecs(sys.argv[2:]):
+            path, compress_type, level, raw_size, size = row[0:5]
+            if size is None:
+                print("%-24s %-6s %5s %10d %s" % (path[-24:], compress_type,
+                                                  "-", raw_size,
+                                                  "not available"))
+                continue
+            print("%-24s %-6s %5s %10d %10d %6.3f %10.1f %10.1f" %
+                  (path[-24:], compress_type,
+                   "-" if level is None else level, raw_size, size,
+                   float(size) / raw_size, row[5] * 1000, row[6] * 1000))
+    elif len(sys.argv) > 1 and sys.argv[1] == "--bench-header":
+        print("%10s %12s %12s %12s" %
+              ("header", "BytesIO ms", "pushback ms", "stream ms"))
+        sizes = [int(size) for size in sys.argv[2:]]
+        for row in benchmark_header(*([sizes] if sizes else [])):
+            print("%10d %12.3f %12.3f %12.3f" %
+                  (row[0], row[1] * 1000, row[2] * 1000, row[3] * 1000))
+    elif len(sys.argv) > 2 and sys.argv[1] == "--bench-decode":
+        print("%-24s %10s %12s %12s %8s" %
+              ("file", "size", "compiled ms", "recursive ms", "speedup"))
+        for path, size, compiled, recursive in benchmark_decode(sys.argv[2:]):
+            print("%-24s %10d %12.2f %12.2f %8.2f" %
+                  (path[-24:], size, compiled * 1000, recursive * 1000,
+                   recursive / compiled))
+    elif len(sys.argv) > 1 and sys.argv[1] == "--bench-numpy":
+        print("%10s %10s %10s %10s %10s" %
+              ("elements", "numpy ms", "numpy MiB", "list ms", "list MiB"))
+        sizes = [int(size) for size in sys.argv[2:]]
+        for row in benchmark_numpy(*([sizes] if sizes else [])):
+            if row[1] is None:
+                print("%10d %21s %10.1f %10.1f" % (row[0], "not available",
+                                                   row[3] * 1000,
+                                                   row[4] / 2.0 ** 20))
+                continue
+            print("%10d %10.1f %10.1f %10.1f %10.1f" %
+                  (row[0], row[1] * 1000, row[2] / 2.0 ** 20,
+                   row[3] * 1000, row[4] / 2.0 ** 20))
+    elif len(sys.argv) > 2 and sys.argv[1] == "--bench-types":
+        print("%-24s %10s %12s %10s" %
+              ("file", "instances", "bytes/inst", "copy us"))
+        for path, instances, size, copy in benchmark_types(sys.argv[2:]):
+            print("%-24s %10d %12.1f %10.3f" %
+                  (path[-24:], instances, size, copy * 1e6))
+    elif len(sys.argv) > 2 and sys.argv[1] == "--bench-reader":
+        print("%-24s %9s %9s %8s %8s %9s %8s %8s" %
+              ("file", "body", "view ms", "view KiB", "copies",
+               "bytes ms", "bytesKiB", "copies"))
+        for row in benchmark_reader(sys.argv[2:]):
+            print("%-24s %9d %9.2f %8.1f %8d %9.2f %8.1f %8d" %
+                  (row[0][-24:], row[1], row[2] * 1000, row[3] / 1024.0,
+                   row[4], row[5] * 1000, row[6] / 1024.0, row[7]))
+    elif len(sys.argv) > 1 and sys.argv[1] == "--bench-size-members":
+        print("%8s %10s %12s %12s %14s" %
+              ("records", "size", "compiled ms", "recursive ms",
+               "bookkeep ms"))
+        records = [int(count) for count in sys.argv[2:]]
+        for row in benchmark_size_members(*([records] if records else [])):
+            print("%8d %10d %12.1f %12.1f %14.1f" %
+                  (row[0], row[1], row[2] * 1000, row[3] * 1000,
+                   row[4] * 1000))
+    elif len(sys.argv) > 1 and sys.argv[1] == "--bench-format":
+        print("%-10s %8s %10s" % ("format", "chars", "parse ms"))
+        for row in benchmark_format():
+            print("%-10s %8d %10.2f" % (row[0], row[1], row[2] * 1000))
+    elif len(sys.argv) > 2 and sys.argv[1] == "--bench-parallel":
+        print("%7s %10s %12s %8s" % ("workers", "ms", "files/s", "speedup"))
+        for row in benchmark_parallel(sys.argv[2:]):
+            print("%7d %10.1f %12.1f %8.2f" %
+                  (row[0], row[1] * 1000, row[2], row[3]))
+    else:
+        print("usage: %s --bench-NAME [ARG...]" % sys.argv[0])
+        sys.exit(2)
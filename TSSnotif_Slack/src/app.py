@@ -1,25 +1,89 @@
+import asyncio
 import json
 import os
 import urllib3
 import boto3
-from utils.RU import RU
+from concurrent.futures import ThreadPoolExecutor
+from utils import RU, dedup, metrics, ratelimit, s3range
 from datetime import datetime
 
 SLACK_WEBHOOK_URL = os.environ["SLACK_WEBHOOK_URL"]
 IN_BUCKET = os.environ['INBUCKET']
 TAGID = '411023800'
+## upper bound of records processed at once (SQS BatchSize is 10)
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "10"))
+## RU members used by data_extract, the others are not decoded
+NOTIFY_FIELDS = {"announced_date", "ICAO", "telegram_type", "flight_type", "edition"}
 
-# Create S3 client 
+## Slack connection pool settings
+SLACK_POOL_MAXSIZE = int(os.environ.get("SLACK_POOL_MAXSIZE", str(MAX_WORKERS)))
+SLACK_CONNECT_TIMEOUT = float(os.environ.get("SLACK_CONNECT_TIMEOUT", "3.0"))
+SLACK_READ_TIMEOUT = float(os.environ.get("SLACK_READ_TIMEOUT", "10.0"))
+SLACK_RETRIES = int(os.environ.get("SLACK_RETRIES", "3"))
+SLACK_BACKOFF_FACTOR = float(os.environ.get("SLACK_BACKOFF_FACTOR", "0.5"))
+
+## Slack webhook budget (messages per second and burst), the lines sent
+## while waiting for the budget are merged into a post of SLACK_MAX_LINES
+SLACK_RATE = float(os.environ.get("SLACK_RATE", str(ratelimit.DEFAULT_RATE)))
+SLACK_BURST = int(os.environ.get("SLACK_BURST", str(ratelimit.DEFAULT_BURST)))
+SLACK_MAX_LINES = int(os.environ.get("SLACK_MAX_LINES", str(ratelimit.DEFAULT_MAX_LINES)))
+
+## asyncio pipeline settings, lambda_handler uses it if ASYNC_PIPELINE=1
+ASYNC_PIPELINE = os.environ.get("ASYNC_PIPELINE", "0") == "1"
+S3_CONCURRENCY = int(os.environ.get("S3_CONCURRENCY", str(MAX_WORKERS)))
+SLACK_CONCURRENCY = int(os.environ.get("SLACK_CONCURRENCY", str(SLACK_POOL_MAXSIZE)))
+
+## dedup of the redelivered SQS messages and the repeated S3 keys
+## (DEDUP=0 disables it), DEDUP_SQLITE_PATH adds the persistent tier
+DEDUP = os.environ.get("DEDUP", "1") == "1"
+DEDUP_TTL = float(os.environ.get("DEDUP_TTL", str(dedup.DEFAULT_TTL)))
+## the claim until the Slack post returns, keep it under the queue's VisibilityTimeout
+DEDUP_PENDING_TTL = float(os.environ.get("DEDUP_PENDING_TTL", str(dedup.DEFAULT_PENDING_TTL)))
+DEDUP_MAX_ENTRIES = int(os.environ.get("DEDUP_MAX_ENTRIES", str(dedup.DEFAULT_MAX_ENTRIES)))
+DEDUP_SQLITE_PATH = os.environ.get("DEDUP_SQLITE_PATH", "")
+
+## per-stage timings and counts as CloudWatch EMF log lines (METRICS_EMF=1)
+METRICS_EMF = os.environ.get("METRICS_EMF", "0") == "1"
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "TSSnotif")
+
+# Create S3 client
 s3_client = boto3.client('s3')
 
-def data_extract(root_ref: dict, created: str):
+# Create the connection pool once per container so that warm invocations
+# reuse the connection to hooks.slack.com (urllib3 keeps it alive)
+htttp = urllib3.PoolManager(
+    maxsize=SLACK_POOL_MAXSIZE,
+    block=True,
+    timeout=urllib3.Timeout(connect=SLACK_CONNECT_TIMEOUT,
+                            read=SLACK_READ_TIMEOUT),
+    retries=urllib3.Retry(total=SLACK_RETRIES,
+                          backoff_factor=SLACK_BACKOFF_FACTOR,
+                          status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=frozenset(["POST"]),
+                          respect_retry_after_header=True))
+
+# Create the dedup cache once per container so that warm invocations
+# remember the keys already delivered
+dedup_cache = None
+if DEDUP:
+    dedup_cache = dedup.DedupCache(
+        ttl=DEDUP_TTL,
+        max_entries=DEDUP_MAX_ENTRIES,
+        pending_ttl=DEDUP_PENDING_TTL,
+        persistent=dedup.SQLiteTier(DEDUP_SQLITE_PATH) if DEDUP_SQLITE_PATH else None)
+
+def get_issue(root_ref: dict):
     announced_date = root_ref["announced_date"]
-    issue = datetime(announced_date["year"], announced_date["month"], announced_date["day"], announced_date["hour"], announced_date["min"]).strftime("%Y%m%d_%H%MZ")
+    return datetime(announced_date["year"], announced_date["month"], announced_date["day"], announced_date["hour"], announced_date["min"]).strftime("%Y%m%d_%H%MZ")
+
+def data_extract(root_ref: dict, created: str):
+    issue = get_issue(root_ref)
     ICAO = root_ref["ICAO"]
     kind = root_ref["telegram_type"] #NRML/AMND/CRCT
     flighttype = root_ref["flight_type"]  #regular/special
     rev = root_ref["edition"]
 
+    message = None
     if rev >= 0 and kind == "CRCT":
         message = f"{ICAO} {issue} CRCTed at {created}"
     elif rev == 0 and flighttype == "special":
@@ -31,44 +95,197 @@ def data_extract(root_ref: dict, created: str):
             message = f"Adhoc {ICAO} {issue} AMDed at {created}"
     #else:
     #    messagecontent = f"OTHERS: Edition {rev}, {kind} {flighttype} {ICAO} {issue} at {created} is not necessary"
-            
+
     return message
 
-def lambda_handler(event, context):
+def get_s3_key(rec: dict):
+    body = json.loads(rec["body"])
+    sqs_message = body['Message']
+    print(f"s3_message:{sqs_message}")
+    if not sqs_message:
+        raise ValueError("Invalid event structure")
+    return sqs_message
 
-    # Extract SQS message
-    for rec in event['Records']:
-       body = json.loads(rec["body"])
-       sqs_message = body['Message']
-       print(f"s3_message:{sqs_message}")
-       if not sqs_message:
-           raise ValueError("Invalid event structure")
-
-    #collecting data from S3
-    response = s3_client.get_object(Bucket=IN_BUCKET, Key=sqs_message)
-
-    ##read RU data
-    ru = RU.RU()
-    root_ref = ru.load(response["Body"])
-    header = ru.get_header()
-    created_time = header['created'].strftime("%Y/%m/%d %H:%M:%S GMT")
-    
-    ## add connection pool and send message due to SNS trigger to the pool
-    htttp = urllib3.PoolManager()
-
-    ## extract messages string variable based on the TSS types
-    messagevar = data_extract(root_ref, created_time)
+def post_webhook(messagevar: str):
     ## write variable into text
     messagecontent = {"text": messagevar}
 
-    ## post to Slack channel
-    slackresp = htttp.request("POST", 
-                     SLACK_WEBHOOK_URL,
-                     body=json.dumps(messagecontent),
-                     headers={"Content-type": "application/json"})
-
-    # TODO implement    
-    return {
-        'statusCode': 200,
-        'body': json.dumps("Message sent successfully.")
-    }
+    ## post to Slack channel, 429/5xx are retried by the pool
+    with metrics.stage("SlackPost"):
+        slackresp = htttp.request("POST",
+                         SLACK_WEBHOOK_URL,
+                         body=json.dumps(messagecontent),
+                         headers={"Content-type": "application/json"})
+    metrics.put("SlackLines", messagevar.count("\n") + 1)
+    if slackresp.status >= 300:
+        raise RuntimeError(f"Slack post failed: {slackresp.status} {slackresp.data!r}")
+    return slackresp
+
+# The webhook's budget is shared by all records and warm invocations of
+# the container
+slack_sender = ratelimit.BatchingSender(
+    post_webhook,
+    ratelimit.TokenBucket(SLACK_RATE, SLACK_BURST),
+    max_lines=SLACK_MAX_LINES)
+
+def post_to_slack(messagevar: str):
+    ## post within the budget, merged with the other records' lines under pressure
+    slack_sender.send(messagevar)
+
+def claim(key: str, claims: list):
+    ## claim the dedup key, False if it was already delivered
+    if not dedup_cache.claim(key):
+        print(f"duplicate skipped:{key}")
+        metrics.put("Duplicates", 1)
+        return False
+    claims.append(key)
+    return True
+
+def release_claims(claims: list):
+    ## the delivery failed, so the retry is not taken as a duplicate
+    for key in claims:
+        dedup_cache.release(key)
+
+def commit_claims(claims: list):
+    ## delivered, the redeliveries are duplicates for DEDUP_TTL from now
+    for key in claims:
+        dedup_cache.commit(key)
+
+def read_record(rec: dict):
+    sqs_message = get_s3_key(rec)
+    claims = []
+    try:
+        size = etag = None
+        if dedup_cache is not None:
+            ## S3 key + ETag is checked by HEAD before any GET
+            with metrics.stage("S3Head"):
+                head = s3_client.head_object(Bucket=IN_BUCKET, Key=sqs_message)
+            size, etag = head["ContentLength"], head["ETag"]
+            if not claim(dedup.object_key(sqs_message, etag), claims):
+                return None
+
+        #collecting data from S3, only the byte ranges read by RU are fetched
+        ## each Range GET is timed as the S3Get stage
+        reader = s3range.S3RangeReader(s3_client, IN_BUCKET, sqs_message, size=size, etag=etag,
+                                       recorder=metrics.get_recorder())
+
+        ##read RU data
+        ru = RU.RU()
+        ## HeaderLoad, FormatParse, Decompress and Decode stages of RU, without the S3Get in them
+        ru.recorder = metrics.get_recorder()
+        root_ref = ru.load(reader, fields=NOTIFY_FIELDS)
+        print(f"s3 fetched:{sqs_message} {reader.bytes_fetched} bytes in {reader.requests} requests")
+        metrics.put("S3Bytes", reader.bytes_fetched, metrics.UNIT_BYTES)
+        metrics.put("S3Requests", reader.requests)
+        header = ru.get_header()
+        metrics.put("BodyBytes", header["data_size"], metrics.UNIT_BYTES)
+        created_time = header['created'].strftime("%Y/%m/%d %H:%M:%S GMT")
+
+        ## the same issuance stored under another key
+        if dedup_cache is not None:
+            key = dedup.issuance_key(root_ref["ICAO"], get_issue(root_ref), root_ref["edition"], root_ref["telegram_type"])
+            if not claim(key, claims):
+                ## this object is delivered as that issuance, so its
+                ## redeliveries are duplicates too
+                commit_claims(claims)
+                return None
+    except Exception:
+        if claims:
+            release_claims(claims)
+        raise
+    return root_ref, created_time, claims
+
+def process_record(rec: dict):
+    metrics.put("Records", 1)
+    record = read_record(rec)
+    if record is None:
+        ## already delivered
+        return
+    root_ref, created_time, claims = record
+
+    try:
+        ## extract messages string variable based on the TSS types
+        with metrics.stage("DataExtract"):
+            messagevar = data_extract(root_ref, created_time)
+        ## nothing to notify for this TSS if None
+        if messagevar is not None:
+            post_to_slack(messagevar)
+    except Exception:
+        if claims:
+            release_claims(claims)
+        raise
+    if claims:
+        commit_claims(claims)
+
+async def process_record_async(rec: dict, executor, s3_semaphore, slack_semaphore):
+    loop = asyncio.get_running_loop()
+    metrics.put("Records", 1)
+
+    ## S3 GET and RU decoding run on the executor, bounded by s3_semaphore
+    async with s3_semaphore:
+        record = await loop.run_in_executor(executor, read_record, rec)
+    if record is None:
+        return
+    root_ref, created_time, claims = record
+
+    try:
+        with metrics.stage("DataExtract"):
+            messagevar = data_extract(root_ref, created_time)
+
+        ## Slack post runs on the executor, bounded by slack_semaphore
+        if messagevar is not None:
+            async with slack_semaphore:
+                await loop.run_in_executor(executor, post_to_slack, messagevar)
+    except Exception:
+        if claims:
+            release_claims(claims)
+        raise
+    if claims:
+        commit_claims(claims)
+
+async def process_records_async(records: list):
+    ## records overlap their S3, decoding and Slack stages with each other
+    s3_semaphore = asyncio.Semaphore(max(1, S3_CONCURRENCY))
+    slack_semaphore = asyncio.Semaphore(max(1, SLACK_CONCURRENCY))
+    workers = max(1, S3_CONCURRENCY) + max(1, SLACK_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = await asyncio.gather(
+            *[process_record_async(rec, executor, s3_semaphore, slack_semaphore)
+              for rec in records],
+            return_exceptions=True)
+
+    failures = []
+    for rec, result in zip(records, results):
+        if isinstance(result, Exception):
+            print(f"failed messageId:{rec['messageId']} {result!r}")
+            failures.append({"itemIdentifier": rec["messageId"]})
+
+    return {"batchItemFailures": failures}
+
+def process_records(records: list):
+    ## process every record, report only the failed ones back to SQS
+    failures = []
+    workers = max(1, min(MAX_WORKERS, len(records)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [(rec, executor.submit(process_record, rec))
+                   for rec in records]
+        for rec, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"failed messageId:{rec['messageId']} {e!r}")
+                failures.append({"itemIdentifier": rec["messageId"]})
+
+    return {"batchItemFailures": failures}
+
+def lambda_handler(event, context):
+    records = event['Records']
+    if METRICS_EMF:
+        metrics.start(METRICS_NAMESPACE, {"FunctionName": os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "TSSnotif")})
+    try:
+        if ASYNC_PIPELINE:
+            return asyncio.run(process_records_async(records))
+        return process_records(records)
+    finally:
+        ## one EMF line per invocation, the values of the records in arrays
+        metrics.finish()
@@ -10,8 +10,11 @@
 # $Id: RU.py,v 1.4 2019/10/29 04:19:42 tsuyoshi Exp $
 # $Source: /home/cvs/EXPRESS/python-lib/RU/RU.py,v $
 #
-import copy
+import array
+import collections
+import contextlib
 import datetime
+import functools
 import io
 import re
 import struct
@@ -37,6 +40,572 @@ HEADER_KEYS = [
 HEADER_OPTIONAL_KEYS = [
     "compress_type",
 ]
+HEADER_READ_SIZE	= 4096
+STRING_READ_SIZE	= 256
+DECOMPRESS_READ_SIZE	= 64 * 1024
+COMPRESS_WRITE_SIZE	= 64 * 1024
+
+# The stage without the recorder, see RU.recorder
+NULL_STAGE		= contextlib.nullcontext()
+
+#
+# 変更フラグ (Type.dirty)
+#
+DIRTY_VALUE		= 1	# the values are changed in place
+DIRTY_RESIZE		= 2	# the size or the layout is changed
+
+def _is_seekable(io_obj):
+    "Is the I/O object seekable ?"
+    seekable = getattr(io_obj, "seekable", None)
+    if seekable is None:
+        return False
+    try:
+        return seekable()
+    except Exception:
+        return False
+
+@functools.lru_cache(maxsize = None)
+def _import_numpy():
+    "Import numpy if it is available."
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def _skip_bytes(io_obj, size, name):
+    "Skip size bytes on the I/O object."
+    if size == 0:
+        return
+    if hasattr(io_obj, "skip"):
+        io_obj.skip(size, name)
+    elif len(io_obj.read(size)) != size:
+        raise RuntimeError("unexpected EOF at %s" % name)
+
+#
+# 先読みしたデータを押し戻せる読み込みクラス
+#
+class PushbackReader(object):
+    """
+    Reader wrapper which can push back the bytes read ahead.
+    """
+    def __init__(self, io_obj):
+        "Initialize this instance."
+        self.io_obj = io_obj
+        self._pushback = b""
+
+    def read(self, size = -1):
+        "Read up to size bytes."
+        if size is None or size < 0:
+            data = self._pushback + self.io_obj.read()
+            self._pushback = b""
+            return data
+        if len(self._pushback) >= size:
+            data = self._pushback[0:size]
+            self._pushback = self._pushback[size:]
+            return data
+        data = self._pushback
+        self._pushback = b""
+        return data + self.io_obj.read(size - len(data))
+
+    def unread(self, data):
+        "Push back the data."
+        self._pushback = bytes(data) + self._pushback
+
+    def seekable(self):
+        "Is seekable ?"
+        return False
+
+#
+# ボディの圧縮コーデック
+#
+class Codec(object):
+    """
+    Compression codec of the RU body.
+    compress() compresses the whole body and decompressor() returns the
+    object having decompress(data), eof and unused_data like
+    bz2.BZ2Decompressor for DecompressReader. compressor() returns the
+    object having compress(data) and flush() like bz2.BZ2Compressor for
+    CompressWriter, or None if the codec compresses the whole body only.
+    """
+    def compress(self, data, level = None):
+        "Compress the data with the level or the codec's default level."
+        raise NotImplementedError()
+
+    def compressor(self, level = None):
+        "Return a new compressor, or None if not supported."
+        return None
+
+    def decompressor(self):
+        "Return a new decompressor."
+        raise NotImplementedError()
+
+    def is_available(self):
+        "Is the module of this codec available ?"
+        return True
+
+class GzipCodec(Codec):
+    "gzip codec."
+    def compress(self, data, level = None):
+        "Compress the data with the level or the codec's default level."
+        import gzip
+
+        if level is None:
+            level = 9
+        return gzip.compress(data, level)
+
+    def compressor(self, level = None):
+        "Return a new compressor."
+        import zlib
+
+        if level is None:
+            level = 9
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def decompressor(self):
+        "Return a new decompressor."
+        import zlib
+
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+class Bzip2Codec(Codec):
+    "bzip2 codec."
+    def compress(self, data, level = None):
+        "Compress the data with the level or the codec's default level."
+        import bz2
+
+        if level is None:
+            level = 9
+        return bz2.compress(data, level)
+
+    def compressor(self, level = None):
+        "Return a new compressor."
+        import bz2
+
+        if level is None:
+            level = 9
+        return bz2.BZ2Compressor(level)
+
+    def decompressor(self):
+        "Return a new decompressor."
+        import bz2
+
+        return bz2.BZ2Decompressor()
+
+class ZstdCodec(Codec):
+    "zstd codec, needs compression.zstd (Python 3.14) or zstandard module."
+    def compress(self, data, level = None):
+        "Compress the data with the level or the codec's default level."
+        zstd, zstandard = self._import()
+        if level is None:
+            level = 3
+        if zstandard:
+            return zstd.ZstdCompressor(level = level).compress(data)
+        return zstd.compress(data, level = level)
+
+    def compressor(self, level = None):
+        "Return a new compressor."
+        zstd, zstandard = self._import()
+        if level is None:
+            level = 3
+        if zstandard:
+            return zstd.ZstdCompressor(level = level).compressobj()
+        return zstd.ZstdCompressor(level = level)
+
+    def decompressor(self):
+        "Return a new decompressor."
+        zstd, zstandard = self._import()
+        if zstandard:
+            return zstd.ZstdDecompressor().decompressobj()
+        return zstd.ZstdDecompressor()
+
+    def _import(self):
+        "Import the zstd module and return it and whether it is zstandard."
+        try:
+            from compression import zstd
+            return zstd, False
+        except ImportError:
+            pass
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("compress_type zstd needs zstandard module")
+        return zstandard, True
+
+    def is_available(self):
+        "Is the module of this codec available ?"
+        try:
+            self._import()
+        except RuntimeError:
+            return False
+        return True
+
+class Lz4Codec(Codec):
+    "lz4 frame codec, needs lz4 module."
+    def compress(self, data, level = None):
+        "Compress the data with the level or the codec's default level."
+        lz4_frame = self._import()
+        if level is None:
+            level = 0
+        return lz4_frame.compress(data, compression_level = level)
+
+    def decompressor(self):
+        "Return a new decompressor."
+        return self._import().LZ4FrameDecompressor()
+
+    def _import(self):
+        "Import the lz4.frame module."
+        try:
+            import lz4.frame
+        except ImportError:
+            raise RuntimeError("compress_type lz4 needs lz4 module")
+        return lz4.frame
+
+    def is_available(self):
+        "Is the module of this codec available ?"
+        try:
+            self._import()
+        except RuntimeError:
+            return False
+        return True
+
+CODECS = {
+    "gzip"	: GzipCodec(),
+    "bzip2"	: Bzip2Codec(),
+    "zstd"	: ZstdCodec(),
+    "lz4"	: Lz4Codec(),
+}
+
+def register_codec(compress_type, codec):
+    "Register the codec for the compress_type."
+    CODECS[compress_type] = codec
+
+def get_codec(compress_type):
+    "Return the codec for the compress_type."
+    codec = CODECS.get(compress_type)
+    if codec is None:
+        raise RuntimeError("no support compress_type %s" % compress_type)
+    return codec
+
+#
+# 圧縮されたボディを逐次展開する読み込みクラス
+#
+class DecompressReader(object):
+    """
+    Reader of the decompressed body.
+    The size bytes of the compressed data are read from io_obj by chunk and
+    fed to the decompressor created by decompressor_factory on demand, so
+    the whole compressed data is never kept in memory.
+    stage(name) returns the context manager timing the decompression (e.g.
+    RU._stage), so it is timed apart from the decoding which reads it.
+    """
+    def __init__(self, io_obj, size, decompressor_factory, stage = None):
+        "Initialize this instance."
+        self.io_obj = io_obj
+        self.remaining = size
+        self.decompressor_factory = decompressor_factory
+        self.decompressor = decompressor_factory()
+        self.buffer = bytearray()
+        self.stage = stage
+
+    def _fill(self, size):
+        "Decompress until size bytes are buffered or the data ends."
+        if size >= 0 and len(self.buffer) >= size:
+            return
+        if self.stage is None:
+            self._decompress(size)
+            return
+        with self.stage("Decompress"):
+            self._decompress(size)
+
+    def _decompress(self, size):
+        "Read and decompress the chunks for _fill()."
+        while size < 0 or len(self.buffer) < size:
+            if self.remaining <= 0:
+                if not self.decompressor.eof:
+                    raise RuntimeError("unexpected EOF of compressed data")
+                return
+            chunk = self.io_obj.read(min(self.remaining, DECOMPRESS_READ_SIZE))
+            if len(chunk) == 0:
+                raise RuntimeError("unexpected EOF")
+            self.remaining -= len(chunk)
+            while len(chunk) > 0:
+                if self.decompressor.eof:
+                    # the next member of the multi-member data
+                    self.decompressor = self.decompressor_factory()
+                self.buffer += self.decompressor.decompress(chunk)
+                chunk = b""
+                if self.decompressor.eof and self.decompressor.unused_data:
+                    chunk = self.decompressor.unused_data
+
+    def read(self, size = -1):
+        "Read up to size bytes."
+        if size is None or size < 0:
+            self._fill(-1)
+            data = self.buffer
+            self.buffer = bytearray()
+            return data
+        self._fill(size)
+        data = bytes(self.buffer[0:size])
+        del self.buffer[0:size]
+        return data
+
+    def unread(self, data):
+        "Push back the data."
+        self.buffer[0:0] = data
+
+    def skip(self, size, name):
+        "Skip size bytes without keeping them."
+        while size > 0:
+            self._fill(min(size, DECOMPRESS_READ_SIZE))
+            n = min(size, len(self.buffer))
+            if n == 0:
+                raise RuntimeError("unexpected EOF at %s" % name)
+            del self.buffer[0:n]
+            size -= n
+
+    def seekable(self):
+        "Is seekable ?"
+        return False
+
+    def close(self):
+        "Read the rest of the compressed data from io_obj without decoding."
+        while self.remaining > 0:
+            chunk = self.io_obj.read(min(self.remaining, DECOMPRESS_READ_SIZE))
+            if len(chunk) == 0:
+                raise RuntimeError("unexpected EOF")
+            self.remaining -= len(chunk)
+        self.buffer = bytearray()
+
+#
+# ボディを逐次圧縮する書き込みクラス
+#
+class CompressWriter(object):
+    """
+    Writer which compresses the body while it is written.
+    The small writes of the members are gathered up to
+    COMPRESS_WRITE_SIZE bytes and fed to the compressor, so the whole
+    uncompressed body is never kept in memory. The compressed data is kept
+    in data until close(), since its size is written in the header ahead.
+    """
+    def __init__(self, compressor):
+        "Initialize this instance."
+        self.compressor = compressor
+        self.buffer = bytearray()
+        self.data = bytearray()
+
+    def write(self, data):
+        "Write the data."
+        self.buffer += data
+        if len(self.buffer) >= COMPRESS_WRITE_SIZE:
+            self.data += self.compressor.compress(self.buffer)
+            self.buffer = bytearray()
+        return len(data)
+
+    def close(self):
+        "Compress the rest and return the compressed data."
+        if len(self.buffer) > 0:
+            self.data += self.compressor.compress(self.buffer)
+            self.buffer = bytearray()
+        self.data += self.compressor.flush()
+        return self.data
+
+#
+# メモリ上のボディ読み込みクラス
+#
+class BodyReader(object):
+    """
+    Reader on the memoryview of the body with an offset cursor.
+    The reader is limited to data[start:end] and the positions are the
+    offsets in data.
+    """
+    def __init__(self, data, start = 0, end = None):
+        "Initialize this instance."
+        if not hasattr(data, "find"):
+            data = bytes(data)
+        self.data = data
+        self.view = memoryview(data)
+        self.pos = start
+        self.end = len(self.view)
+        if end is not None:
+            self.end = min(end, self.end)
+
+    def read(self, size = -1):
+        "Read up to size bytes as the memoryview."
+        start = self.pos
+        if size is None or size < 0 or start + size > self.end:
+            self.pos = self.end
+        else:
+            self.pos = start + size
+        return self.view[start:self.pos]
+
+    def read_view(self, size, name):
+        "Return the memoryview of size bytes."
+        start = self.pos
+        if start + size > self.end:
+            raise RuntimeError("unexpected EOF at %s" % name)
+        self.pos = start + size
+        return self.view[start:self.pos]
+
+    def read_cstring(self, name):
+        "Read the NUL terminated string."
+        start = self.pos
+        pos = self.data.find(b"\x00", start, self.end)
+        if pos < 0:
+            raise RuntimeError("unexpected EOF at %s" % name)
+        self.pos = pos + 1
+        return self.view[start:pos]
+
+    def remaining(self):
+        "Return the number of bytes not read yet."
+        return self.end - self.pos
+
+    def seek(self, offset, whence = io.SEEK_SET):
+        "Change the position."
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.end
+        self.pos = min(max(offset, 0), self.end)
+        return self.pos
+
+    def seekable(self):
+        "Is seekable ?"
+        return True
+
+    def skip(self, size, name):
+        "Skip size bytes."
+        if self.pos + size > self.end:
+            raise RuntimeError("unexpected EOF at %s" % name)
+        self.pos += size
+
+    def tell(self):
+        "Return the position."
+        return self.pos
+
+    def unpack(self, struct_obj):
+        "Unpack the values by struct_obj."
+        start = self.pos
+        if start + struct_obj.size > self.end:
+            raise RuntimeError("unexpected EOF")
+        self.pos = start + struct_obj.size
+        return struct_obj.unpack_from(self.view, start)
+
+    def unpack_value(self, format_, size, name):
+        "Unpack a value by the format."
+        start = self.pos
+        if start + size > self.end:
+            raise RuntimeError("unexpected EOF at %s" % name)
+        self.pos = start + size
+        return struct.unpack_from(format_, self.view, start)[0]
+
+#
+# ストリーム上のボディの読み込みクラス
+#
+class StreamBodyReader(object):
+    """
+    Reader of the body on the stream (e.g. DecompressReader) with the
+    interface of BodyReader for the DecodePlan.
+    Only the window of the bytes not read yet is kept in memory, so the
+    views returned are the copies of the bytes in the window.
+    """
+    def __init__(self, io_obj):
+        "Initialize this instance."
+        self.io_obj = io_obj
+        self.buffer = b""
+        self.offset = 0
+        self.pos = 0
+
+    def _fill(self, size):
+        "Buffer size bytes from the offset, return False if the data ends."
+        available = len(self.buffer) - self.offset
+        if available >= size:
+            return True
+        chunks = [self.buffer[self.offset:]]
+        while available < size:
+            chunk = self.io_obj.read(max(size - available,
+                                         DECOMPRESS_READ_SIZE))
+            if len(chunk) == 0:
+                break
+            chunks.append(chunk)
+            available += len(chunk)
+        self.buffer = b"".join(chunks)
+        self.offset = 0
+        return available >= size
+
+    def _take(self, size):
+        "Return up to size bytes from the offset."
+        start = self.offset
+        data = self.buffer[start:start + size]
+        self.offset = start + len(data)
+        self.pos += len(data)
+        return data
+
+    def read(self, size = -1):
+        "Read up to size bytes."
+        if size is None or size < 0:
+            self.remaining()
+            size = len(self.buffer)
+        else:
+            self._fill(size)
+        return self._take(size)
+
+    def read_view(self, size, name):
+        "Return size bytes."
+        if not self._fill(size):
+            raise RuntimeError("unexpected EOF at %s" % name)
+        return self._take(size)
+
+    def read_cstring(self, name):
+        "Read the NUL terminated string."
+        searched = 0
+        while True:
+            pos = self.buffer.find(b"\x00", self.offset + searched)
+            if pos >= 0:
+                break
+            searched = len(self.buffer) - self.offset
+            if not self._fill(searched + 1):
+                raise RuntimeError("unexpected EOF at %s" % name)
+        data = self._take(pos - self.offset)
+        self._take(1)
+        return data
+
+    def remaining(self):
+        "Return the number of bytes not read yet, the rest is buffered."
+        rest = self.io_obj.read()
+        if len(rest) > 0:
+            self.buffer = self.buffer[self.offset:] + rest
+            self.offset = 0
+        return len(self.buffer) - self.offset
+
+    def seekable(self):
+        "Is seekable ?"
+        return False
+
+    def skip(self, size, name):
+        "Skip size bytes without keeping them."
+        available = len(self.buffer) - self.offset
+        if size <= available:
+            self.offset += size
+        else:
+            self.buffer = b""
+            self.offset = 0
+            _skip_bytes(self.io_obj, size - available, name)
+        self.pos += size
+
+    def tell(self):
+        "Return the position."
+        return self.pos
+
+    def unpack(self, struct_obj):
+        "Unpack the values by struct_obj."
+        if not self._fill(struct_obj.size):
+            raise RuntimeError("unexpected EOF")
+        return struct_obj.unpack(self._take(struct_obj.size))
+
+    def unpack_value(self, format_, size, name):
+        "Unpack a value by the format."
+        return struct.unpack(format_, self.read_view(size, name))[0]
 
 #
 # RUヘッダクラス
@@ -147,23 +716,22 @@ class Header(object):
         self._keys[name] = value
 
     def load(self, io_obj, strict = True):
-        "Load from the IO object."
+        """
+        Load from the IO object.
+        The header is read by chunk and the bytes after it are given back to
+        io_obj by unread() or seek(). io_obj which can do neither (e.g. the
+        StreamingBody of boto3) is wrapped in PushbackReader keeping them.
+        Return the IO object to read the body from, io_obj or its
+        PushbackReader.
+        """
+        if not hasattr(io_obj, "unread") and not _is_seekable(io_obj):
+            io_obj = PushbackReader(io_obj)
         signature = io_obj.read(len(HEADER_SIGNATURE))
         if len(signature) != len(HEADER_SIGNATURE) or \
                 signature != HEADER_SIGNATURE:
             raise RuntimeError("no RU header")
-        lines = b""
         end_signature = HEADER_END_SIGNATURE.encode(self.encoding)
-        while True:
-            c = io_obj.read(1)
-            if len(c) != 1:
-                raise RuntimeError("no end of RU header")
-            lines += c
-            if len(lines) >= len(end_signature) and \
-                    lines[len(lines) - 2:len(lines)] == end_signature:
-                break
-        # Remove the end of signature
-        lines = lines[0:len(lines) - len(end_signature)]
+        lines = self._read_lines(io_obj, end_signature)
 
         #
         self._keys = {}
@@ -206,6 +774,32 @@ class Header(object):
                 if strict and not key in HEADER_OPTIONAL_KEYS:
                     raise RuntimeError("no %s" % key)
 
+        return io_obj
+
+    def _read_lines(self, io_obj, end_signature):
+        """
+        Read the header lines by chunk and give back the bytes after the end
+        of signature to the IO object.
+        """
+        buf = bytearray()
+        start = 0
+        while True:
+            chunk = io_obj.read(HEADER_READ_SIZE)
+            if len(chunk) == 0:
+                raise RuntimeError("no end of RU header")
+            buf += chunk
+            pos = buf.find(end_signature, start)
+            if pos >= 0:
+                break
+            start = max(0, len(buf) - len(end_signature) + 1)
+        rest = buf[pos + len(end_signature):]
+        if len(rest) > 0:
+            if hasattr(io_obj, "unread"):
+                io_obj.unread(rest)
+            else:
+                io_obj.seek(-len(rest), io.SEEK_CUR)
+        return bytes(buf[0:pos])
+
     def save(self, io_obj):
         "Save to the IO object"
         io_obj.write(HEADER_SIGNATURE)
@@ -250,28 +844,73 @@ class Header(object):
 # RUの型定義
 #
 
+#
+# 型のスキーマ (コピー間で共有する不変の記述子)
+#
+TypeSchema = collections.namedtuple("TypeSchema", (
+    "name", "type", "size", "format", "encoding", "encoding_errors",
+))
+
+def _schema_property(field):
+    "Make the property of the schema's field."
+    getter = lambda self: getattr(self.schema, field)
+    def setter(self, value):
+        self.schema = self.schema._replace(**{field : value})
+    return property(getter, setter, doc = "The %s of the schema." % field)
+
 #
 # すべての型のベースクラス
 #
 class Type(object):
-    "RU type base class for all types."
+    """
+    RU type base class for all types.
+    The name, type, size, format and encoding are kept in the TypeSchema
+    shared by the copies, and only the value belongs to the instance.
+    """
+    __slots__ = ("schema", "value", "dirty", "changes")
+
     def __init__(self, name, type_, size = None):
         "Initialize this instance."
-        self.name = name
-        self.type = type_
-        self.size = size
-        self.encoding = None
-        self.format = None
+        self.schema = TypeSchema(name, type_, size, None, None, None)
         self.value = None
-
-    def copy(self):
-        "Copy this instance."
-        return copy.copy(self)
+        # Changed since the load or the last save, see RU.save()
+        self.dirty = False
+        # The set of id(schema) changed in the tree, shared by its members
+        self.changes = None
+
+    name = _schema_property("name")
+    type = _schema_property("type")
+    size = _schema_property("size")
+    format = _schema_property("format")
+    encoding = _schema_property("encoding")
+
+    def copy(self, changes = None):
+        """
+        Copy this instance.
+        changes is the set of the tree having the copy, or the same as this
+        instance if None.
+        """
+        obj = self.__class__.__new__(self.__class__)
+        obj.schema = self.schema
+        obj.value = self.value
+        obj.dirty = False
+        obj.changes = self.changes if changes is None else changes
+        return obj
 
     def get_name(self):
         "Return the name."
         return self.name
 
+    def _set_dirty(self, dirty = DIRTY_VALUE):
+        """
+        Mark this instance changed since the load or the last save.
+        The greater dirty (DIRTY_RESIZE) is kept until the save.
+        """
+        if dirty > self.dirty:
+            self.dirty = dirty
+        if self.changes is not None:
+            self.changes.add(id(self.schema))
+
     def get_name_type(self):
         "Return the name and type string."
         if self.name == "":
@@ -312,16 +951,36 @@ class Type(object):
         "Is struct type ?"
         return False
 
+    def get_fixed_size(self):
+        "Return the size in bytes, or None if the size is variable."
+        return self.size
+
     def read(self, ru, io_obj):
         "Read the value from I/O object."
-        if self.format is None:
-            raise RuntimeError("%s no pack format" % self.type)
-        data = io_obj.read(self.size)
-        if len(data) != self.size:
-            raise RuntimeError("unexpected EOF at %s" % self.name)
-        self.value = struct.unpack(self.format, data)[0]
-        if self.is_integer():
-            ru._set_array_size(self.name, self.value)
+        self.value = self._read_value(io_obj)
+        if self.schema.name in ru.size_members and self.is_integer():
+            ru._set_array_size(self.schema.name, self.value)
+
+    def skip(self, ru, io_obj):
+        "Skip the value on I/O object."
+        if self.is_integer() and self.schema.name in ru.size_members:
+            # The array size is needed even if the member is not requested.
+            ru._set_array_size(self.schema.name, self._read_value(io_obj))
+            return
+        _skip_bytes(io_obj, self.schema.size, self.schema.name)
+
+    def _read_value(self, io_obj):
+        "Read and unpack the value from I/O object."
+        schema = self.schema
+        if schema.format is None:
+            raise RuntimeError("%s no pack format" % schema.type)
+        if type(io_obj) is BodyReader:
+            return io_obj.unpack_value(schema.format, schema.size,
+                                       schema.name)
+        data = io_obj.read(schema.size)
+        if len(data) != schema.size:
+            raise RuntimeError("unexpected EOF at %s" % schema.name)
+        return struct.unpack(schema.format, data)[0]
 
     def write(self, ru, io_obj):
         "Write the value to I/O object."
@@ -329,14 +988,16 @@ class Type(object):
             raise RuntimeError("%s no pack format" % self.type)
         data = struct.pack(self.format, self.value)
         io_obj.write(data)
-        if self.is_integer():
-            ru._set_array_size(self.name, self.value)            
+        if self.name in ru.size_members and self.is_integer():
+            ru._set_array_size(self.name, self.value)
 
 #
 # RU スカラー型のベースクラス
 #
 class ScalarType(Type):
     "RU Scalar type base class."
+    __slots__ = ()
+
     def __init__(self, name, type_, size):
         "Initialize this instance."
         super(ScalarType, self).__init__(name, type_, size)
@@ -354,6 +1015,8 @@ class ScalarType(Type):
 #
 class INTType(ScalarType):
     "RU Integer type base class."
+    __slots__ = ()
+
     def __init__(self, name, size):
         "Initialize this instance."
         type_ = "INT%d" % (size * CHAR_BIT)
@@ -367,12 +1030,15 @@ class INTType(ScalarType):
     def set_value(self, value):
         "Set the value."
         self.value = int(value)
+        self._set_dirty()
 
 #
 # RU UINT型のベースクラス
 #
 class UINTType(ScalarType):
     "RU Unsigned Integer type base class."
+    __slots__ = ()
+
     def __init__(self, name, size):
         "Initialize this instance."
         type_ = "UINT%d" % (size * CHAR_BIT)
@@ -386,12 +1052,15 @@ class UINTType(ScalarType):
     def set_value(self, value):
         "Set the value."
         self.value = int(value)
+        self._set_dirty()
 
 #
 # RU FLOAT型のベースクラス
 #
 class FLOATType(ScalarType):
     "RU FLOAT type base class."
+    __slots__ = ()
+
     def __init__(self, name, size):
         "Initialize this instance."
         type_ = "FLOAT%d" % (size * CHAR_BIT)
@@ -405,18 +1074,22 @@ class FLOATType(ScalarType):
     def set_value(self, value):
         "Set the value."
         self.value = float(value)
+        self._set_dirty()
 
 #
 # RU 文字列型のベースクラス
 #
 class StringType(Type):
     "RU String type base class."
+    __slots__ = ()
+
     def __init__(self, name, type_, size = None):
         "Initialize this instance."
         super(StringType, self).__init__(name, type_, size)
-        self.encoding_errors = None
         self.value = ""
 
+    encoding_errors = _schema_property("encoding_errors")
+
     def get_name_type(self):
         "Return the name and type."
         if self.size is None:
@@ -454,52 +1127,108 @@ class StringType(Type):
     def set_value(self, value):
         "Set the value."
         self.value = str(value)
+        self._set_dirty()
 
     def read(self, ru, io_obj):
         "Read the RU string type value from I/O object."
         if self.size is None:
-            s = b""
-            while True:
-                c = io_obj.read(1)
-                if len(c) == 0:
-                    raise RuntimeError("unexpected EOF at %s" % self.name)
-                if c == b"\x00":
-                    break
-                s += c
+            s = self._read_cstring(io_obj)
         else:
             s = io_obj.read(self.size)
             if len(s) != self.size:
                 raise RuntimeError("unexpected EOF at %s" % self.name)
 
-        encoding, errors = self.get_encoding(ru, True)
+        encoding, errors = self._get_encoding(ru)
         if encoding == "bytes":
-            self.value = s
+            self.value = bytes(s)
         else:
-            self.value = s.decode(encoding, errors)
+            self.value = str(s, encoding, errors)
+
+    def skip(self, ru, io_obj):
+        "Skip the RU string type value on I/O object."
+        if self.size is None:
+            self._read_cstring(io_obj)
+        else:
+            _skip_bytes(io_obj, self.size, self.name)
+
+    def _read_cstring(self, io_obj):
+        "Read the NUL terminated string from I/O object."
+        if hasattr(io_obj, "read_cstring"):
+            return io_obj.read_cstring(self.name)
+        if hasattr(io_obj, "unread") or _is_seekable(io_obj):
+            return self._read_cstring_chunked(io_obj)
+        s = bytearray()
+        while True:
+            c = io_obj.read(1)
+            if len(c) == 0:
+                raise RuntimeError("unexpected EOF at %s" % self.name)
+            if c == b"\x00":
+                break
+            s += c
+        return s
+
+    def _read_cstring_chunked(self, io_obj):
+        """
+        Read the NUL terminated string by chunk and give back the bytes after
+        the NUL to the IO object.
+        """
+        buf = bytearray()
+        start = 0
+        while True:
+            chunk = io_obj.read(STRING_READ_SIZE)
+            if len(chunk) == 0:
+                raise RuntimeError("unexpected EOF at %s" % self.name)
+            buf += chunk
+            pos = buf.find(b"\x00", start)
+            if pos >= 0:
+                break
+            start = len(buf)
+        rest = len(buf) - pos - 1
+        if rest > 0:
+            if hasattr(io_obj, "unread"):
+                io_obj.unread(buf[pos + 1:])
+            else:
+                io_obj.seek(-rest, io.SEEK_CUR)
+        del buf[pos:]
+        return buf
+
+    def _get_encoding(self, ru):
+        "Get the encoding and errors, cached on the RU per string type."
+        if ru is None:
+            return self.get_encoding(None, True)
+        encoding = ru.encoding_cache.get(self.type)
+        if encoding is None:
+            encoding = self.get_encoding(ru, True)
+            ru.encoding_cache[self.type] = encoding
+        return encoding
 
     def write(self, ru, io_obj):
         "Write the RU string type value to I/O object."
-        encoding, errors = self.get_encoding(ru, True)
+        io_obj.write(self._encode(ru))
+
+    def _encode(self, ru):
+        "Return the bytes of the value with the NUL or the padding."
+        encoding, errors = self._get_encoding(ru)
         if encoding == "bytes":
-            buf = self.value
+            buf = bytes(self.value)
         else:
             buf = self.value.encode(encoding, errors)
         if self.size is None:
-            io_obj.write(buf)
-            io_obj.write(b"\x00")
+            return buf + b"\x00"
+        sz = len(buf)
+        if sz < self.size:
+            buf += b"\x00" * (self.size - sz)
         else:
-            sz = len(buf)
-            if sz < self.size:
-                buf += b"\x00" * (self.size - sz)
-            else:
-                buf = buf[0 : self.size]
-            io_obj.write(buf)
+            buf = buf[0 : self.size]
+        return buf
 
 #
 # RU FLOAT32/64型
 #
 class FLOAT32Type(FLOATType):
     "RU FLOAT32 type."
+    __slots__ = ()
+
     def __init__(self, name):
         "Initialize this instance."
         super(FLOAT32Type, self).__init__(name, 4)
@@ -507,6 +1236,8 @@ class FLOAT32Type(FLOATType):
 
 class FLOAT64Type(FLOATType):
     "RU FLOAT64 type."
+    __slots__ = ()
+
     def __init__(self, name):
         "Initialize this instance."
         super(FLOAT64Type, self).__init__(name, 8)
@@ -517,6 +1248,8 @@ class FLOAT64Type(FLOATType):
 #
 class INT8Type(INTType):
     "RU INT8 type."
+    __slots__ = ()
+
     def __init__(self, name):
         "Initialize this instance."
         super(INT8Type, self).__init__(name, 1)
@@ -524,6 +1257,8 @@ class INT8Type(INTType):
 
 class INT16Type(INTType):
     "RU INT16 type."
+    __slots__ = ()
+
     def __init__(self, name):
         "Initialize this instance."
         super(INT16Type, self).__init__(name, 2)
@@ -531,6 +1266,8 @@ class INT16Type(INTType):
 
 class INT32Type(INTType):
     "RU INT32 type."
+    __slots__ = ()
+
     def __init__(self, name):
         "Initialize this instance."
         super(INT32Type, self).__init__(name, 4)
@@ -541,6 +1278,8 @@ class INT32Type(INTType):
 #
 class UINT8Type(UINTType):
     "RU UINT8 type."
+    __slots__ = ()
+
     def __init__(self, name):
         "Initialize this instance."
         super(UINT8Type, self).__init__(name, 1)
@@ -548,6 +1287,8 @@ class UINT8Type(UINTType):
 
 class UINT16Type(UINTType):
     "RU UINT16 type."
+    __slots__ = ()
+
     def __init__(self, name):
         "Initialize this instance."
         super(UINT16Type, self).__init__(name, 2)
@@ -555,6 +1296,8 @@ class UINT16Type(UINTType):
 
 class UINT32Type(UINTType):
     "RU UINT32 type."
+    __slots__ = ()
+
     def __init__(self, name):
         "Initialize this instance."
         super(UINT32Type, self).__init__(name, 4)
@@ -565,12 +1308,16 @@ class UINT32Type(UINTType):
 #
 class STRType(StringType):
     "RU STR type."
+    __slots__ = ()
+
     def __init__(self, name):
         "Initialize this instance."
         super(STRType, self).__init__(name, "STR")
 
 class ESTRType(StringType):
     "RU ESTR type."
+    __slots__ = ()
+
     def __init__(self, name):
         "Initialize this instance."
         super(ESTRType, self).__init__(name, "ESTR")
@@ -578,6 +1325,8 @@ class ESTRType(StringType):
 
 class JSTRType(StringType):
     "RU JSTR type."
+    __slots__ = ()
+
     def __init__(self, name):
         "Initialize this instance."
         super(JSTRType, self).__init__(name, "JSTR")
@@ -585,6 +1334,8 @@ class JSTRType(StringType):
 
 class SSTRType(StringType):
     "RU SSTR type."
+    __slots__ = ()
+
     def __init__(self, name):
         ""
         super(SSTRType, self).__init__(name, "SSTR")
@@ -592,6 +1343,8 @@ class SSTRType(StringType):
 
 class USTRType(StringType):
     "RU USTR type."
+    __slots__ = ()
+
     def __init__(self, name):
         "Initialize this instance."
         super(USTRType, self).__init__(name, "USTR")
@@ -602,12 +1355,16 @@ class USTRType(StringType):
 #
 class NSTRType(StringType):
     "RU NSTR type."
+    __slots__ = ()
+
     def __init__(self, name, size):
         "Initialize this instance."
         super(NSTRType, self).__init__(name, "NSTR", size)
 
 class NESTRType(StringType):
     "RU NESTR type."
+    __slots__ = ()
+
     def __init__(self, name, size):
         "Initialize this instance."
         super(NESTRType, self).__init__(name, "NESTR", size)
@@ -615,6 +1372,8 @@ class NESTRType(StringType):
 
 class NJSTRType(StringType):
     "RU NJSTR type."
+    __slots__ = ()
+
     def __init__(self, name, size):
         "Initialize this instance."
         super(NJSTRType, self).__init__(name, "NJSTR", size)
@@ -622,6 +1381,8 @@ class NJSTRType(StringType):
 
 class NSSTRType(StringType):
     "RU SNSTR type."
+    __slots__ = ()
+
     def __init__(self, name, size):
         "Initialize this instance."
         super(NSSTRType, self).__init__(name, "NSSTR", size)
@@ -630,38 +1391,80 @@ class NSSTRType(StringType):
 
 class NUSTRType(StringType):
     "RU NUSTR type."
+    __slots__ = ()
+
     def __init__(self, name, size):
         "Initialize this instance."
         super(NUSTRType, self).__init__(name, "NUSTR", size)
         self.encoding = "utf_8"
 
+#
+# numpyのdtype (ビッグエンディアン)
+#
+NUMPY_DTYPES = {
+    "!f" : ">f4", "!d" : ">f8",
+    "b" : "i1", "!h" : ">i2", "!l" : ">i4",
+    "B" : "u1", "!H" : ">u2", "!L" : ">u4",
+}
+
+#
+# array.arrayのタイプコード
+#
+ARRAY_TYPECODES = {
+    "!f" : "f", "!d" : "d",
+    "b" : "b", "!h" : "h", "!l" : "i",
+    "B" : "B", "!H" : "H", "!L" : "I",
+}
+
 #
 # RU Array型
 #
 class ArrayType(Type):
     """
     RU Array Type.
+    The array of INT/UINT/FLOAT is read into numpy.ndarray if RU.use_numpy
+    is set and numpy is available, and its elements are ElementRef while it
+    is read or changed in place. It is converted to the list of the member's
+    copy by append() and resize().
+    The array of the struct of INT/UINT/FLOAT is read into one column per
+    member if RU.columnar is True, and its rows are StructRow.
     """
+    __slots__ = ("member", "ndarray", "columns")
+
     def __init__(self, name, size, member):
         "Initialize this instance."
         super(ArrayType, self).__init__(name, "Array", size)
         self.member = member
         self.value = []
+        self.ndarray = None
+        self.columns = None
 
     def __len__(self):
         "Return the length."
+        if self.ndarray is not None:
+            return len(self.ndarray)
+        if self.columns is not None:
+            return len(self.columns[self.member.members[0].name])
         return len(self.value)
 
     def __iter__(self):
         "Return the iterator object."
+        if self.columns is not None:
+            return (StructRow(self, i) for i in range(len(self)))
+        if self.ndarray is not None:
+            return (ElementRef(self, i) for i in range(len(self)))
         return (obj for obj in self.value)
 
     def __getitem__(self, key):
         "Get the item value."
         if not type(key) is int:
             raise TypeError("key is not int")
-        if key < 0 or key >= len(self.value):
+        if key < 0 or key >= len(self):
             raise IndexError("%d out of range" % key)
+        if self.ndarray is not None:
+            return self.ndarray[key].item()
+        if self.columns is not None:
+            return StructRow(self, key)
         obj = self.value[key]
         if obj.is_struct() or obj.is_array():
             return obj
@@ -672,8 +1475,20 @@ class ArrayType(Type):
         "Set the item value."
         if not type(key) is int:
             raise TypeError("key is not int")
-        if key < 0 or key >= len(self.value):
+        if key < 0 or key >= len(self):
             raise IndexError("%d out of range" % key)
+        if self.ndarray is not None:
+            if not self.ndarray.flags.writeable:
+                # The view on the body, copy it before the change.
+                self.ndarray = self.ndarray.copy()
+            if self.member.is_integer():
+                self.ndarray[key] = int(value)
+            else:
+                self.ndarray[key] = float(value)
+            self._set_dirty(DIRTY_VALUE)
+            return
+        if self.columns is not None:
+            raise RuntimeError("Array or Struct type assignment not supported")
         obj = self.value[key]
         if obj.is_struct() or obj.is_array():
             raise RuntimeError("Array or Struct type assignment not supported")
@@ -683,13 +1498,148 @@ class ArrayType(Type):
         "Append the value."
         if self.member.is_array() or self.member.is_struct():
             raise RuntimeError("Array or Struct type append not supported")
-        member = self.member.copy()
+        self._unpack_ndarray()
+        member = self.member.copy(self.changes)
         member.set_value(value)
         self.value.append(member)
-        
-    def copy(self):
-        "Copy this array instance."
-        return ArrayType(self.name, self.size, self.member.copy())
+        self._set_dirty(DIRTY_RESIZE)
+
+    def get_ndarray(self):
+        "Return the numpy.ndarray of the values, or None if not read so."
+        return self.ndarray
+
+    def get_dtype(self):
+        "Return the numpy dtype of the member, or None if not scalar."
+        if not self.member.is_scalar():
+            return None
+        return NUMPY_DTYPES.get(self.member.format)
+
+    def set_ndarray(self, ndarray):
+        "Set the values by numpy.ndarray."
+        self._set_ndarray(ndarray)
+        self._set_dirty(DIRTY_RESIZE)
+
+    def _set_ndarray(self, ndarray):
+        "Set the values by numpy.ndarray read from the body."
+        self.ndarray = ndarray
+        self.columns = None
+        self.value = []
+
+    def get_column(self, name):
+        "Return the column of the struct member, or None if not read so."
+        if self.columns is None:
+            return None
+        return self.columns[name]
+
+    def is_columnar(self):
+        "Can the member be read into the columns ?"
+        if not self.member.is_struct() or len(self.member.members) == 0:
+            return False
+        names = set()
+        for member in self.member.members:
+            if not member.is_scalar() or member.name == "" or \
+                    member.name in names:
+                return False
+            names.add(member.name)
+        return True
+
+    def set_columns(self, data, numpy = None):
+        """
+        Set the values by the bytes of the structs as the columns.
+        The columns are the views of numpy's structured array if numpy is
+        given, or array.array.
+        """
+        self._set_columns(data, numpy)
+        self._set_dirty(DIRTY_RESIZE)
+
+    def _set_columns(self, data, numpy = None):
+        "Set the values by the bytes of the structs read from the body."
+        members = self.member.members
+        if numpy is not None:
+            dtype = numpy.dtype([(member.name, NUMPY_DTYPES[member.format])
+                                 for member in members])
+            records = numpy.frombuffer(data, dtype)
+            columns = [records[member.name] for member in members]
+        else:
+            struct_obj = self._get_row_struct()
+            values = list(zip(*struct_obj.iter_unpack(data)))
+            if len(values) == 0:
+                values = [()] * len(members)
+            columns = [array.array(ARRAY_TYPECODES[member.format], value)
+                       for member, value in zip(members, values)]
+        self.columns = {}
+        for member, column in zip(members, columns):
+            self.columns[member.name] = column
+        self.ndarray = None
+        self.value = []
+
+    def _get_row_struct(self):
+        "Return struct.Struct of the struct member."
+        return struct.Struct("!" + "".join(member.format.lstrip("!")
+                                           for member in self.member.members))
+
+    def _get_column_value(self, name, index):
+        "Get the value in the column."
+        value = self.columns[name][index]
+        if hasattr(value, "item"):
+            value = value.item()
+        return value
+
+    def _set_column_value(self, name, index, value):
+        "Set the value in the column."
+        column = self.columns[name]
+        if hasattr(column, "flags") and not column.flags.writeable:
+            # The view on the body, copy it before the change.
+            column = column.copy()
+            self.columns[name] = column
+        if self.member._get_member(name).is_integer():
+            column[index] = int(value)
+        else:
+            column[index] = float(value)
+        self._set_dirty(DIRTY_VALUE)
+
+    def _get_struct(self, index):
+        "Return the copy of the struct member with the values of the row."
+        member = self.member.copy(self.changes)
+        for name in self.columns:
+            member._get_member(name).value = \
+                self._get_column_value(name, index)
+        return member
+
+    def _unpack_columns(self):
+        "Convert the columns to the list of the member's copy."
+        if self.columns is None:
+            return
+        self.value = [self._get_struct(i) for i in range(len(self))]
+        self.columns = None
+
+    def _unpack_ndarray(self):
+        "Convert numpy.ndarray to the list of the member's copy."
+        if self.ndarray is None:
+            return
+        values = []
+        for value in self.ndarray.tolist():
+            member = self.member.copy(self.changes)
+            member.value = value
+            values.append(member)
+        self.value = values
+        self.ndarray = None
+
+    def copy(self, changes = None):
+        """
+        Copy this array instance.
+        The member is the template of the elements and shared by the copies,
+        and the elements are copied from it with the changes of the array.
+        """
+        obj = ArrayType.__new__(ArrayType)
+        obj.schema = self.schema
+        obj.member = self.member
+        obj.value = []
+        obj.dirty = False
+        obj.changes = self.changes if changes is None else changes
+        obj.ndarray = None
+        obj.columns = None
+        return obj
 
     def get_name_type(self):
         "Return the name and type."
@@ -705,6 +1655,14 @@ class ArrayType(Type):
         "Return the reference."
         if not type(key) is int:
             raise TypeError("key is not int")
+        if self.columns is not None:
+            if key < 0 or key >= len(self):
+                raise IndexError("%d out of range" % key)
+            return StructRow(self, key)
+        if self.ndarray is not None:
+            if key < 0 or key >= len(self):
+                raise IndexError("%d out of range" % key)
+            return ElementRef(self, key)
         if key < 0 or key >= len(self.value):
             raise IndexError("%d out of range" % key)
         obj = self.value[key]
@@ -716,9 +1674,14 @@ class ArrayType(Type):
 
     def resize(self, size):
         "Resize this array."
+        self._set_dirty(DIRTY_RESIZE)
         if size <= 0:
             self.value = []
+            self.ndarray = None
+            self.columns = None
             return
+        self._unpack_ndarray()
+        self._unpack_columns()
         if size < len(self.value):
             # Shrink down the array.
             while len(self.value) > size:
@@ -726,47 +1689,120 @@ class ArrayType(Type):
         else:
             # Grow up the array.
             while len(self.value) < size:
-                member = self.member.copy()
+                member = self.member.copy(self.changes)
                 self.value.append(member)
 
-    def read(self, ru, io_obj):
-        "Read the array values from I/O."
+    def get_fixed_size(self):
+        "Return the size in bytes, or None if the size is variable."
+        if type(self.size) is not int:
+            return None
+        member_size = self.member.get_fixed_size()
+        if member_size is None:
+            return None
+        return self.size * member_size
+
+    def read(self, ru, io_obj, fields = None):
+        """
+        Read the array values from I/O.
+        fields is the member's selection made by RU.load.
+        """
         self.value = []
-        if self.size is None:
+        self.ndarray = None
+        self.columns = None
+        numpy = None
+        if ru.use_numpy:
+            numpy = _import_numpy()
+        dtype = self.get_dtype()
+        if dtype is not None and numpy is not None:
+            self.ndarray = numpy.frombuffer(self._read_block(ru, io_obj),
+                                            dtype)
+        elif ru.columnar and self.is_columnar():
+            self._set_columns(self._read_block(ru, io_obj), numpy)
+        elif self.size is None:
             # unlimit array size for '+'
-            array = io_obj.read()
-            array_io = io.BytesIO(array)
-            while True:
-                if array_io.tell() >= len(array):
-                    break
-                member = self.member.copy()
-                member.read(ru, array_io)
+            if type(io_obj) is BodyReader:
+                array_io = io_obj
+            else:
+                array_io = BodyReader(io_obj.read())
+            while array_io.remaining() > 0:
+                member = self.member.copy(self.changes)
+                if fields is None:
+                    member.read(ru, array_io)
+                else:
+                    member.read(ru, array_io, fields)
                 self.value.append(member)
         else:
-            if type(self.size) is int:
-                size = self.size
-            else:
-                size = ru._get_array_size(self.size)
+            size = self._get_read_size(ru)
             for i in range(size):
-                member = self.member.copy()
-                member.read(ru, io_obj)
+                member = self.member.copy(self.changes)
+                if fields is None:
+                    member.read(ru, io_obj)
+                else:
+                    member.read(ru, io_obj, fields)
                 self.value.append(member)
 
+    def skip(self, ru, io_obj):
+        "Skip the array values on I/O."
+        if self.size is None:
+            io_obj.read()
+            return
+        size = self._get_read_size(ru)
+        member_size = self.member.get_fixed_size()
+        if member_size is not None:
+            _skip_bytes(io_obj, size * member_size, self.name)
+        else:
+            for i in range(size):
+                self.member.skip(ru, io_obj)
+
+    def _read_block(self, ru, io_obj):
+        "Read the bytes of all the fixed-size members."
+        member_size = self.member.get_fixed_size()
+        if self.size is None:
+            data = io_obj.read()
+            if len(data) % member_size != 0:
+                raise RuntimeError("unexpected EOF at %s" % self.member.name)
+        else:
+            length = self._get_read_size(ru) * member_size
+            data = io_obj.read(length)
+            if len(data) != length:
+                raise RuntimeError("unexpected EOF at %s" % self.member.name)
+        return data
+
+    def _get_read_size(self, ru):
+        "Return the array size to read."
+        if type(self.size) is int:
+            return self.size
+        return ru._get_array_size(self.size)
+
     def write(self, ru, io_obj):
         "Write the array values to I/O."
         if self.size is not None:
             if type(self.size) is int:
                 size = self.size
-                if size != len(self.value):
+                if size != len(self):
                     raise RuntimeError("%s array size %s expected %s" %
-                                       (self.name, len(self.value), size))
+                                       (self.name, len(self), size))
             else:
                 size = ru._get_array_size(self.size)
-                if size != len(self.value):
+                if size != len(self):
                     raise RuntimeError("%s array size %s expected %s %s" %
-                                       (self.name, len(self.value),
+                                       (self.name, len(self),
                                         self.size, size))
+        self._write_values(ru, io_obj)
 
+    def _write_values(self, ru, io_obj):
+        "Write the array values to I/O without the size check."
+        if self.ndarray is not None:
+            io_obj.write(self.ndarray.astype(self.get_dtype(),
+                                             copy = False).tobytes())
+            return
+        if self.columns is not None:
+            struct_obj = self._get_row_struct()
+            columns = [self.columns[member.name]
+                       for member in self.member.members]
+            io_obj.write(b"".join(struct_obj.pack(*row)
+                                  for row in zip(*columns)))
+            return
         for v in self.value:
             v.write(ru, io_obj)
 
@@ -785,21 +1821,27 @@ DATETIME_SECOND_KEYS = ("sec", "second")
 class StructType(Type):
     """
     RU Struct type.
+    The index of the members by name is shared by the copies.
     """
+    __slots__ = ("members", "_index")
+
     def __init__(self, name, members = []):
         "Initialize this instance."
         super(StructType, self).__init__(name, "Struct")
         self.members = []
-        self.member_by_name = {}
+        self._index = {}
         for member in members:
-            if member in self.member_by_name:
-                raise RuntimeError("duplicate member %s" % member.name)
+            self._index[member.name] = len(self.members)
             self.members.append(member)
-            self.member_by_name[member.name] = member
+
+    @property
+    def member_by_name(self):
+        "The members by name."
+        return {name : self.members[i] for name, i in self._index.items()}
 
     def __contains__(self, item):
         "Contains for in."
-        return item in self.member_by_name
+        return item in self._index
 
     def __len__(self):
         "Return the length."
@@ -813,9 +1855,9 @@ class StructType(Type):
         "Get the item value."
         if not type(key) is str:
             raise TypeError("key is not str")
-        if not key in self.member_by_name:
+        if not key in self._index:
             raise KeyError("no %s" % key)
-        obj = self.member_by_name[key]
+        obj = self._get_member(key)
         if obj.is_array() or obj.is_struct():
             return obj
         else:
@@ -825,19 +1867,25 @@ class StructType(Type):
         "Set the item value."
         if not type(key) is str:
             raise TypeError("key is not str")
-        if not key in self.member_by_name:
+        if not key in self._index:
             raise KeyError("no key %s" % key)
-        obj = self.member_by_name[key]
+        obj = self._get_member(key)
         if obj.is_array() or obj.is_struct():
             raise RuntimeError("Array or Struct type assignment not supported")
         obj.set_value(value)
 
-    def copy(self):
-        "Copy this struct instance."
-        members = []
-        for member in self.members:
-            members.append(member.copy())
-        return StructType(self.name, members)
+    def copy(self, changes = None):
+        "Copy this struct instance, see Type.copy()."
+        if changes is None:
+            changes = self.changes
+        obj = StructType.__new__(StructType)
+        obj.schema = self.schema
+        obj.value = None
+        obj.dirty = False
+        obj.changes = changes
+        obj.members = [member.copy(changes) for member in self.members]
+        obj._index = self._index
+        return obj
 
     def get_name_type(self):
         "Return the name and type."
@@ -859,14 +1907,14 @@ class StructType(Type):
         "Return the reference."
         if not type(key) is str:
             raise TypeError("key is not str")
-        if not key in self.member_by_name:
+        if not key in self._index:
             raise KeyError("no %s" % key)
-        obj = self.member_by_name[key]
+        obj = self._get_member(key)
         return obj
         
     def has_member(self, name):
         "Has member ?"
-        if name in self.member_by_name:
+        if name in self._index:
             return True
         else:
             return False
@@ -875,9 +1923,13 @@ class StructType(Type):
         "Is struct type ?"
         return True
 
+    def _get_member(self, name):
+        "Return the member by name."
+        return self.members[self._index[name]]
+
     def keys(self):
         "Return the struct member's name."
-        return self.member_by_name.keys()
+        return self._index.keys()
 
     def is_time(self):
         "Is time struct ?"
@@ -886,12 +1938,12 @@ class StructType(Type):
         for member in self.members:
             if member.name != "" and not member.name in keys:
                 return False
-        if not "year" in self.member_by_name:
+        if not "year" in self._index:
             return False
-        if not "mon" in self.member_by_name and \
-                not "month" in self.member_by_name:
+        if not "mon" in self._index and \
+                not "month" in self._index:
             return False
-        if not "day" in self.member_by_name:
+        if not "day" in self._index:
             return False
         return True
 
@@ -922,7 +1974,7 @@ class StructType(Type):
         return default
 
     def _get_value(self, key):
-        return self.member_by_name[key].get_value()
+        return self._get_member(key).get_value()
 
     def set_time(self, value):
         "Set the time."
@@ -941,14 +1993,59 @@ class StructType(Type):
                 return self._set_value(key, value)
 
     def _set_value(self, key, value):
-        self.member_by_name[key].set_value(value)
+        self._get_member(key).set_value(value)
 
-    def read(self, ru, io_obj):
-        "Read the struct member's value from I/O."
+    def get_fixed_size(self):
+        "Return the size in bytes, or None if the size is variable."
+        size = 0
+        for member in self.members:
+            member_size = member.get_fixed_size()
+            if member_size is None:
+                return None
+            size += member_size
+        return size
+
+    def read(self, ru, io_obj, fields = None):
+        """
+        Read the struct member's value from I/O.
+        fields is the member's selection made by RU.load, the members not
+        in it are skipped and keep their initial value.
+        """
+        members = self.members
+        if self.name != "/":
+            ru._enter_struct()
+        elif fields is not None:
+            # The members after the last selected one are not read at all
+            # on the root, its end is not needed by the following members.
+            last = -1
+            for i in range(len(members)):
+                if members[i].name in fields:
+                    last = i
+            members = members[0:last + 1]
+        for member in members:
+            if fields is None:
+                member.read(ru, io_obj)
+            elif member.name in fields:
+                selection = fields[member.name]
+                if selection is True:
+                    member.read(ru, io_obj)
+                else:
+                    member.read(ru, io_obj, selection)
+            else:
+                member.skip(ru, io_obj)
+        if self.name != "/":
+            ru._leave_struct()
+
+    def skip(self, ru, io_obj):
+        "Skip the struct member's value on I/O."
+        size = self.get_fixed_size()
+        if size is not None:
+            _skip_bytes(io_obj, size, self.name)
+            return
         if self.name != "/":
             ru._enter_struct()
         for member in self.members:
-            member.read(ru, io_obj)
+            member.skip(ru, io_obj)
         if self.name != "/":
             ru._leave_struct()
 
@@ -958,14 +2055,229 @@ class StructType(Type):
             member.write(ru, io_obj)
 
 #
-# トークン定数
+# カラム形式で読み込んだArrayの行
 #
-TOK_ERROR	= -1
-TOK_END		= 0
-TOK_COLON	= 1
-TOK_COMMA	= 2
-TOK_LBRKT	= 3
-TOK_RBRKT	= 4
+class StructRow(object):
+    """
+    Row proxy of the array read as the columns.
+    It has the read/write interface of StructType for the values.
+    """
+    __slots__ = ("array", "index")
+
+    def __init__(self, array, index):
+        "Initialize this instance."
+        self.array = array
+        self.index = index
+
+    def __contains__(self, item):
+        "Contains for in."
+        return item in self.array.columns
+
+    def __len__(self):
+        "Return the length."
+        return len(self.array.columns)
+
+    def __iter__(self):
+        "Return the iterator object of the member's copy."
+        return iter(self.to_struct())
+
+    def __getitem__(self, key):
+        "Get the item value."
+        if not type(key) is str:
+            raise TypeError("key is not str")
+        if not key in self.array.columns:
+            raise KeyError("no %s" % key)
+        return self.array._get_column_value(key, self.index)
+
+    def __setitem__(self, key, value):
+        "Set the item value."
+        if not type(key) is str:
+            raise TypeError("key is not str")
+        if not key in self.array.columns:
+            raise KeyError("no key %s" % key)
+        self.array._set_column_value(key, self.index, value)
+
+    @property
+    def name(self):
+        "The name."
+        return self.array.member.name
+
+    def get_name(self):
+        "Return the name."
+        return self.name
+
+    def has_member(self, name):
+        "Has member ?"
+        return name in self.array.columns
+
+    def is_array(self):
+        "Is array type ?"
+        return False
+
+    def is_scalar(self):
+        "Is scalar type ?"
+        return False
+
+    def is_string(self):
+        "Is string type ?"
+        return False
+
+    def is_struct(self):
+        "Is struct type ?"
+        return True
+
+    def is_time(self):
+        "Is time struct ?"
+        return self.array.member.is_time()
+
+    def get_time(self):
+        "Returns the value as `datetime`."
+        return self.to_struct().get_time()
+
+    def _get_time_tuple(self):
+        return self.to_struct()._get_time_tuple()
+
+    def copy(self):
+        "Return the copy of the struct with the values of this row."
+        return self.to_struct()
+
+    def keys(self):
+        "Return the struct member's name."
+        return self.array.columns.keys()
+
+    def to_struct(self):
+        "Return the copy of the struct with the values of this row."
+        return self.array._get_struct(self.index)
+
+#
+# numpy.ndarray に読み込んだ配列の要素
+#
+class ElementRef(object):
+    """
+    Element proxy of the array read into numpy.ndarray.
+    It has the read/write interface of the scalar types for the value, and
+    the array keeps its numpy.ndarray.
+    """
+    __slots__ = ("array", "index")
+
+    def __init__(self, array, index):
+        "Initialize this instance."
+        self.array = array
+        self.index = index
+
+    @property
+    def name(self):
+        "The name."
+        return self.array.member.name
+
+    @property
+    def value(self):
+        "The value."
+        return self.get_value()
+
+    @value.setter
+    def value(self, value):
+        self.set_value(value)
+
+    def copy(self):
+        "Return the copy of the member with the value of this element."
+        obj = self.array.member.copy(self.array.changes)
+        obj.value = self.get_value()
+        return obj
+
+    def get_name(self):
+        "Return the name."
+        return self.name
+
+    def get_name_type(self):
+        "Return the name and type string."
+        return self.array.member.get_name_type()
+
+    def get_type(self):
+        "Return the type."
+        return self.array.member.type
+
+    def get_size(self):
+        "Return the size."
+        return self.array.member.size
+
+    def get_value(self):
+        "Return the value."
+        return self.array[self.index]
+
+    def set_value(self, value):
+        "Set the value."
+        self.array[self.index] = value
+
+    def is_array(self):
+        "Is array type ?"
+        return False
+
+    def is_float(self):
+        "Is float type ?"
+        return self.array.member.is_float()
+
+    def is_integer(self):
+        "Is integer type ?"
+        return self.array.member.is_integer()
+
+    def is_scalar(self):
+        "Is scalar type ?"
+        return True
+
+    def is_string(self):
+        "Is string type ?"
+        return False
+
+    def is_struct(self):
+        "Is struct type ?"
+        return False
+
+#
+# RU 遅延読み込みStruct型
+#
+class LazyStructType(StructType):
+    """
+    RU root Struct type whose members are read at the first access.
+    """
+    __slots__ = ("_loader",)
+
+    def __init__(self, loader):
+        "Initialize this instance."
+        Type.__init__(self, "/", "Struct")
+        self._loader = loader
+
+    def __getattr__(self, name):
+        "Read the members at the first access."
+        if name != "members" and name != "_index":
+            raise AttributeError(name)
+        self.load()
+        return object.__getattribute__(self, name)
+
+    def is_loaded(self):
+        "Are the members already read ?"
+        return self._loader is None
+
+    def load(self):
+        "Read the members."
+        if self._loader is None:
+            return
+        root = self._loader()
+        self.members = root.members
+        self._index = root._index
+        # the members record their changes in the set of the loaded root
+        self.changes = root.changes
+        self._loader = None
+
+#
+# トークン定数
+#
+TOK_ERROR	= -1
+TOK_END		= 0
+TOK_COLON	= 1
+TOK_COMMA	= 2
+TOK_LBRKT	= 3
+TOK_RBRKT	= 4
 TOK_LCBRKT	= 5
 TOK_RCBRKT	= 6
 TOK_LT		= 7
@@ -975,28 +2287,19 @@ TOK_SYMBOL	= 10
 TOK_NUMBER	= 11
 
 #
-# 英字/数字/特殊文字
+# 特殊文字とトークンの正規表現
 #
-ALPHA_CHARS = (
-    "A", "B", "C", "D", "E", "F", "G", "H", "I", "J",
-    "K", "L", "M", "N", "O", "P", "Q", "R", "S", "T",
-    "U", "V", "W", "X", "Y", "Z",
-    "a", "b", "c", "d", "e", "f", "g", "h", "i", "j",
-    "k", "l", "m", "n", "o", "p", "q", "r", "s", "t",
-    "u", "v", "w", "x", "y", "z",
-    "_",
-)
-
-DIGIT_CHARS = (
-    "0", "1", "2", "3", "4", "5", "6", "7", "8", "9",
-)
-
 SPEC_CHARS = {
     ":" : TOK_COLON, "," : TOK_COMMA, "[" : TOK_LBRKT, "]" : TOK_RBRKT,
     "{" : TOK_LCBRKT, "}" : TOK_RCBRKT, "<" : TOK_LT, ">" : TOK_GT,
     "+" : TOK_PLUS,
 }
 
+# The blanks and a token: NUMBER, SYMBOL, special char, the other char (the
+# error) or the end.
+TOKEN_RE = re.compile(r"[ \t]*(?:([0-9]+)|([A-Za-z_][A-Za-z0-9_]*)|"
+                      r"([:,\[\]{}<>+])|(.)|\Z)", re.DOTALL)
+
 BUILTIN_SCALAR_TYPE = {
     "FLOAT32" : FLOAT32Type, "FLOAT64" : FLOAT64Type,
     "INT8" : INT8Type, "INT16" : INT16Type, "INT32" : INT32Type,
@@ -1032,14 +2335,16 @@ class FormatParser(object):
         self._ptr = 0
         self._token = None
         self._value = None
-        self._last_token = None
-        self._last_value = None
+        self._tokens = None
+        self._index = 0
         self._size_members = {}
 
     def parse(self, input_ = None):
         "Parse."
         if input_ is not None:
             self.init(input_)
+        self._tokens = self._tokenize()
+        self._index = 0
         members = self._parse_field_list()
         if members is None or self._token != TOK_END:
             left = self.input[0:self._ptr]
@@ -1049,108 +2354,128 @@ class FormatParser(object):
 
         return (root, self._size_members)
 
+    def _tokenize(self):
+        """
+        Split the input into the list of (token, value, end) by TOKEN_RE in
+        a pass, up to the end or the first error.
+        """
+        tokens = []
+        input_ = self.input
+        pos = 0
+        while True:
+            m = TOKEN_RE.match(input_, pos)
+            pos = m.end()
+            kind = m.lastindex
+            if kind == 1:
+                tokens.append((TOK_NUMBER, int(m.group(1)), pos))
+            elif kind == 2:
+                tokens.append((TOK_SYMBOL, m.group(2), pos))
+            elif kind == 3:
+                c = m.group(3)
+                tokens.append((SPEC_CHARS[c], c, pos))
+            elif kind == 4:
+                tokens.append((TOK_ERROR, None, pos))
+                return tokens
+            else:
+                tokens.append((TOK_END, None, pos))
+                return tokens
+
     def _parse_field_list(self):
         """
-        Parse the field_list.
+        Parse the field_list without the recursion.
         FIELD-LIST := NAME ':' TYPE { ',' NAME ':' TYPE }
+        The struct types being parsed are kept on the stack of (name,
+        members of the parent, array) and array is (name, size) of the
+        array type of the struct or None.
         """
-        if self.debug:
-            print("enter parse_field_list()")
+        stack = []
         first = True
         members = []
         while True:
             if not first:
                 tok = self._get_token()
                 if tok != TOK_COMMA:
-                    self._unget_token()
-                    break
+                    if len(stack) == 0:
+                        self._unget_token()
+                        break
+                    # the end of '[' FIELD-LIST ']'
+                    if tok != TOK_RBRKT:
+                        return None
+                    name, parent, array = stack.pop()
+                    node = StructType(name, members)
+                    if array is not None:
+                        node = ArrayType(array[0], array[1], node)
+                    parent.append(node)
+                    members = parent
+                    continue
             tok = self._get_token()
             if tok != TOK_SYMBOL:
-                if self.debug:
-                    print("leave parse_field_list() NG")
                 return None
             name = self._value
             tok = self._get_token()
             if tok != TOK_COLON:
-                if self.debug:
-                    print("leave parse_field_list() NG")
                 return None
             member = self._parse_type(name)
             if member is None:
-                if self.debug:
-                    print("leave parse_field_list() NG")
                 return None
+            if type(member) is tuple:
+                # '[' FIELD-LIST ']' of the struct
+                stack.append((member[0], members, member[1]))
+                members = []
+                first = True
+                continue
             members.append(member)
             first = False
-        if self.debug:
-            print("leave parse_field_list() OK")
 
         return members
 
-    def _parse_type(self, name, allow_array = True):
+    def _parse_type(self, name):
         """
         Parse the type.
         TYPE :=	'{' NUMBER | NAME '}' TYPE or
         	'+' TYPE or
                 '[' FIELD-LIST ']' or
                 BULTIN-TYPE
+        The TYPE of the array's member is not an array. Return (name,
+        array) at '[' to parse the FIELD-LIST by the caller, array is the
+        same as the stack of _parse_field_list().
         """
-        if self.debug:
-            print("enter parse_type()")
+        array = None
         tok = self._get_token()
-        if allow_array and tok == TOK_LCBRKT:
+        if tok == TOK_LCBRKT:
             # '{' NUMBER | NAME '}' TYPE
             tok = self._get_token()
             if tok != TOK_NUMBER and tok != TOK_SYMBOL:
-                if self.debug:
-                    print("leave parse_type() NG")
                 return None
             size_member = self._value
             if tok == TOK_SYMBOL:
                 self._size_members[size_member] = True
             tok = self._get_token()
             if tok != TOK_RCBRKT:
-                if self.debug:
-                    print("leave parse_type() NG")
                 return None
-            member = self._parse_type("", False)
-            if member is None:
-                if self.debug:
-                    print("leave parse_type() NG")
-                return None
-            node = ArrayType(name, size_member, member)
-        elif allow_array and tok == TOK_PLUS:
+            array = (name, size_member)
+            name = ""
+            tok = self._get_token()
+        elif tok == TOK_PLUS:
             # '+' TYPE
-            member = self._parse_type("", False)
-            node = ArrayType(name, None, member)
-        elif tok == TOK_LBRKT:
-            # '[' FIELD-LIST ']'
-            members = self._parse_field_list()
-            if members is None:
-                if self.debug:
-                    print("leave parse_type() NG")
-                return None
+            array = (name, None)
+            name = ""
             tok = self._get_token()
-            if tok != TOK_RBRKT:
-                if self.debug:
-                    print("leave parse_type() NG")
-                return None
-            node = StructType(name, members)
-        else:
-            self._unget_token()
-            node = self._parse_builtin_type(name)
-            if node is None:
-                if self.debug:
-                    print("leave parse_type() NG")
-                return None
+        if tok == TOK_LBRKT:
+            # '[' FIELD-LIST ']'
+            return (name, array)
+        self._unget_token()
+        node = self._parse_builtin_type(name)
+        if node is None:
+            return None
+        if array is not None:
+            node = ArrayType(array[0], array[1], node)
         return node
 
     def _parse_builtin_type(self, name):
         """
         Parse the builtin type.
         """
-        if self.debug:
-            print("enter parse_builtin_type()")
         node = None
         tok = self._get_token()
         if tok == TOK_SYMBOL:
@@ -1164,76 +2489,27 @@ class FormatParser(object):
             # <NUMBER>STRING-TYPE
             tok = self._get_token()
             if tok != TOK_NUMBER:
-                if self.debug:
-                    print("leave parse_builtin_type() NG")
                 return None
             size = self._value
             tok = self._get_token()
             if tok != TOK_GT:
-                if self.debug:
-                    print("leave parse_builtin_type() NG")
                 return None
             tok = self._get_token()
             if tok == TOK_SYMBOL and self._value in BUILTIN_NSTR_TYPE:
                 factory = BUILTIN_NSTR_TYPE[self._value]
                 node = factory(name, size)
 
-        if node is None:
-            if self.debug:
-                print("leave parse_builtin_type() NG")
-            return None
-        else:
-            if self.debug:
-                print("leave parse_builtin_type() OK")
-            return node
+        return node
 
     def _get_token(self):
         "Get a token."
-        if self._last_token is not None:
-            self._token = self._last_token
-            self._value = self._last_value
-            self._last_token = None
-            self._last_value = None
-        else:
-            while True:
-                c = self._getc()
-                if c is None:
-                    break
-                if c != " " and c != "\t":
-                    break
-            if c is None:
-                self._token = TOK_END
-                self._value = None
-            elif c in DIGIT_CHARS:
-                s = ""
-                while c in DIGIT_CHARS:
-                    s += c
-                    c = self._getc()
-                    if c is None:
-                        break
-                if c is not None:
-                    self._ungetc()
-                self._token = TOK_NUMBER
-                self._value = int(s)
-            elif c in ALPHA_CHARS:
-                s = c
-                while True:
-                    c = self._getc()
-                    if c is None:
-                        break
-                    if c not in ALPHA_CHARS and c not in DIGIT_CHARS:
-                        break
-                    s += c
-                if c is not None:
-                    self._ungetc()
-                self._token = TOK_SYMBOL
-                self._value = s
-            elif c in SPEC_CHARS:
-                self._token = SPEC_CHARS[c]
-                self._value = c
-            else:
-                self._token = TOK_ERROR
-                self._value = None
+        tokens = self._tokens
+        if self._index < len(tokens):
+            self._token, self._value, end = tokens[self._index]
+            # The error is reported at the end of the last token read.
+            if end > self._ptr:
+                self._ptr = end
+        self._index += 1
 
         if self.debug:
             print("get token %d:%s" % (self._token, self._value))
@@ -1242,26 +2518,756 @@ class FormatParser(object):
 
     def _unget_token(self):
         "Unget a token."
-        if self.debug and self._last_token is not None:
-            print("overwrite last token %d:%s" % (self._last_token,
-                                                  self._last_value))
-        self._last_token = self._token
-        self._last_value = self._value
+        self._index -= 1
         if self.debug:
             print("unget token %d:%s" % (self._token, self._value))
 
-    def _getc(self):
-        "Get a character."
-        if self._ptr >= len(self.input):
+#
+# デコードプランの命令
+#
+OP_FIXED	= 0
+OP_STR		= 1
+OP_STRUCT	= 2
+OP_ARRAY	= 3
+OP_SKIP		= 4
+
+ELEM_FIXED		= 0
+ELEM_STR		= 1
+ELEM_FIXED_STRUCT	= 2
+ELEM_STRUCT		= 3
+ELEM_NSTR		= 4
+
+#
+# 固定長メンバーの値の種類
+#
+VALUE_PLAIN	= 0
+VALUE_SIZE	= 1
+# The size member not requested by fields, it keeps its initial value.
+VALUE_SKIPPED_SIZE	= 2
+
+#
+# コンパイル済みデコードプラン
+#
+class DecodePlan(object):
+    """
+    Decode plan compiled from the format tree made by FormatParser.
+    The runs of the fixed-size members are merged into one struct.Struct and
+    unpacked at once, the dynamic sizes ({name} arrays, '+' arrays and NUL
+    terminated strings) are handled as explicit steps.
+    The fixed-size strings in the runs are decoded from the slices of the
+    body's memoryview at their offsets.
+    """
+    def __init__(self, root, size_members, fields = None):
+        """
+        Initialize this instance.
+        size_members is the size member's names made by FormatParser and
+        fields is the member's selection made by RU._select_fields.
+        """
+        self.size_members = size_members
+        self.steps = self._compile_struct(root, fields)
+
+    def decode(self, ru, root, reader):
+        "Decode the body on the BodyReader into the root."
+        _decode_struct(self.steps, ru, root, reader, ru.encoding_cache)
+
+    def _compile_struct(self, obj, fields):
+        "Compile the struct's members into steps."
+        steps = []
+        run = ([], [], [])
+        for i in range(len(obj.members)):
+            member = obj.members[i]
+            skipped = fields is not None and member.name not in fields
+            selection = None
+            if skipped:
+                # The struct is skipped by reading only its size members.
+                selection = {}
+            elif fields is not None and fields[member.name] is not True:
+                selection = fields[member.name]
+            fixed_size = member.get_fixed_size()
+            if skipped and fixed_size is not None and \
+                    not self._has_size_member(member):
+                if fixed_size > 0:
+                    run[0].append("%dx" % fixed_size)
+                continue
+            if member.is_struct():
+                sub_steps = self._compile_struct(member, selection)
+                if self._is_flat(sub_steps):
+                    # Merge into this run with the member's path.
+                    offset = self._get_run_size(run)
+                    run[0].append(sub_steps[0][1].format[1:])
+                    for path, kind in sub_steps[0][2]:
+                        run[1].append(((i,) + path, kind))
+                    for path, start, size in sub_steps[0][3]:
+                        run[2].append(((i,) + path, offset + start, size))
+                    continue
+                self._flush(steps, run)
+                steps.append((OP_STRUCT, i, sub_steps,
+                              self._sets_size(sub_steps)))
+            elif member.is_array():
+                self._flush(steps, run)
+                if skipped:
+                    steps.append((OP_SKIP, i))
+                else:
+                    element = self._compile_element(member.member, selection)
+                    steps.append((OP_ARRAY, i, member.size, element))
+            elif fixed_size is None:
+                # NUL terminated string
+                self._flush(steps, run)
+                steps.append((OP_SKIP if skipped else OP_STR, i))
+            elif member.is_string():
+                run[2].append(((i,), self._get_run_size(run), fixed_size))
+                run[0].append("%dx" % fixed_size)
+            elif skipped:
+                # The array size is needed even if the member is not requested.
+                run[0].append(member.format.lstrip("!"))
+                run[1].append(((i,), VALUE_SKIPPED_SIZE))
+            else:
+                run[0].append(member.format.lstrip("!"))
+                run[1].append(((i,), self._get_kind(member)))
+        self._flush(steps, run)
+
+        return steps
+
+    def _compile_element(self, member, fields):
+        "Compile the array's member."
+        if member.is_struct():
+            steps = self._compile_struct(member, fields)
+            if self._is_flat(steps):
+                return (ELEM_FIXED_STRUCT, steps[0][1], steps[0][2],
+                        steps[0][3])
+            return (ELEM_STRUCT, steps, self._sets_size(steps))
+        if member.get_fixed_size() is None:
+            return (ELEM_STR,)
+        if member.is_string():
+            return (ELEM_NSTR, member.size)
+        return (ELEM_FIXED, struct.Struct("!" + member.format.lstrip("!")))
+
+    def _flush(self, steps, run):
+        "Flush the run of the fixed-size members as a step."
+        codes, targets, strings = run
+        if len(codes) == 0:
+            return
+        steps.append((OP_FIXED, struct.Struct("!" + "".join(codes)),
+                      tuple(targets), tuple(strings)))
+        del codes[:]
+        del targets[:]
+        del strings[:]
+
+    def _get_run_size(self, run):
+        "Return the size of the run in bytes."
+        return struct.calcsize("!" + "".join(run[0]))
+
+    def _get_kind(self, member):
+        "Return the kind of the fixed-size member's value."
+        if member.is_integer() and member.name in self.size_members:
+            return VALUE_SIZE
+        return VALUE_PLAIN
+
+    def _sets_size(self, steps):
+        """
+        Do the steps set the size member directly ?
+        The struct's scope of the size members is entered only if so, the
+        scope of the struct setting nothing is the same as its parent's.
+        """
+        for step in steps:
+            if step[0] == OP_FIXED:
+                for path, kind in step[2]:
+                    if kind != VALUE_PLAIN:
+                        return True
+        return False
+
+    def _has_size_member(self, obj):
+        "Has the integer size member ?"
+        if obj.is_struct():
+            for member in obj.members:
+                if self._has_size_member(member):
+                    return True
+            return False
+        return obj.is_integer() and obj.name in self.size_members
+
+    def get_fixed_prefix(self):
+        """
+        Return the first step if every selected member is in its run of the
+        fixed-size members (the following steps only skip), otherwise None.
+        """
+        if len(self.steps) == 0 or self.steps[0][0] != OP_FIXED:
             return None
-        c = self.input[self._ptr]
-        self._ptr += 1
-        return c
+        for step in self.steps[1:]:
+            if step[0] != OP_SKIP:
+                return None
+        return self.steps[0]
 
-    def _ungetc(self):
-        "Unget a character."
-        if self._ptr > 0:
-            self._ptr -= 1
+    def _is_flat(self, steps):
+        "Are the steps only one run of the values without size member ?"
+        if len(steps) != 1 or steps[0][0] != OP_FIXED:
+            return False
+        for path, kind in steps[0][2]:
+            if kind != VALUE_PLAIN:
+                return False
+        return True
+
+def _get_member(obj, path):
+    "Return the member by the path of the indexes."
+    if len(path) == 1:
+        return obj.members[path[0]]
+    for i in path:
+        obj = obj.members[i]
+    return obj
+
+def _decode_string(member, data, ru, encodings):
+    "Decode the string member's bytes."
+    encoding = encodings.get(member.type)
+    if encoding is None:
+        encoding = member.get_encoding(ru, True)
+        encodings[member.type] = encoding
+    if encoding[0] == "bytes":
+        return bytes(data)
+    return str(data, encoding[0], encoding[1])
+
+def _set_values(obj, targets, values, ru):
+    "Set the unpacked values to the members."
+    for (path, kind), value in zip(targets, values):
+        member = _get_member(obj, path)
+        if kind == VALUE_SKIPPED_SIZE:
+            ru._set_array_size(member.name, value)
+            continue
+        if kind == VALUE_SIZE:
+            ru._set_array_size(member.name, value)
+        member.value = value
+
+def _set_strings(obj, strings, view, offset, ru, encodings):
+    "Set the fixed-size strings at the offset of the view to the members."
+    for path, start, size in strings:
+        member = _get_member(obj, path)
+        start += offset
+        member.value = _decode_string(member, view[start:start + size], ru,
+                                      encodings)
+
+def _decode_struct(steps, ru, obj, reader, encodings):
+    "Decode the struct's members by the steps."
+    members = obj.members
+    for step in steps:
+        op = step[0]
+        if op == OP_FIXED:
+            if step[3]:
+                data = reader.read_view(step[1].size, obj.name)
+                _set_values(obj, step[2], step[1].unpack_from(data), ru)
+                _set_strings(obj, step[3], data, 0, ru, encodings)
+            else:
+                _set_values(obj, step[2], reader.unpack(step[1]), ru)
+        elif op == OP_STR:
+            member = members[step[1]]
+            data = reader.read_cstring(member.name)
+            member.value = _decode_string(member, data, ru, encodings)
+        elif op == OP_STRUCT:
+            if step[3]:
+                ru._enter_struct()
+                _decode_struct(step[2], ru, members[step[1]], reader,
+                               encodings)
+                ru._leave_struct()
+            else:
+                _decode_struct(step[2], ru, members[step[1]], reader,
+                               encodings)
+        elif op == OP_ARRAY:
+            array = members[step[1]]
+            size = step[2]
+            if size is not None and type(size) is not int:
+                size = ru._get_array_size(size)
+            _decode_array(array, size, step[3], ru, reader, encodings)
+        else:
+            members[step[1]].skip(ru, reader)
+
+def _read_elements(reader, size, member_size, name):
+    "Return the view of the fixed-size elements and the number of them."
+    if size is None:
+        # unlimit array size for '+'
+        size, rest = divmod(reader.remaining(), member_size)
+        if rest != 0:
+            raise RuntimeError("unexpected EOF at %s" % name)
+    return reader.read_view(size * member_size, name), size
+
+def _decode_array(array, size, element, ru, reader, encodings):
+    "Decode the array's members by the element plan."
+    template = array.member
+    changes = array.changes
+    values = []
+    kind = element[0]
+    if ru.columnar and array.is_columnar():
+        data, size = _read_elements(reader, size, template.get_fixed_size(),
+                                    template.name)
+        numpy = None
+        if ru.use_numpy:
+            numpy = _import_numpy()
+        array._set_columns(data, numpy)
+        return
+    if kind == ELEM_FIXED:
+        struct_obj = element[1]
+        data, size = _read_elements(reader, size, struct_obj.size,
+                                    template.name)
+        if ru.use_numpy and _import_numpy() is not None:
+            array._set_ndarray(_import_numpy().frombuffer(data,
+                                                         array.get_dtype()))
+            return
+        for (value,) in struct_obj.iter_unpack(data):
+            member = template.copy(changes)
+            member.value = value
+            values.append(member)
+    elif kind == ELEM_NSTR:
+        member_size = element[1]
+        data, size = _read_elements(reader, size, member_size, template.name)
+        for offset in range(0, size * member_size, member_size):
+            member = template.copy(changes)
+            member.value = _decode_string(
+                member, data[offset:offset + member_size], ru, encodings)
+            values.append(member)
+    elif kind == ELEM_FIXED_STRUCT:
+        struct_obj, targets, strings = element[1:]
+        data, size = _read_elements(reader, size, struct_obj.size,
+                                    template.name)
+        offset = 0
+        for unpacked in struct_obj.iter_unpack(data):
+            member = template.copy(changes)
+            _set_values(member, targets, unpacked, ru)
+            if strings:
+                _set_strings(member, strings, data, offset, ru, encodings)
+            values.append(member)
+            offset += struct_obj.size
+    else:
+        i = 0
+        while (size is None and reader.remaining() > 0) or \
+                (size is not None and i < size):
+            member = template.copy(changes)
+            if kind == ELEM_STR:
+                data = reader.read_cstring(member.name)
+                member.value = _decode_string(member, data, ru, encodings)
+            elif element[2]:
+                ru._enter_struct()
+                _decode_struct(element[1], ru, member, reader, encodings)
+                ru._leave_struct()
+            else:
+                _decode_struct(element[1], ru, member, reader, encodings)
+            values.append(member)
+            i += 1
+    array.value = values
+
+#
+# フォーマット文字列のキャッシュ
+#
+FORMAT_CACHE_SIZE	= 64
+
+@functools.lru_cache(maxsize = FORMAT_CACHE_SIZE)
+def _parse_format(format_):
+    "Parse the format string. The result is shared, don't change it."
+    return FormatParser().parse(format_)
+
+@functools.lru_cache(maxsize = FORMAT_CACHE_SIZE)
+def _compile_format(format_, fields):
+    "Compile the decode plan for the format string and the fields."
+    root, size_members = _parse_format(format_)
+    selection = None
+    if fields is not None:
+        selection = RU._select_fields(root, fields)
+    return DecodePlan(root, size_members, selection)
+
+def parse_format(format_):
+    """
+    Parse the format string with the process wide cache.
+    Return a fresh root and the size member's names as FormatParser.parse.
+    """
+    root, size_members = _parse_format(format_)
+    return (root.copy(set()), dict(size_members))
+
+def compile_format(format_, fields = None):
+    "Return the cached DecodePlan for the format string and the fields."
+    if fields is not None:
+        fields = frozenset(fields)
+    return _compile_format(format_, fields)
+
+def format_cache_info():
+    """
+    Return the hits, misses, maxsize and currsize of the format caches as
+    {"format": ..., "plan": ...}.
+    """
+    return {
+        "format" : _parse_format.cache_info(),
+        "plan" : _compile_format.cache_info(),
+    }
+
+def format_cache_clear():
+    "Clear the format caches."
+    _compile_format.cache_clear()
+    _parse_format.cache_clear()
+
+#
+# 複数の RU の一括読み込み結果
+#
+class BulkResult(object):
+    """
+    Members of the Reusables of one format by column, made by RU.load_many.
+    columns maps the dotted path of the member to the values of all the
+    Reusables: numpy.ndarray (or array.array without RU.use_numpy or numpy)
+    for INT/UINT/FLOAT, and the list for strings and arrays (numpy.ndarray
+    or the list of the values per Reusable). indexes are the positions of the Reusables in
+    the inputs of RU.load_many and headers are their headers.
+    """
+    def __init__(self, ru, format_, fields = None):
+        "Initialize this instance."
+        self.format = format_
+        self.indexes = []
+        self.headers = []
+        self.columns = collections.OrderedDict()
+        self._template, self._size_members = parse_format(format_)
+        self._selection = None
+        if fields is not None:
+            self._selection = RU._select_fields(self._template, fields)
+        self._leaves = _get_leaves(self._template, self._selection)
+        self.names = [name for name, path, member in self._leaves]
+        self._plan = None
+        self._prefix = None
+        if ru.compiled:
+            self._plan = compile_format(format_, fields)
+            self._prefix = self._plan.get_fixed_prefix()
+        self._chunks = []
+        self._values = [[] for leaf in self._leaves]
+
+    def __len__(self):
+        "Return the number of the Reusables."
+        return len(self.indexes)
+
+    def __getstate__(self):
+        """
+        Return the state to pickle, the columns of numpy.ndarray per
+        Reusable are packed into one buffer and the offsets.
+        """
+        state = self.__dict__.copy()
+        numpy = _import_numpy()
+        if numpy is None:
+            return state
+        columns = collections.OrderedDict()
+        for name, column in self.columns.items():
+            if type(column) is list and len(column) > 0 and \
+                    all([isinstance(c, numpy.ndarray) and c.ndim == 1 and
+                         c.dtype == column[0].dtype for c in column]):
+                column = (numpy.concatenate(column),
+                          numpy.cumsum([len(c) for c in column]))
+            columns[name] = column
+        state["columns"] = columns
+        return state
+
+    def __setstate__(self, state):
+        "Restore the state made by __getstate__."
+        self.__dict__.update(state)
+        numpy = _import_numpy()
+        for name, column in self.columns.items():
+            if type(column) is tuple:
+                self.columns[name] = numpy.split(column[0], column[1][:-1])
+
+    def to_pandas(self):
+        "Return the columns as pandas.DataFrame."
+        try:
+            import pandas
+        except ImportError:
+            raise RuntimeError("to_pandas needs pandas module")
+        return pandas.DataFrame(self.columns, columns = self.names)
+
+    def to_arrow(self):
+        "Return the columns as pyarrow.Table."
+        try:
+            import pyarrow
+        except ImportError:
+            raise RuntimeError("to_arrow needs pyarrow module")
+        return pyarrow.table(collections.OrderedDict(
+            [(name, list(self.columns[name])
+              if type(self.columns[name]) is array.array
+              else self.columns[name]) for name in self.names]))
+
+    def _add(self, ru, index, header, body):
+        "Add the body of the Reusable."
+        if self._prefix is not None:
+            # only the fixed-size part is kept and unpacked by _finish()
+            size = self._prefix[1].size
+            if len(body) < size:
+                raise RuntimeError("unexpected EOF")
+            self._chunks.append(bytes(body[0:size]))
+            self.indexes.append(index)
+            self.headers.append(header)
+            return
+        root = self._template.copy(set())
+        ru._init_size_members(self._size_members)
+        if self._plan is not None:
+            self._plan.decode(ru, root, BodyReader(body))
+        else:
+            root.read(ru, BodyReader(body), self._selection)
+        values = [_get_python_value(_get_member(root, leaf[1]))
+                  for leaf in self._leaves]
+        for i in range(len(values)):
+            self._values[i].append(values[i])
+        self.indexes.append(index)
+        self.headers.append(header)
+
+    def _finish(self, ru):
+        "Make the columns of the Reusables added."
+        if self._prefix is not None:
+            self._unpack_prefix(ru)
+        numpy = None
+        if ru.use_numpy:
+            numpy = _import_numpy()
+        for i in range(len(self._leaves)):
+            name, path, member = self._leaves[i]
+            values = self._values[i]
+            format_ = member.format
+            if member.is_scalar() and format_ in NUMPY_DTYPES:
+                if numpy is not None:
+                    dtype = numpy.dtype(NUMPY_DTYPES[format_])
+                    values = numpy.array(values, dtype.newbyteorder("="))
+                else:
+                    values = array.array(ARRAY_TYPECODES[format_], values)
+            elif not type(values) is list:
+                values = list(values)
+            self.columns[name] = values
+        # Only the columns are kept, so that the result is passed between
+        # the processes without the format tree.
+        self._template = None
+        self._selection = None
+        self._leaves = None
+        self._plan = None
+        self._prefix = None
+        self._values = None
+        return self
+
+    def _extend(self, others):
+        "Append the Reusables of the other results of the same format."
+        numpy = _import_numpy()
+        for other in others:
+            self.indexes.extend(other.indexes)
+            self.headers.extend(other.headers)
+        for name in self.names:
+            columns = [self.columns[name]] + \
+                [other.columns[name] for other in others]
+            column = columns[0]
+            if numpy is not None and isinstance(column, numpy.ndarray):
+                self.columns[name] = numpy.concatenate(columns)
+            else:
+                for other_column in columns[1:]:
+                    column.extend(other_column)
+        return self
+
+    def _unpack_prefix(self, ru):
+        "Unpack the fixed-size part of all the bodies at once."
+        step = self._prefix
+        size = step[1].size
+        data = b"".join(self._chunks)
+        self._chunks = None
+        count = len(self.indexes)
+        values = {}
+        if len(step[2]) > 0 and count > 0:
+            unpacked = list(zip(*step[1].iter_unpack(data)))
+            for i in range(len(step[2])):
+                values[step[2][i][0]] = unpacked[i]
+        strings = {}
+        for path, start, string_size in step[3]:
+            strings[path] = start, string_size
+        for i in range(len(self._leaves)):
+            name, path, member = self._leaves[i]
+            if path in strings:
+                start, string_size = strings[path]
+                encoding, errors = member._get_encoding(ru)
+                column = []
+                for offset in range(start, size * count, size):
+                    s = data[offset:offset + string_size]
+                    if encoding == "bytes":
+                        column.append(s)
+                    else:
+                        column.append(str(s, encoding, errors))
+                self._values[i] = column
+            else:
+                self._values[i] = values.get(path, ())
+
+def _get_python_value(obj):
+    """
+    Return the member's value as the python objects, numpy.ndarray of the
+    arrays are converted to the native byte order.
+    """
+    if obj.is_struct():
+        return dict([(m.name, _get_python_value(m)) for m in obj.members])
+    if obj.is_array():
+        if obj.get_ndarray() is not None:
+            return _to_native(obj.get_ndarray())
+        if obj.columns is not None:
+            return dict([(name, _to_native(column))
+                         for name, column in obj.columns.items()])
+        return [_get_python_value(m) for m in obj.value]
+    return obj.get_value()
+
+def _to_native(column):
+    "Return numpy.ndarray in the native byte order, or column as is."
+    dtype = getattr(column, "dtype", None)
+    if dtype is None or dtype.isnative:
+        return column
+    return column.astype(dtype.newbyteorder("="))
+
+def _get_leaves(obj, selection, path = (), prefix = ""):
+    """
+    Return the list of (dotted path, path of the indexes, member) of the
+    selected scalar, string and array members under the struct.
+    """
+    leaves = []
+    for i in range(len(obj.members)):
+        member = obj.members[i]
+        if selection is not None and member.name not in selection:
+            continue
+        sub = None
+        if selection is not None and selection[member.name] is not True:
+            sub = selection[member.name]
+        name = prefix + member.name
+        if member.is_struct():
+            leaves.extend(_get_leaves(member, sub, path + (i,), name + "."))
+        else:
+            leaves.append((name, path + (i,), member))
+    return leaves
+
+#
+# 変更されたメンバーのボディへの書き戻し
+#
+class BodyPatcher(object):
+    """
+    Patcher of the changed members on the body kept by RU.load for RU.save.
+    The members are walked on the body to know their offsets, but the
+    subtrees without the schemas changed since the load or the last save
+    (see Type.changes) are skipped over on the body by Type.skip(), and the
+    members after the last changed one are not walked at all. The sizes of
+    the arrays skipped are read from the body, so the tree may have only
+    the members selected by RU.load(fields = ...).
+    """
+    def __init__(self, ru, data, start, end, schemas):
+        "Initialize this instance."
+        self.ru = ru
+        self.data = data
+        self.start = start
+        self.end = end
+        self.reader = BodyReader(data, start, end)
+        self.schemas = schemas
+        self.patches = []
+        self.changed = []
+        self._arrays = {}
+
+    def patch(self, root):
+        """
+        Collect the patches of the changed members in root and return False
+        if the body must be encoded whole.
+        """
+        members = root.members
+        last = -1
+        for i in range(len(members)):
+            if self._has_changes(members[i]):
+                last = i
+        ru = self.ru
+        ru._init_size_members(ru.size_members)
+        try:
+            for member in members[0:last + 1]:
+                if not self._walk(member):
+                    return False
+        finally:
+            ru._init_size_members(ru.size_members)
+        return True
+
+    def get_body(self):
+        """
+        Return the copy of the body with the patches, or None if no patch
+        (the changes were on the other Reusables).
+        """
+        if len(self.patches) == 0:
+            return None
+        body = bytearray(memoryview(self.data)[self.start:self.end])
+        for offset, patch in self.patches:
+            offset -= self.start
+            body[offset:offset + len(patch)] = patch
+        for obj in self.changed:
+            obj.dirty = False
+        return body
+
+    def _has_changes(self, obj):
+        "May obj have the changed members ?"
+        if obj.is_struct():
+            for member in obj.members:
+                if self._has_changes(member):
+                    return True
+            return False
+        if obj.is_array():
+            # The member is the template shared by the copies of the array.
+            key = id(obj.member)
+            if not key in self._arrays:
+                self._arrays[key] = id(obj.schema) in self.schemas or \
+                    self._has_changes(obj.member)
+            return self._arrays[key]
+        return id(obj.schema) in self.schemas
+
+    def _walk(self, obj):
+        """
+        Append the patches of the changed members in obj and return False if
+        the body must be encoded whole.
+        """
+        reader = self.reader
+        if not self._has_changes(obj):
+            obj.skip(self.ru, reader)
+            return True
+        if obj.is_struct():
+            self.ru._enter_struct()
+            for member in obj.members:
+                if not self._walk(member):
+                    return False
+            self.ru._leave_struct()
+            return True
+        if obj.dirty:
+            self.changed.append(obj)
+        if obj.is_array():
+            return self._walk_array(obj)
+        start = reader.pos
+        if obj.is_string():
+            if obj.size is None:
+                reader.read_cstring(obj.name)
+            else:
+                reader.skip(obj.size, obj.name)
+            if obj.dirty:
+                data = obj._encode(self.ru)
+                if len(data) != reader.pos - start:
+                    # the length of STR is changed
+                    return False
+                self.patches.append((start, data))
+            return True
+        if obj.is_integer() and obj.name in self.ru.size_members:
+            if obj.dirty:
+                return False
+            # the size of the arrays skipped after it
+            obj.skip(self.ru, reader)
+            return True
+        reader.skip(obj.size, obj.name)
+        if obj.dirty:
+            self.patches.append((start, struct.pack(obj.format, obj.value)))
+        return True
+
+    def _walk_array(self, array):
+        "_walk() of the array."
+        if array.dirty == DIRTY_RESIZE:
+            return False
+        if not array.dirty and array.ndarray is None and \
+                array.columns is None:
+            for member in array.value:
+                if not self._walk(member):
+                    return False
+            return True
+        # The values of numpy.ndarray or the columns of the fixed size.
+        member_size = array.member.get_fixed_size()
+        if member_size is None:
+            return False
+        start = self.reader.pos
+        self.reader.skip(len(array) * member_size, array.name)
+        if array.dirty:
+            self.changed.extend(array.value)
+            data = io.BytesIO()
+            array._write_values(self.ru, data)
+            self.patches.append((start, data.getvalue()))
+        return True
 
 #
 # RUクラス
@@ -1280,6 +3286,20 @@ class RU(object):
         header = ru.get_header()
         root = ru.get_root()
         ...
+    for read from the local file (memory-mapped):
+        ru = RU.RU()
+        root = ru.load_path("filename")
+        ...
+    for header only:
+        ru = RU.RU()
+        header = ru.load_header(fp)
+        ...
+    for update (only the changed members are encoded by save):
+        ru = RU.RU()
+        ru.keep_source = True
+        root = ru.load(fp)
+        root["edition"] = 1
+        ru.save(out)
     for write:
         header = RU.Header()
         ...
@@ -1298,6 +3318,24 @@ class RU(object):
         self.root = None
         self.encoding = { "STR" : "euc_jp" }
         self.encoding_errors = { }
+        # The (encoding, errors) resolved per string type, see set_encoding()
+        self.encoding_cache = { }
+        # Decode the body by the DecodePlan instead of Type.read()
+        self.compiled = True
+        # Read the arrays of INT/UINT/FLOAT into numpy.ndarray if numpy is
+        # available, the elements are ElementRef instead of the Type's copy
+        self.use_numpy = False
+        # Read the arrays of the struct of INT/UINT/FLOAT into the columns
+        self.columnar = False
+        # Keep the body in memory read by load() for the incremental save()
+        self.keep_source = False
+        # (data, start, end) of the body kept, see save()
+        self.source = None
+        # The fields given to load(), the other members aren't in the root
+        self.fields = None
+        # The recorder timing the stages of load() by stage(name) returning
+        # the context manager (e.g. metrics.Recorder), or None
+        self.recorder = None
         if header is not None:
             self.create(header)
 
@@ -1313,12 +3351,10 @@ class RU(object):
         "Create the Reusable."
         if header is not None:
             self.header = header
-        parser = FormatParser()
-        self.root, size_members = parser.parse(self.header.format)
-        self.level = 0
-        self.size_members = {}
-        for name in size_members.keys():
-            self.size_members[name] = {}
+        self.root, size_members = parse_format(self.header.format)
+        self.source = None
+        self.fields = None
+        self._init_size_members(size_members)
 
         return self.root
 
@@ -1366,70 +3402,346 @@ class RU(object):
             self.encoding_errors[native_str_type] = errors
         else:
             self.encoding_errors.pop(native_str_type, None)
+        self.encoding_cache.clear()
 
-    def load(self, io_obj, strict = True):
-        "Load the Reusable from I/O."
+    def _stage(self, name):
+        "Return the context manager timing the stage by the recorder."
+        if self.recorder is None:
+            return NULL_STAGE
+        return self.recorder.stage(name)
+
+    def load_header(self, io_obj, strict = True):
+        """
+        Load the Reusable header only from I/O.
+        The bytes read after the header are given back to io_obj if it is
+        seekable or has unread() (e.g. PushbackReader), see Header.load.
+        """
         if self.header is None:
             self.header = Header()
         self.header.load(io_obj, strict)
-        data_size = self.header["data_size"]
-        data_part = io_obj.read(data_size)
-        if len(data_part) != data_size:
-            raise RuntimeError("unexpected EOF")
-        compress_type = self.header["compress_type"]
-        if compress_type is not None and compress_type != "":
-            if compress_type == "gzip":
-                import gzip
-
-                compressed_data_part = data_part
-                data_part = gzip.decompress(compressed_data_part)
-            elif compress_type == "bzip2":
-                import bz2
+        return self.header
 
-                compressed_data_part = data_part
-                data_part = bz2.decompress(compressed_data_part)
-            else:
-                raise RuntimeError("no support compress_type %s" %
-                                   compress_type)
+    def load(self, io_obj, strict = True, lazy = False, fields = None):
+        """
+        Load the Reusable from I/O.
+        If lazy is True, only the header is read here and the body is read
+        from io_obj at the first access to the root members, so io_obj must
+        be kept open until then.
+        If fields is given, only the members of the dotted paths in it
+        (e.g. "announced_date", "points.lat") are decoded and the others
+        keep their initial value. If io_obj is seekable and has
+        skip(size, name) like s3range.S3RangeReader, the uncompressed body
+        is read in place and the bytes of the other members are skipped.
+        The Reusable loaded with fields can be saved only by patching the
+        body kept by keep_source, see save().
+        The compressed body is decompressed by chunk while it is decoded, and
+        the whole decompressed body is kept only if keep_source is set.
+        """
+        if not _is_seekable(io_obj):
+            io_obj = PushbackReader(io_obj)
+        with self._stage("HeaderLoad"):
+            self.load_header(io_obj, strict)
+        self.source = None
+        self.fields = None
+        if fields is not None:
+            self.fields = frozenset(fields)
+        if lazy:
+            self.root = LazyStructType(
+                lambda: self._load_body(io_obj, fields))
+        else:
+            self.root = self._load_body(io_obj, fields)
 
-        body_io = io.BytesIO(data_part)
-        parser = FormatParser()
-        self.root, size_members = parser.parse(self.header["format"])
-        self.level = 0
-        self.size_members = {}
-        for name in size_members.keys():
-            self.size_members[name] = {}
+        return self.root
 
-        self.root.read(self, body_io)
+    def load_path(self, path, mmap = True, strict = True, lazy = False,
+                  fields = None):
+        """
+        Load the Reusable from the file of the path.
+        If mmap is True, the file is memory-mapped and the body is decoded
+        on the mapping, so only the pages of the members read are touched
+        (with fields, the pages of the members skipped are not). The arrays
+        read into numpy.ndarray (use_numpy) refer to the mapping, which is unmapped when
+        all of them are released, so the file must not be truncated or
+        rewritten (e.g. by save() to the same path) while they are used.
+        strict, lazy and fields are the same as load().
+        """
+        import mmap as mmap_module
 
-        return self.root
+        fp = open(path, "rb")
+        try:
+            data = None
+            if mmap:
+                try:
+                    data = mmap_module.mmap(fp.fileno(), 0,
+                                            access = mmap_module.ACCESS_READ)
+                except (ValueError, OSError):
+                    # the empty file or the file which can't be mapped
+                    data = None
+            if data is not None and fields is not None and \
+                    hasattr(mmap_module, "MADV_RANDOM"):
+                # no read ahead of the pages skipped
+                data.madvise(mmap_module.MADV_RANDOM)
+            if data is None:
+                data = fp.read()
+        finally:
+            fp.close()
+        return self.load(BodyReader(data), strict, lazy, fields)
+
+    def _load_body(self, io_obj, fields = None):
+        "Load the body part from I/O and return the root."
+        data_size = self.header["data_size"]
+        decompress_reader = None
+        body_end = None
+        compress_type = self.header["compress_type"]
+        if compress_type is not None and compress_type != "":
+            codec = get_codec(compress_type)
+            # the decompression is timed as the Decompress stage, apart
+            # from the Decode stage reading it
+            decompress_reader = DecompressReader(io_obj, data_size,
+                                                 codec.decompressor,
+                                                 self._stage)
+            if self.keep_source:
+                # the whole body is kept, it is built from the decompressed
+                # chunks without the compressed copy
+                body_reader = BodyReader(decompress_reader.read())
+            elif self.compiled:
+                # the plan decodes the window of the decompressed chunks
+                body_reader = StreamBodyReader(decompress_reader)
+            else:
+                # the fields are read from the decompressor directly
+                body_reader = decompress_reader
+        elif type(io_obj) is BodyReader:
+            # the body is decoded in place on the memory of io_obj (e.g. the
+            # mapping made by load_path) without the copy
+            body_reader = BodyReader(io_obj.data, io_obj.pos,
+                                     io_obj.pos + data_size)
+            io_obj.skip(data_size, "body")
+        elif fields is not None and hasattr(io_obj, "skip") and \
+                _is_seekable(io_obj):
+            # the random access reader (e.g. s3range.S3RangeReader) reads
+            # only the selected members and skips the others in place
+            body_reader = io_obj
+            body_end = io_obj.tell() + data_size
+        else:
+            data_part = io_obj.read(data_size)
+            if len(data_part) != data_size:
+                raise RuntimeError("unexpected EOF")
+            body_reader = BodyReader(data_part)
+
+        plan = None
+        with self._stage("FormatParse"):
+            root, size_members = parse_format(self.header["format"])
+            if self.compiled and type(body_reader) in (BodyReader,
+                                                       StreamBodyReader):
+                plan = compile_format(self.header["format"], fields)
+        self._init_size_members(size_members)
+        self.encoding_cache.clear()
+
+        start = getattr(body_reader, "pos", None)
+        if plan is not None:
+            with self._stage("Decode"):
+                plan.decode(self, root, body_reader)
+        else:
+            selection = None
+            if fields is not None:
+                selection = RU._select_fields(root, fields)
+            with self._stage("Decode"):
+                root.read(self, body_reader, selection)
+        if self.keep_source and type(body_reader) is BodyReader and \
+                isinstance(body_reader.data, (bytes, bytearray)):
+            # not the mapping of load_path, the file may be rewritten
+            self.source = (body_reader.data, start, body_reader.end)
+        if decompress_reader is not None:
+            decompress_reader.close()
+        if body_end is not None:
+            io_obj.seek(body_end)
+
+        return root
+
+    def load_many(self, io_objs, fields = None, strict = True, errors = None):
+        """
+        Load the Reusables from the I/O objects and return their members by
+        column.
+        The Reusables are grouped by the header's format and each format is
+        parsed and compiled once. If the selected members are all in the
+        fixed-size part at the beginning of the body, only that part of the
+        bodies is kept and they are unpacked at once. Return the dict of
+        BulkResult by format in the order of the first appearance.
+        The encodings, compiled and use_numpy of this instance are used, and
+        its header and root are not changed.
+        If errors is a list, the Reusables which can't be loaded are skipped
+        and (index, exception) of them are appended to it.
+
+        Usage:
+            ru = RU.RU()
+            results = ru.load_many(streams, fields = ["ICAO", "edition"])
+            for format_, result in results.items():
+                df = result.to_pandas()
+        """
+        if fields is not None:
+            fields = frozenset(fields)
+        self.encoding_cache.clear()
+        results = collections.OrderedDict()
+        for index, io_obj in enumerate(io_objs):
+            if errors is None:
+                self._load_many_one(results, index, io_obj, fields, strict)
+                continue
+            try:
+                self._load_many_one(results, index, io_obj, fields, strict)
+            except Exception as e:
+                errors.append((index, e))
+        for result in results.values():
+            result._finish(self)
+        return results
+
+    def _load_many_one(self, results, index, io_obj, fields, strict):
+        "Load a Reusable into the BulkResult of its format in results."
+        if not _is_seekable(io_obj):
+            io_obj = PushbackReader(io_obj)
+        header = Header()
+        header.load(io_obj, strict)
+        format_ = header["format"]
+        result = results.get(format_)
+        if result is None:
+            result = BulkResult(self, format_, fields)
+            results[format_] = result
+        result._add(self, index, header, self._read_body(io_obj, header))
+
+    def _read_body(self, io_obj, header):
+        "Read the body part of the header and return it decompressed."
+        data_size = header["data_size"]
+        compress_type = header["compress_type"]
+        if compress_type is not None and compress_type != "":
+            codec = get_codec(compress_type)
+            return DecompressReader(io_obj, data_size,
+                                    codec.decompressor).read()
+        data_part = io_obj.read(data_size)
+        if len(data_part) != data_size:
+            raise RuntimeError("unexpected EOF")
+        return data_part
 
-    def save(self, io_obj):
-        "Save the Reuable to I/O."
+    def save(self, io_obj, compress_level = None):
+        """
+        Save the Reuable to I/O.
+        The body is compressed by the codec of the header's compress_type
+        with compress_level, or with the codec's default level if None.
+        If keep_source is set before load() and the body is kept, only the
+        members changed by set_value(), __setitem__() and so on since the
+        load or the last save are encoded and patched on the copy of the
+        body at their offsets, and the body without changes is written as
+        it is. The body is encoded whole if the size member, the size of
+        the array or the length of STR is changed. The values changed
+        directly on get_ndarray() or get_column() are not tracked.
+        The Reusable loaded with fields has only the members selected, so it
+        is saved only by the patches, and RuntimeError is raised if the
+        body is not kept or it must be encoded whole.
+        If the body is not kept, the body is compressed while it is encoded
+        by the codec having compressor().
+        """
         if self.header is None:
             raise RuntimeError("No RU header")
+        if self.fields is not None and self.source is None:
+            raise RuntimeError("RU loaded with fields can't be saved "
+                               "without keep_source")
 
-        body_io = io.BytesIO()
-        self.root.write(self, body_io)
-        body_part = body_io.getvalue()
-        write_data = body_part
+        codec = None
         compress_type = self.header["compress_type"]
         if compress_type is not None and compress_type != "":
-            if compress_type == "gzip":
-                import gzip
-            
-                write_data = gzip.compress(body_part)
-            elif compress_type == "bzip2":
-                import bz2
-
-                write_data = bz2.compress(body_part)                
+            codec = get_codec(compress_type)
+        body_part = None
+        if self.source is not None:
+            body_part = self._patch_source()
+            if body_part is None and self.fields is not None:
+                raise RuntimeError("RU loaded with fields can't be encoded "
+                                   "whole, the size or the length of STR is "
+                                   "changed")
+        if body_part is None:
+            compressor = None
+            if codec is not None and self.source is None:
+                compressor = codec.compressor(compress_level)
+            if compressor is not None:
+                # the body is compressed while it is encoded
+                writer = CompressWriter(compressor)
+                self.root.write(self, writer)
+                write_data = writer.close()
+                codec = None
             else:
-                raise RuntimeError("no support compress_type %s" %
-                                   compress_type)
+                body_io = io.BytesIO()
+                self.root.write(self, body_io)
+                body_part = body_io.getvalue()
+                if self.source is not None:
+                    self._clear_dirty(self.root)
+                    self.source = (body_part, 0, len(body_part))
+        if codec is not None:
+            write_data = codec.compress(body_part, compress_level)
+        elif body_part is not None:
+            write_data = body_part
         self.header["data_size"] = len(write_data)
         self.header.save(io_obj)
         io_obj.write(write_data)
 
+    def _patch_source(self):
+        """
+        Return the body kept with the patches of the changed members, or
+        None if the body must be encoded whole.
+        """
+        data, start, end = self.source
+        schemas = self.root.changes
+        body = None
+        if schemas:
+            patcher = BodyPatcher(self, data, start, end, schemas)
+            if not patcher.patch(self.root):
+                return None
+            body = patcher.get_body()
+            schemas.clear()
+        if body is None:
+            if start == 0 and end == len(data):
+                return data
+            return memoryview(data)[start:end]
+        self.source = (body, 0, len(body))
+        return body
+
+    def _clear_dirty(self, obj):
+        "Clear the dirty flags of the members and the changes of the tree."
+        obj.dirty = False
+        if obj.changes:
+            obj.changes.clear()
+        if obj.is_struct():
+            for member in obj.members:
+                self._clear_dirty(member)
+        elif obj.is_array():
+            for member in obj.value:
+                self._clear_dirty(member)
+
+    @classmethod
+    def _select_fields(cls, root, fields):
+        """
+        Make the member's selection tree from the dotted paths.
+        Each selection maps the member name to True (whole member) or to the
+        selection of the struct or the array's struct member.
+        """
+        selection = {}
+        for path in fields:
+            obj = root
+            this = selection
+            names = path.split(".")
+            for i in range(len(names)):
+                name = names[i]
+                if obj.is_array():
+                    obj = obj.member
+                if not obj.is_struct() or not obj.has_member(name):
+                    raise RuntimeError("no field %s" % path)
+                obj = obj.get_ref(name)
+                if i == len(names) - 1:
+                    this[name] = True
+                elif this.get(name) is not True:
+                    this = this.setdefault(name, {})
+                else:
+                    # The parent member is already selected whole.
+                    break
+
+        return selection
+
     def _dump(self, obj, path):
         "Dump for internal."
         if obj.is_array():
@@ -1472,39 +3784,153 @@ class RU(object):
             else:
                 print("%s = %s" % (p, str(obj.value)))
 
+    def _init_size_members(self, size_members):
+        """
+        Initialize the scopes of the size members.
+        size_members maps the size member's name to the stack of (level,
+        value) set in the structs entered, and _size_scope is the stack of
+        (level, stack of the name) in the order of the push, so every
+        operation below is O(1) (amortized for _leave_struct).
+        """
+        self.level = 0
+        self.size_members = {}
+        for name in size_members.keys():
+            self.size_members[name] = []
+        self._size_scope = []
+
     def _enter_struct(self):
         "Enter the struct."
         self.level += 1
 
     def _leave_struct(self):
         "Leave the struct and remvoe size member's values."
-        for name in  self.size_members.keys():
-            this = self.size_members[name]
-            if self.level in this:
-                del this[self.level]
+        scope = self._size_scope
+        level = self.level
+        while len(scope) > 0 and scope[-1][0] == level:
+            scope.pop()[1].pop()
         self.level -= 1
 
     def _get_array_size(self, name):
         "Get the array memeber's size."
-        if not name in self.size_members:
+        this = self.size_members.get(name)
+        if this is None:
             raise RuntimeError("size member %s is unknown" % name)
-        this = self.size_members[name]
-        max_level = None
-        value = None
-        for level in this.keys():
-            if max_level is None or level > max_level:
-                max_level = level
-                value = this[level]
-        if value is None:
+        if len(this) == 0:
             raise RuntimeError("size member %s value is unknown" % name)
-        return value
+        return this[-1][1]
 
     def _set_array_size(self, name, value):
         "Set the array member size value."
-        if not name in self.size_members:
+        this = self.size_members.get(name)
+        if this is None:
             return
-        this = self.size_members[name]
-        this[self.level] = value
+        level = self.level
+        if len(this) > 0 and this[-1][0] == level:
+            this[-1] = (level, value)
+        else:
+            this.append((level, value))
+            self._size_scope.append((level, this))
+
+#
+# 複数プロセスでの RU の一括読み込み
+#
+class ParallelRUDecoder(object):
+    """
+    Decoder of many Reusables on the worker processes.
+    The inputs (the file paths or the bytes of the Reusables) are split
+    into the chunks of chunk_size in their order and each chunk is decoded
+    by RU.load_many on a worker of ProcessPoolExecutor. The workers return
+    only BulkResult's columns (numpy.ndarray are passed as their buffers),
+    not the trees of the types.
+    The encodings, compiled, use_numpy and columnar of ru are used on the
+    workers. The errors of the inputs are sent back as (type name, message)
+    and reported as RuntimeError("type name: message"), so the error which
+    can't be pickled doesn't lose the results of the other inputs.
+
+    Usage:
+        decoder = ParallelRUDecoder(max_workers = 4, fields = ["ICAO"])
+        results, errors = decoder.decode(paths)
+        for index, e in errors:
+            print(paths[index], e)
+    """
+    def __init__(self, max_workers = None, fields = None, chunk_size = 64,
+                 ru = None, strict = True):
+        "Initialize this instance."
+        self.max_workers = max_workers
+        self.fields = None
+        if fields is not None:
+            self.fields = frozenset(fields)
+        self.chunk_size = max(1, chunk_size)
+        if ru is None:
+            ru = RU()
+        self.settings = (dict(ru.encoding), dict(ru.encoding_errors),
+                         ru.compiled, ru.use_numpy, ru.columnar)
+        self.strict = strict
+
+    def decode(self, inputs):
+        """
+        Decode the inputs and return the dict of BulkResult by format and
+        the list of (index, exception) of the inputs which can't be
+        decoded, in the order of the inputs.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        inputs = list(inputs)
+        futures = []
+        with ProcessPoolExecutor(max_workers = self.max_workers) as executor:
+            for start in range(0, len(inputs), self.chunk_size):
+                chunk = inputs[start:start + self.chunk_size]
+                futures.append((start, len(chunk), executor.submit(
+                    _decode_inputs, start, chunk, self.fields,
+                    self.settings, self.strict)))
+            parts = collections.OrderedDict()
+            errors = []
+            for start, size, future in futures:
+                try:
+                    results, chunk_errors = future.result()
+                except Exception as e:
+                    # the worker itself failed, e.g. BrokenProcessPool
+                    errors.extend([(index, e)
+                                   for index in range(start, start + size)])
+                    continue
+                errors.extend([(index, RuntimeError("%s: %s" % error))
+                               for index, error in chunk_errors])
+                for result in results:
+                    parts.setdefault(result.format, []).append(result)
+        results = collections.OrderedDict()
+        for format_, format_parts in parts.items():
+            results[format_] = format_parts[0]._extend(format_parts[1:])
+        errors.sort(key = lambda error: error[0])
+        return results, errors
+
+def _decode_inputs(start, inputs, fields, settings, strict):
+    """
+    Decode the inputs on the worker process.
+    Return the list of BulkResult and the list of (index, (type name of the
+    exception, message)).
+    """
+    ru = RU()
+    (ru.encoding, ru.encoding_errors, ru.compiled, ru.use_numpy,
+     ru.columnar) = settings
+    results = collections.OrderedDict()
+    errors = []
+    for index in range(start, start + len(inputs)):
+        input_ = inputs[index - start]
+        try:
+            if isinstance(input_, (bytes, bytearray, memoryview)):
+                ru._load_many_one(results, index, io.BytesIO(input_),
+                                  fields, strict)
+            else:
+                fp = open(input_, "rb")
+                try:
+                    ru._load_many_one(results, index, fp, fields, strict)
+                finally:
+                    fp.close()
+        except Exception as e:
+            errors.append((index, (type(e).__name__, str(e))))
+    for result in results.values():
+        result._finish(ru)
+    return list(results.values()), errors
 
 #
 #
@@ -1514,8 +3940,6 @@ if __name__ == "__main__":
 
     if len(sys.argv) > 1:
         path = sys.argv[1]
-        fp = open(path, "rb")
         ru = RU()
-        ru.load(fp)
-        fp.close()
+        ru.load_path(path)
         ru.dump()
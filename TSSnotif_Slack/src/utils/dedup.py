@@ -0,0 +1,192 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Python 3 delivery dedup cache module.
+#
+import collections
+import threading
+import time
+
+#
+# 定数
+#
+DEFAULT_TTL		= 24 * 60 * 60
+# The claim before the delivery, shorter than the visibility timeout of the
+# queue (60s) so that the retry of the delivery which crashed isn't skipped
+DEFAULT_PENDING_TTL	= 45
+DEFAULT_MAX_ENTRIES	= 10000
+
+def object_key(key, etag = None):
+    "Return the dedup key of the S3 object, the ETag tells the versions."
+    if etag is None:
+        return "s3:%s" % key
+    return "s3:%s:%s" % (key, etag.strip('"'))
+
+def issuance_key(icao, issue, edition, telegram_type):
+    "Return the dedup key of the TSS issuance."
+    return "tss:%s:%s:%s:%s" % (icao, issue, edition, telegram_type)
+
+#
+# プロセス内の TTL/LRU キャッシュ
+#
+class MemoryTier(object):
+    """
+    In-process tier of the keys with TTL, the least recently used keys are
+    dropped over max_entries. It lives as long as the warm container.
+    """
+    def __init__(self, max_entries = DEFAULT_MAX_ENTRIES):
+        "Initialize this instance."
+        self.max_entries = max(1, max_entries)
+        self._expires = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key, expires, now):
+        "Add the key unless it is alive, return whether it is added."
+        with self._lock:
+            alive = self._expires.get(key)
+            if alive is not None and alive > now:
+                self._expires.move_to_end(key)
+                return False
+            self._set(key, expires)
+        return True
+
+    def put(self, key, expires):
+        "Add the key or change its expiry."
+        with self._lock:
+            self._set(key, expires)
+
+    def _set(self, key, expires):
+        "Set the expiry of the key as the most recently used."
+        self._expires[key] = expires
+        self._expires.move_to_end(key)
+        while len(self._expires) > self.max_entries:
+            self._expires.popitem(last = False)
+
+    def discard(self, key):
+        "Remove the key."
+        with self._lock:
+            self._expires.pop(key, None)
+
+    def __len__(self):
+        "Return the number of the keys."
+        return len(self._expires)
+
+#
+# SQLite による永続キャッシュ
+#
+class SQLiteTier(object):
+    """
+    Persistent tier on the SQLite database file, for the tests and the
+    local runs. The other persistent tiers (e.g. the conditional put of
+    DynamoDB) have the same add(key, expires, now), put(key, expires) and
+    discard(key).
+    """
+    def __init__(self, path):
+        "Initialize this instance."
+        import sqlite3
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread = False,
+                                     isolation_level = None)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS dedup "
+                           "(key TEXT PRIMARY KEY, expires REAL NOT NULL)")
+
+    def add(self, key, expires, now):
+        "Add the key unless it is alive, return whether it is added."
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM dedup WHERE key = ? AND expires <= ?",
+                             (key, now))
+                cursor = conn.execute("INSERT OR IGNORE INTO dedup "
+                                      "(key, expires) VALUES (?, ?)",
+                                      (key, expires))
+                added = cursor.rowcount == 1
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return added
+
+    def put(self, key, expires):
+        "Add the key or change its expiry."
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO dedup (key, expires) "
+                               "VALUES (?, ?)", (key, expires))
+
+    def discard(self, key):
+        "Remove the key."
+        with self._lock:
+            self._conn.execute("DELETE FROM dedup WHERE key = ?", (key,))
+
+    def purge(self, now = None):
+        "Remove the expired keys."
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM dedup WHERE expires <= ?", (now,))
+
+    def close(self):
+        "Close the database."
+        with self._lock:
+            self._conn.close()
+
+#
+# 重複配信の判定キャッシュ
+#
+class DedupCache(object):
+    """
+    Cache of the keys claimed by the deliveries.
+    claim() adds the key to the memory tier and to the persistent tier if
+    any, and it is refused while the key is alive in either of them. The
+    claim is pending for pending_ttl seconds, and commit() keeps the key
+    for ttl seconds after the delivery. The key claimed by the delivery
+    which failed is released to be retried, and the key of the delivery
+    which crashed (e.g. the timeout of Lambda) expires by pending_ttl.
+
+    Usage:
+        cache = DedupCache(persistent = SQLiteTier("/tmp/dedup.sqlite"))
+        key = object_key(s3_key, etag)
+        if cache.claim(key):
+            try:
+                ...
+            except Exception:
+                cache.release(key)
+                raise
+            cache.commit(key)
+    """
+    def __init__(self, ttl = DEFAULT_TTL, max_entries = DEFAULT_MAX_ENTRIES,
+                 persistent = None, pending_ttl = DEFAULT_PENDING_TTL):
+        "Initialize this instance."
+        self.ttl = ttl
+        self.pending_ttl = min(pending_ttl, ttl)
+        self.memory = MemoryTier(max_entries)
+        self.persistent = persistent
+
+    def claim(self, key):
+        "Claim the key for pending_ttl, return False if it is a duplicate."
+        now = time.time()
+        expires = now + self.pending_ttl
+        if not self.memory.add(key, expires, now):
+            return False
+        if self.persistent is not None and \
+                not self.persistent.add(key, expires, now):
+            # claimed by the other container, which may release it later
+            self.memory.discard(key)
+            return False
+        return True
+
+    def commit(self, key):
+        "Keep the key claimed for ttl after the delivery."
+        expires = time.time() + self.ttl
+        self.memory.put(key, expires)
+        if self.persistent is not None:
+            self.persistent.put(key, expires)
+
+    def release(self, key):
+        "Release the key claimed."
+        self.memory.discard(key)
+        if self.persistent is not None:
+            self.persistent.discard(key)
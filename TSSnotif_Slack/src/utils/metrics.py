@@ -0,0 +1,163 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Python 3 CloudWatch Embedded Metric Format module.
+#
+import contextlib
+import json
+import sys
+import threading
+import time
+
+#
+# 定数
+#
+UNIT_MILLISECONDS	= "Milliseconds"
+UNIT_BYTES		= "Bytes"
+UNIT_COUNT		= "Count"
+
+# CloudWatch takes up to 100 values of a metric in a log event
+MAX_VALUES		= 100
+
+# The context manager doing nothing, for the stages while it is off
+NULL_STAGE = contextlib.nullcontext()
+
+#
+# 計測値の記録
+#
+class Recorder(object):
+    """
+    Recorder of the metric values of an invocation.
+    The values are kept by metric and written by flush() as the log events
+    of CloudWatch Embedded Metric Format, so CloudWatch makes the metrics
+    (and their percentiles) of them without the API calls.
+    The time of a stage doesn't include the stages in it on the same
+    thread (e.g. the S3 reads in the decoding), so the stages add up.
+
+    Usage:
+        recorder = Recorder("TSSnotif", {"FunctionName" : "..."})
+        with recorder.stage("S3Get"):
+            ...
+        recorder.put("S3Bytes", size, UNIT_BYTES)
+        recorder.flush()
+    """
+    def __init__(self, namespace, dimensions = None, stream = None):
+        "Initialize this instance."
+        self.namespace = namespace
+        self.dimensions = dict(dimensions or {})
+        self.stream = stream
+        self._values = {}
+        self._units = {}
+        self._lock = threading.Lock()
+        # The stack of the time of the inner stages per thread
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Context manager putting its time in milliseconds to name, without
+        the time of the inner stages.
+        """
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            inner = stack.pop()
+            if len(stack) > 0:
+                stack[-1] += elapsed
+            self.put(name, (elapsed - inner) * 1000.0, UNIT_MILLISECONDS)
+
+    def put(self, name, value, unit = UNIT_COUNT):
+        "Put the value of the metric."
+        with self._lock:
+            values = self._values.get(name)
+            if values is None:
+                values = self._values[name] = []
+                self._units[name] = unit
+            values.append(value)
+
+    def get_values(self, name):
+        "Return the values put to the metric."
+        with self._lock:
+            return list(self._values.get(name, ()))
+
+    def flush(self):
+        "Write the values as EMF JSON lines and clear them."
+        with self._lock:
+            values = self._values
+            units = self._units
+            self._values = {}
+            self._units = {}
+        stream = self.stream
+        if stream is None:
+            stream = sys.stdout
+        for event in self._make_events(values, units):
+            stream.write(json.dumps(event, separators = (",", ":")) + "\n")
+        stream.flush()
+
+    def _make_events(self, values, units):
+        "Make the EMF log events of up to MAX_VALUES values per metric."
+        events = []
+        i = 0
+        while True:
+            event = dict(self.dimensions)
+            metrics = []
+            for name in values.keys():
+                chunk = values[name][i:i + MAX_VALUES]
+                if len(chunk) == 0:
+                    continue
+                metrics.append({"Name" : name, "Unit" : units[name]})
+                event[name] = chunk if len(chunk) > 1 else chunk[0]
+            if len(metrics) == 0:
+                return events
+            event["_aws"] = {
+                "Timestamp" : int(time.time() * 1000),
+                "CloudWatchMetrics" : [{
+                    "Namespace" : self.namespace,
+                    "Dimensions" : [list(self.dimensions.keys())],
+                    "Metrics" : metrics,
+                }],
+            }
+            events.append(event)
+            i += MAX_VALUES
+
+#
+# 呼び出し毎の記録 (Lambda のコンテナは一度に一つの呼び出しを処理する)
+#
+_recorder = None
+
+def start(namespace, dimensions = None):
+    "Start recording the invocation and return the Recorder."
+    global _recorder
+    _recorder = Recorder(namespace, dimensions)
+    return _recorder
+
+def get_recorder():
+    "Return the Recorder of the invocation, or None if not recording."
+    return _recorder
+
+def stage(name):
+    "Context manager timing the stage, it does nothing if not recording."
+    recorder = _recorder
+    if recorder is None:
+        return NULL_STAGE
+    return recorder.stage(name)
+
+def put(name, value, unit = UNIT_COUNT):
+    "Put the value of the metric if recording."
+    recorder = _recorder
+    if recorder is not None:
+        recorder.put(name, value, unit)
+
+def finish():
+    "Write the values of the invocation and stop recording."
+    global _recorder
+    recorder = _recorder
+    _recorder = None
+    if recorder is not None:
+        recorder.flush()
@@ -0,0 +1,131 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Python 3 rate limited message sender module.
+#
+import threading
+import time
+
+#
+# 定数
+#
+DEFAULT_RATE		= 1.0
+DEFAULT_BURST		= 1
+DEFAULT_MAX_LINES	= 20
+
+#
+# トークンバケット
+#
+class TokenBucket(object):
+    """
+    Token bucket of rate tokens per second up to burst tokens.
+    clock and sleep can be replaced for the tests.
+    """
+    def __init__(self, rate = DEFAULT_RATE, burst = DEFAULT_BURST,
+                 clock = time.monotonic, sleep = time.sleep):
+        "Initialize this instance."
+        if rate <= 0:
+            raise ValueError("rate %s must be positive" % rate)
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(self.burst)
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        "Add the tokens of the time passed."
+        now = self.clock()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def try_acquire(self):
+        "Take a token if any, return whether it is taken."
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+        return False
+
+    def acquire(self):
+        "Take a token, wait for it if none."
+        with self._lock:
+            self._refill()
+            # The token is reserved before the wait, so the waiters are
+            # served in order and the rounding of the wait can't spin.
+            self._tokens -= 1
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            self.sleep(wait)
+
+#
+# 行をまとめて送るレート制限付き送信
+#
+class BatchingSender(object):
+    """
+    Sender of the lines through post(text) within the budget of the
+    TokenBucket.
+    send() is called from the threads and returns when its line is posted.
+    While a sender waits for the token, the lines sent by the others are
+    queued and merged into the same post of up to max_lines lines, so the
+    lines under pressure cost one token together. An error of post() is
+    raised by send() of every line in that post.
+
+    Usage:
+        sender = BatchingSender(post_text, TokenBucket(1.0, 1))
+        sender.send("line")
+    """
+    def __init__(self, post, bucket, max_lines = DEFAULT_MAX_LINES):
+        "Initialize this instance."
+        self.post = post
+        self.bucket = bucket
+        self.max_lines = max(1, max_lines)
+        self.posts = 0
+        self._pending = []
+        self._flushing = False
+        self._cond = threading.Condition()
+
+    def send(self, line):
+        "Send the line, wait until it is posted."
+        entry = [line, False, None]
+        with self._cond:
+            self._pending.append(entry)
+            while not entry[1] and self._flushing:
+                self._cond.wait()
+            if entry[1]:
+                return self._result(entry)
+            self._flushing = True
+        try:
+            while not entry[1]:
+                self._flush()
+        finally:
+            with self._cond:
+                self._flushing = False
+                self._cond.notify_all()
+        return self._result(entry)
+
+    def _flush(self):
+        "Post the lines queued after a token is taken."
+        self.bucket.acquire()
+        with self._cond:
+            batch = self._pending[0:self.max_lines]
+            del self._pending[0:self.max_lines]
+        error = None
+        try:
+            self.post("\n".join(entry[0] for entry in batch))
+            self.posts += 1
+        except Exception as e:
+            error = e
+        with self._cond:
+            for entry in batch:
+                entry[1] = True
+                entry[2] = error
+            self._cond.notify_all()
+
+    def _result(self, entry):
+        "Raise the error of the post of the entry."
+        if entry[2] is not None:
+            raise entry[2]
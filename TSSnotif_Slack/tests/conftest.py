@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the Lambda's code is under src/ (CodeUri of template.yaml)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
@@ -0,0 +1,185 @@
+import datetime
+import io
+import random
+import string
+
+from utils import RU
+
+## the members used by app.py with the nested, {name}, {n}, <n> and '+' arrays
+TSS_FORMAT = ("announced_date:[year:INT16,month:INT8,day:INT8,hour:INT8,min:INT8],"
+              "ICAO:<4>NSTR,telegram_type:<4>NSTR,flight_type:STR,edition:INT16,"
+              "n:INT32,points:{n}[lat:FLOAT32,lon:FLOAT32,val:INT16],remarks:STR,"
+              "m:UINT16,grid:{m}FLOAT32,fixed:{3}INT8,"
+              "nested:{n}[k:UINT8,vals:{k}INT16,s:STR,sub:[c:INT8,d:{c}[e:FLOAT64]]],"
+              "jp:USTR,u:UINT32,tail:+UINT16")
+
+FORMATS = {
+    "tss": TSS_FORMAT,
+    "flat": "a:INT8,b:UINT8,c:INT16,d:UINT16,e:INT32,f:UINT32,g:FLOAT32,"
+            "h:FLOAT64,s:STR,u:USTR,ns:<8>NSTR,nu:<12>NUSTR",
+    "columns": "n:UINT16,pts:{n}[x:FLOAT32,y:FLOAT32,v:INT16],w:{n}INT32,tail:+INT8",
+    ## the struct of variable size before the fixed members
+    "var_struct": "hdr:[k:UINT8,v:{k}INT16,s:STR],ICAO:<4>NSTR,edition:INT16",
+    "deep": "n:INT16,a:{n}[k:INT8,b:{k}[j:INT8,c:{j}[i:INT8,d:{i}INT16,"
+            "e:[h:INT8,f:{h}[g:INT8,y:{g}UINT8]]]]]",
+}
+
+INT_RANGES = {
+    "INT8": (-128, 127), "INT16": (-32768, 32767),
+    "INT32": (-2 ** 31, 2 ** 31 - 1), "UINT8": (0, 255),
+    "UINT16": (0, 65535), "UINT32": (0, 2 ** 32 - 1),
+}
+
+
+def make_header(format_, compress_type=None):
+    header = RU.Header()
+    header.announced = datetime.datetime(2024, 1, 2, 3, 4, 5)
+    header.created = datetime.datetime(2024, 1, 2, 3, 5, 6)
+    header.global_id = "WNI0"
+    header.category = "TSS0"
+    header.data_id = "41102380"
+    header.data_name = "test"
+    header.format = format_
+    header.header_comment = "test"
+    header.header_version = "1.0"
+    header.revision = "1"
+    if compress_type is not None:
+        header.compress_type = compress_type
+    return header
+
+
+def random_value(obj, rnd):
+    ## the values which survive the round trip as they are
+    type_ = obj.get_type()
+    if type_ in INT_RANGES:
+        return rnd.randint(*INT_RANGES[type_])
+    if type_ == "FLOAT32":
+        return rnd.randint(-4000, 4000) / 4.0
+    if type_ == "FLOAT64":
+        return rnd.random() * 1000
+    size = obj.get_size()
+    length = rnd.randint(0, 8 if size is None else size)
+    if type_ in ("USTR", "NUSTR"):
+        return "日本語"[0:length // 3] + "x" * (length % 3)
+    return "".join(rnd.choice(string.ascii_letters) for i in range(length))
+
+
+def fill(obj, rnd, size_names, sizes=None):
+    ## set the members of the struct at random, the sizes of the arrays by
+    ## the size members in the scope
+    sizes = dict(sizes or {})
+    for member in obj.members:
+        if member.is_struct():
+            fill(member, rnd, size_names, sizes)
+        elif member.is_array():
+            if type(member.size) is int:
+                count = member.size
+            elif member.size is None:
+                count = rnd.randint(0, 5)
+            else:
+                count = sizes[member.size]
+            member.resize(count)
+            for i in range(count):
+                element = member.get_ref(i)
+                if element.is_struct():
+                    fill(element, rnd, size_names, sizes)
+                else:
+                    member[i] = random_value(element, rnd)
+        elif member.name in size_names and member.is_integer():
+            sizes[member.name] = rnd.randint(0, 4)
+            member.set_value(sizes[member.name])
+        else:
+            member.set_value(random_value(member, rnd))
+
+
+def make_ru(format_=TSS_FORMAT, seed=0, compress_type=None, **values):
+    ## return the bytes of the Reusable filled at random, values are set
+    ## on the root members after that
+    rnd = random.Random(seed)
+    ru = RU.RU()
+    root = ru.create(make_header(format_, compress_type))
+    fill(root, rnd, RU.parse_format(format_)[1])
+    for name, value in values.items():
+        root[name] = value
+    data = io.BytesIO()
+    ru.save(data)
+    return data.getvalue()
+
+
+def make_tss(seed=0, compress_type=None, telegram_type="AMND", edition=1,
+             flight_type="regular", ICAO="RJTT"):
+    data = make_ru(TSS_FORMAT, seed, compress_type, telegram_type=telegram_type,
+                   edition=edition, flight_type=flight_type, ICAO=ICAO)
+    ru = RU.RU()
+    ru.keep_source = True
+    root = ru.load(io.BytesIO(data))
+    date = root["announced_date"]
+    for name, value in (("year", 2024), ("month", 1), ("day", 2), ("hour", 3),
+                        ("min", 0)):
+        date[name] = value
+    out = io.BytesIO()
+    ru.save(out)
+    return out.getvalue()
+
+
+def tree_values(obj):
+    ## the values of the tree as the python objects, whatever the arrays
+    ## are read into
+    if obj.is_struct():
+        return [(member.name, tree_values(member)) for member in obj.members]
+    if obj.is_array():
+        if obj.columns is not None:
+            return [tree_values(row.to_struct()) for row in obj]
+        if obj.get_ndarray() is not None:
+            return obj.get_ndarray().tolist()
+        return [tree_values(member) for member in obj.value]
+    return obj.get_value()
+
+
+def load_values(data, **kwargs):
+    ru = RU.RU()
+    for name, value in kwargs.pop("settings", {}).items():
+        setattr(ru, name, value)
+    root = ru.load(io.BytesIO(data), **kwargs)
+    return tree_values(root)
+
+
+def python_value(value):
+    ## the column value of BulkResult as the python objects
+    if isinstance(value, dict):
+        return dict((name, python_value(v)) for name, v in value.items())
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    if isinstance(value, list):
+        return [python_value(v) for v in value]
+    return value
+
+
+def member_value(obj):
+    ## the member loaded by RU.load as the column value of BulkResult
+    if obj.is_struct():
+        return dict((member.name, member_value(member)) for member in obj.members)
+    if obj.is_array():
+        return [member_value(member) for member in obj.value]
+    return obj.get_value()
+
+
+def bulk_columns(inputs, names, fields=None):
+    ## the columns of the inputs made by RU.load of each of them
+    columns = dict((name, []) for name in names)
+    for data in inputs:
+        root = RU.RU().load(io.BytesIO(data), fields=fields)
+        for name in names:
+            obj = root
+            for part in name.split("."):
+                obj = obj._get_member(part)
+            columns[name].append(member_value(obj))
+    return columns
+
+
+def check_bulk_result(result, inputs, fields=None):
+    ## result has the members of its inputs loaded one by one
+    expected = bulk_columns([inputs[i] for i in result.indexes], result.names,
+                            fields)
+    for name in result.names:
+        assert python_value(result.columns[name]) == expected[name], name
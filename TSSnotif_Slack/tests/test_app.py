@@ -0,0 +1,256 @@
+import http.server
+import importlib
+import io
+import json
+import re
+import sys
+import threading
+import time
+import types
+
+import pytest
+import urllib3
+
+from utils import ratelimit
+
+import ru_samples
+
+
+class FakeS3Client(object):
+    ## serves the HEADs and the Range GETs of the objects like S3
+    def __init__(self):
+        self.objects = {}
+
+    def put(self, key, data, etag='"v1"'):
+        self.objects[key] = (data, etag)
+
+    def _get(self, Key):
+        if Key not in self.objects:
+            raise KeyError("NoSuchKey: %s" % Key)
+        return self.objects[Key]
+
+    def head_object(self, Bucket, Key):
+        data, etag = self._get(Key)
+        return {"ContentLength": len(data), "ETag": etag}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        data, etag = self._get(Key)
+        m = re.match(r"bytes=(\d+)-(\d+)", Range)
+        first = int(m.group(1))
+        last = min(int(m.group(2)), len(data) - 1)
+        return {
+            "Body": io.BytesIO(data[first:last + 1]),
+            "ContentRange": "bytes %d-%d/%d" % (first, last, len(data)),
+            "ETag": etag,
+        }
+
+
+def make_record(message_id, key):
+    return {"messageId": message_id, "body": json.dumps({"Message": key})}
+
+
+class WebhookHandler(http.server.BaseHTTPRequestHandler):
+    ## keep the connection open between the requests
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        limit = self.server.limit
+        if limit is not None and not limit.try_acquire():
+            ## over the rate like Slack, the body is not taken
+            self.server.throttled += 1
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"no")
+            return
+        self.server.bodies.append(body)
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def webhook():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), WebhookHandler)
+    server.connections = 0
+    server.bodies = []
+    ## the statuses of the next responses, 200 after them
+    server.statuses = []
+    ## the TokenBucket of the rate, 429 over it
+    server.limit = None
+    server.throttled = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def s3():
+    return FakeS3Client()
+
+
+@pytest.fixture
+def load_app(monkeypatch, webhook, s3):
+    ## app.py creates the S3 client and the pools at import, boto3.client
+    ## is stubbed by the fake S3 client
+    url = f"http://127.0.0.1:{webhook.server_address[1]}/hook"
+    monkeypatch.setenv("SLACK_WEBHOOK_URL", url)
+    monkeypatch.setenv("INBUCKET", "test-bucket")
+    monkeypatch.setenv("DEDUP", "0")
+    monkeypatch.setenv("SLACK_RATE", "100")
+    monkeypatch.setitem(sys.modules, "boto3",
+                        types.SimpleNamespace(client=lambda *args, **kwargs: s3))
+
+    def load(**environ):
+        for name, value in environ.items():
+            monkeypatch.setenv(name, value)
+        import app
+        return importlib.reload(app)
+    return load
+
+
+@pytest.fixture
+def app(load_app):
+    return load_app()
+
+
+def test_post_webhook_reuses_connection(app, webhook):
+    for i in range(5):
+        resp = app.post_webhook(f"line {i}")
+        assert resp.status == 200
+    assert len(webhook.bodies) == 5
+    assert webhook.connections == 1
+
+
+def test_post_webhook_retries_on_same_connection(app, webhook):
+    ## 503 is retried by the pool, not by a new connection
+    webhook.statuses = [503]
+    resp = app.post_webhook("retried")
+    assert resp.status == 200
+    assert len(webhook.bodies) == 2
+    assert webhook.connections == 1
+
+
+def test_post_webhook_raises_on_error_status(app, webhook):
+    webhook.statuses = [400]
+    with pytest.raises(RuntimeError, match="Slack post failed: 400"):
+        app.post_webhook("bad")
+
+
+def posted_lines(webhook):
+    lines = []
+    for body in webhook.bodies:
+        lines.extend(json.loads(body)["text"].split("\n"))
+    return sorted(lines)
+
+
+def put_tss(s3, key, **values):
+    s3.put(key, ru_samples.make_tss(**values))
+
+
+@pytest.mark.parametrize("pipeline", ["0", "1"])
+def test_lambda_handler_reports_failed_records(load_app, webhook, s3, pipeline):
+    app = load_app(ASYNC_PIPELINE=pipeline)
+    put_tss(s3, "good1", ICAO="RJTT")
+    put_tss(s3, "good2", ICAO="RJAA")
+    ## nothing to notify for NRML
+    put_tss(s3, "quiet", telegram_type="NRML")
+    s3.put("broken", b"not a Reusable")
+    records = [
+        make_record("m1", "good1"),
+        make_record("m2", "missing"),
+        make_record("m3", "good2"),
+        make_record("m4", "broken"),
+        make_record("m5", ""),
+        make_record("m6", "quiet"),
+    ]
+    result = app.lambda_handler({"Records": records}, None)
+    failed = sorted(item["itemIdentifier"] for item in result["batchItemFailures"])
+    assert failed == ["m2", "m4", "m5"]
+    assert posted_lines(webhook) == [
+        "RJAA 20240102_0300Z AMDed at 2024/01/02 03:05:06 GMT",
+        "RJTT 20240102_0300Z AMDed at 2024/01/02 03:05:06 GMT",
+    ]
+
+
+def test_process_records_reports_slack_failure(app, webhook, s3):
+    put_tss(s3, "good")
+    webhook.statuses = [400]
+    result = app.process_records([make_record("m1", "good"),
+                                  make_record("m2", "missing")])
+    assert sorted(item["itemIdentifier"] for item in result["batchItemFailures"]) \
+        == ["m1", "m2"]
+
+
+def test_process_records_without_failures(app, webhook, s3):
+    put_tss(s3, "good")
+    result = app.process_records([make_record("m1", "good")])
+    assert result == {"batchItemFailures": []}
+    assert len(webhook.bodies) == 1
+
+
+def test_duplicate_issuance_commits_object_claim(load_app, webhook, s3):
+    app = load_app(DEDUP="1", DEDUP_TTL="3600", DEDUP_PENDING_TTL="60")
+    ## the same issuance stored under two keys
+    put_tss(s3, "first")
+    put_tss(s3, "second")
+    assert app.process_records([make_record("m1", "first")]) == \
+        {"batchItemFailures": []}
+    assert app.process_records([make_record("m2", "second")]) == \
+        {"batchItemFailures": []}
+    assert len(webhook.bodies) == 1
+    ## the claim of the second object is kept for DEDUP_TTL, not pending
+    key = app.dedup.object_key("second", '"v1"')
+    expires = app.dedup_cache.memory._expires[key]
+    assert expires - time.time() > 60
+    assert not app.dedup_cache.claim(key)
+
+
+def test_webhook_stub_throttles_over_rate(webhook):
+    webhook.limit = ratelimit.TokenBucket(20.0, 2)
+    url = f"http://127.0.0.1:{webhook.server_address[1]}/hook"
+    http = urllib3.PoolManager()
+    statuses = [http.request("POST", url, body=b"{}", retries=False).status
+                for i in range(5)]
+    assert 429 in statuses
+    assert webhook.throttled == statuses.count(429)
+
+
+def test_post_to_slack_keeps_under_rate(load_app, webhook):
+    ## the webhook allows 20 posts per second (burst 2 for the jitter)
+    app = load_app(SLACK_RATE="20", SLACK_BURST="1", SLACK_MAX_LINES="20")
+    webhook.limit = ratelimit.TokenBucket(20.0, 2)
+    lines = [f"line {i}" for i in range(60)]
+    errors = []
+
+    def send(part):
+        try:
+            for line in part:
+                app.post_to_slack(line)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=send, args=(lines[i:i + 2],))
+               for i in range(0, len(lines), 2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert webhook.throttled == 0
+    assert posted_lines(webhook) == sorted(lines)
+    ## the lines under pressure are merged into the posts
+    assert len(webhook.bodies) < len(lines) // 2
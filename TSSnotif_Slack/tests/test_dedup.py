@@ -0,0 +1,129 @@
+import pytest
+
+from utils import dedup
+
+
+class Clock(object):
+    def __init__(self, now = 1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(dedup.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def sqlite_tier(tmp_path):
+    tier = dedup.SQLiteTier(str(tmp_path / "dedup.sqlite"))
+    yield tier
+    tier.close()
+
+
+def test_keys():
+    assert dedup.object_key("a/b.ru") == "s3:a/b.ru"
+    assert dedup.object_key("a/b.ru", '"abc"') == "s3:a/b.ru:abc"
+    assert dedup.issuance_key("RJTT", "20240101_0000Z", 1, "AMND") == \
+        "tss:RJTT:20240101_0000Z:1:AMND"
+
+
+def test_claim_refuses_duplicate(clock):
+    cache = dedup.DedupCache()
+    assert cache.claim("k")
+    assert not cache.claim("k")
+    assert cache.claim("other")
+
+
+def test_release_allows_retry(clock):
+    cache = dedup.DedupCache()
+    assert cache.claim("k")
+    cache.release("k")
+    assert cache.claim("k")
+
+
+def test_pending_claim_expires(clock):
+    ## the delivery crashed without release or commit
+    cache = dedup.DedupCache(ttl = 3600, pending_ttl = 45)
+    assert cache.claim("k")
+    clock.now += 44
+    assert not cache.claim("k")
+    clock.now += 2
+    assert cache.claim("k")
+
+
+def test_commit_keeps_key_for_ttl(clock):
+    cache = dedup.DedupCache(ttl = 3600, pending_ttl = 45)
+    assert cache.claim("k")
+    cache.commit("k")
+    clock.now += 3599
+    assert not cache.claim("k")
+    clock.now += 2
+    assert cache.claim("k")
+
+
+def test_pending_ttl_is_bounded_by_ttl():
+    assert dedup.DedupCache(ttl = 10, pending_ttl = 45).pending_ttl == 10
+
+
+def test_memory_tier_drops_least_recently_used():
+    tier = dedup.MemoryTier(max_entries = 2)
+    assert tier.add("a", 100, 0)
+    assert tier.add("b", 100, 0)
+    ## "a" is used again, so "b" is dropped
+    assert not tier.add("a", 100, 0)
+    assert tier.add("c", 100, 0)
+    assert len(tier) == 2
+    assert tier.add("b", 100, 0)
+    assert not tier.add("c", 100, 0)
+
+
+def test_sqlite_tier(sqlite_tier):
+    assert sqlite_tier.add("k", 100, 0)
+    assert not sqlite_tier.add("k", 100, 50)
+    ## expired
+    assert sqlite_tier.add("k", 200, 100)
+    sqlite_tier.put("k", 300)
+    assert not sqlite_tier.add("k", 400, 250)
+    sqlite_tier.discard("k")
+    assert sqlite_tier.add("k", 400, 250)
+    sqlite_tier.purge(400)
+    assert sqlite_tier.add("k", 500, 400)
+
+
+def test_sqlite_tier_is_shared_by_containers(clock, tmp_path):
+    path = str(tmp_path / "dedup.sqlite")
+    first = dedup.DedupCache(persistent = dedup.SQLiteTier(path))
+    second = dedup.DedupCache(persistent = dedup.SQLiteTier(path))
+    try:
+        assert first.claim("k")
+        assert not second.claim("k")
+        ## the refused claim doesn't stay in the memory tier
+        assert len(second.memory) == 0
+        first.release("k")
+        assert second.claim("k")
+        second.commit("k")
+        clock.now += 60
+        assert not first.claim("k")
+    finally:
+        first.persistent.close()
+        second.persistent.close()
+
+
+def test_sqlite_tier_persists(clock, tmp_path):
+    path = str(tmp_path / "dedup.sqlite")
+    tier = dedup.SQLiteTier(path)
+    cache = dedup.DedupCache(persistent = tier)
+    assert cache.claim("k")
+    cache.commit("k")
+    tier.close()
+    ## a new container on the same file
+    tier = dedup.SQLiteTier(path)
+    try:
+        assert not dedup.DedupCache(persistent = tier).claim("k")
+    finally:
+        tier.close()
@@ -0,0 +1,137 @@
+import io
+import json
+import time
+import zlib
+
+import pytest
+
+from utils import RU, metrics
+
+import ru_samples
+
+
+def flush(recorder):
+    recorder.stream = io.StringIO()
+    recorder.flush()
+    return [json.loads(line) for line in recorder.stream.getvalue().splitlines()]
+
+
+def test_flush_writes_emf_document():
+    recorder = metrics.Recorder("TSSnotif", {"FunctionName": "notif"})
+    recorder.put("Records", 1)
+    recorder.put("Records", 1)
+    recorder.put("S3Bytes", 512, metrics.UNIT_BYTES)
+    with recorder.stage("Decode"):
+        pass
+    before = int(time.time() * 1000)
+    events = flush(recorder)
+    assert len(events) == 1
+    event = events[0]
+    assert event["FunctionName"] == "notif"
+    ## one value as is, the values of a metric as the array
+    assert event["Records"] == [1, 1]
+    assert event["S3Bytes"] == 512
+    assert event["Decode"] >= 0
+    aws = event["_aws"]
+    assert sorted(aws) == ["CloudWatchMetrics", "Timestamp"]
+    assert before <= aws["Timestamp"] <= int(time.time() * 1000)
+    assert aws["CloudWatchMetrics"] == [{
+        "Namespace": "TSSnotif",
+        "Dimensions": [["FunctionName"]],
+        "Metrics": [
+            {"Name": "Records", "Unit": "Count"},
+            {"Name": "S3Bytes", "Unit": "Bytes"},
+            {"Name": "Decode", "Unit": "Milliseconds"},
+        ],
+    }]
+    ## the values are cleared by flush
+    assert flush(recorder) == []
+
+
+def test_flush_splits_values_over_events():
+    recorder = metrics.Recorder("TSSnotif")
+    for i in range(metrics.MAX_VALUES + 5):
+        recorder.put("Records", i)
+    recorder.put("Errors", 1)
+    events = flush(recorder)
+    assert [len(event["Records"]) for event in events] == [metrics.MAX_VALUES, 5]
+    assert events[0]["Records"] + events[1]["Records"] == \
+        list(range(metrics.MAX_VALUES + 5))
+    assert events[0]["Errors"] == 1 and "Errors" not in events[1]
+    assert [metric["Name"] for metric in
+            events[1]["_aws"]["CloudWatchMetrics"][0]["Metrics"]] == ["Records"]
+    assert events[0]["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [[]]
+
+
+def test_stage_excludes_inner_stages():
+    recorder = metrics.Recorder("TSSnotif")
+    with recorder.stage("Outer"):
+        with recorder.stage("Inner"):
+            time.sleep(0.05)
+    assert recorder.get_values("Inner")[0] >= 50
+    assert recorder.get_values("Outer")[0] < 50
+
+
+def test_module_functions_without_recorder():
+    assert metrics.get_recorder() is None
+    with metrics.stage("Decode"):
+        metrics.put("Records", 1)
+    metrics.finish()
+
+
+def test_start_and_finish(capsys):
+    recorder = metrics.start("TSSnotif", {"FunctionName": "notif"})
+    assert metrics.get_recorder() is recorder
+    metrics.put("Records", 3)
+    metrics.finish()
+    assert metrics.get_recorder() is None
+    event = json.loads(capsys.readouterr().out)
+    assert event["Records"] == 3
+
+
+class SlowDecompressor(object):
+    ## zlib decompressor taking 20 ms per chunk
+    def __init__(self):
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data):
+        time.sleep(0.02)
+        return self.decompressor.decompress(data)
+
+    @property
+    def eof(self):
+        return self.decompressor.eof
+
+    @property
+    def unused_data(self):
+        return self.decompressor.unused_data
+
+
+class SlowCodec(RU.GzipCodec):
+    def decompressor(self):
+        return SlowDecompressor()
+
+
+@pytest.mark.parametrize("settings", [
+    {"keep_source": True},
+    {"compiled": True},
+    {"compiled": False},
+])
+def test_decompress_stage_apart_from_decode(monkeypatch, settings):
+    monkeypatch.setitem(RU.CODECS, "slow", SlowCodec())
+    data = ru_samples.make_tss(1, compress_type="gzip")
+    ru = RU.RU()
+    ru.load(io.BytesIO(data))
+    ru.get_header()["compress_type"] = "slow"
+    out = io.BytesIO()
+    ru.save(out)
+    recorder = metrics.Recorder("TSSnotif")
+    ru = RU.RU()
+    for name, value in settings.items():
+        setattr(ru, name, value)
+    ru.recorder = recorder
+    ru.load(io.BytesIO(out.getvalue()))
+    assert sum(recorder.get_values("Decompress")) >= 20
+    assert sum(recorder.get_values("Decode")) < 20
+    assert len(recorder.get_values("HeaderLoad")) == 1
+    assert len(recorder.get_values("FormatParse")) == 1
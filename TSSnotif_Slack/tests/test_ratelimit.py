@@ -0,0 +1,160 @@
+import threading
+import time
+
+import pytest
+
+from utils import ratelimit
+
+
+class FakeClock(object):
+    ## sleep() advances the clock instead of waiting
+    def __init__(self, now = 100.0):
+        self.now = now
+        self.sleeps = []
+        self._lock = threading.Lock()
+
+    def clock(self):
+        with self._lock:
+            return self.now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+
+@pytest.fixture
+def fake():
+    return FakeClock()
+
+
+def make_bucket(fake, rate, burst):
+    return ratelimit.TokenBucket(rate, burst, clock = fake.clock,
+                                 sleep = fake.sleep)
+
+
+def wait_for(condition, timeout = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_rate_must_be_positive(fake):
+    with pytest.raises(ValueError):
+        make_bucket(fake, 0, 1)
+
+
+def test_burst_then_refill(fake):
+    bucket = make_bucket(fake, 2.0, 3)
+    assert [bucket.try_acquire() for i in range(4)] == [True, True, True,
+                                                        False]
+    fake.now += 0.5
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    ## the tokens don't grow over burst
+    fake.now += 100
+    assert [bucket.try_acquire() for i in range(4)] == [True, True, True,
+                                                        False]
+
+
+def test_acquire_sleeps_for_missing_token(fake):
+    bucket = make_bucket(fake, 4.0, 1)
+    bucket.acquire()
+    assert fake.sleeps == []
+    bucket.acquire()
+    assert fake.sleeps == [pytest.approx(0.25)]
+    fake.now += 0.1
+    bucket.acquire()
+    assert fake.sleeps[1] == pytest.approx(0.15)
+
+
+def test_acquire_keeps_rate(fake):
+    bucket = make_bucket(fake, 10.0, 1)
+    start = fake.now
+    for i in range(21):
+        bucket.acquire()
+    assert fake.now - start == pytest.approx(2.0)
+
+
+def test_send_posts_line(fake):
+    posted = []
+    sender = ratelimit.BatchingSender(posted.append, make_bucket(fake, 1.0, 1))
+    sender.send("a")
+    sender.send("b")
+    assert posted == ["a", "b"]
+    assert sender.posts == 2
+    assert fake.sleeps == [pytest.approx(1.0)]
+
+
+def test_send_raises_post_error(fake):
+    def post(text):
+        raise RuntimeError("Slack post failed: 500")
+
+    sender = ratelimit.BatchingSender(post, make_bucket(fake, 1.0, 1))
+    with pytest.raises(RuntimeError, match="500"):
+        sender.send("a")
+    assert sender.posts == 0
+
+
+def run_pressure(fake, post, lines, max_lines):
+    ## the first line's post blocks, the other lines are queued meanwhile
+    sender = ratelimit.BatchingSender(post, make_bucket(fake, 1.0, 1),
+                                      max_lines = max_lines)
+    errors = {}
+
+    def send(line):
+        try:
+            sender.send(line)
+        except Exception as e:
+            errors[line] = e
+
+    first = threading.Thread(target = send, args = ("first",))
+    first.start()
+    post.started.wait(5)
+    threads = [threading.Thread(target = send, args = (line,))
+               for line in lines]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: len(sender._pending) == len(lines))
+    post.release.set()
+    for thread in [first] + threads:
+        thread.join(5)
+    return sender, errors
+
+
+class BlockingPost(object):
+    def __init__(self, fail = False):
+        self.texts = []
+        self.fail = fail
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, text):
+        self.started.set()
+        self.release.wait(5)
+        self.texts.append(text)
+        if self.fail and len(self.texts) > 1:
+            raise RuntimeError("Slack post failed: 503")
+
+
+def test_lines_under_pressure_are_merged(fake):
+    post = BlockingPost()
+    lines = ["line %d" % i for i in range(5)]
+    sender, errors = run_pressure(fake, post, lines, 3)
+    assert errors == {}
+    assert post.texts[0] == "first"
+    ## 5 lines in 2 posts of up to 3 lines, in the order of the queue
+    assert [len(text.split("\n")) for text in post.texts[1:]] == [3, 2]
+    assert sorted("\n".join(post.texts[1:]).split("\n")) == lines
+    assert sender.posts == 3
+    assert fake.sleeps == [pytest.approx(1.0)] * 2
+
+
+def test_post_error_is_raised_by_every_line(fake):
+    post = BlockingPost(fail = True)
+    lines = ["line %d" % i for i in range(3)]
+    sender, errors = run_pressure(fake, post, lines, 10)
+    assert sorted(errors) == lines
+    assert all("503" in str(e) for e in errors.values())
+    assert sender.posts == 1
@@ -0,0 +1,175 @@
+import io
+
+import pytest
+
+from utils import RU
+
+import ru_samples
+
+## n = 4, m = 3 and 2 elements of tail
+SEED = 3
+
+
+def set_edition(root):
+    root["edition"] = 7
+
+
+def set_hour(root):
+    root["announced_date"]["hour"] = 23
+
+
+def set_grid(root):
+    root["grid"][1] = 2.5
+
+
+def set_point(root):
+    root["points"].get_ref(2)["lat"] = 1.25
+
+
+def set_icao(root):
+    root["ICAO"] = "RJAA"
+
+
+def set_nested_string(root):
+    ## the same length
+    nested = root["nested"].get_ref(1)
+    nested["s"] = "z" * len(nested["s"])
+
+
+def set_remarks(root):
+    ## the length of STR
+    root["remarks"] = "changed remarks"
+
+
+def resize_grid(root):
+    root["m"] = root["m"] + 1
+    root["grid"].append(0.5)
+
+
+def append_tail(root):
+    root["tail"].append(7)
+
+
+## (edit, fields having the members changed, is the body patched in place ?)
+EDITS = [
+    (set_edition, ["edition"], True),
+    (set_hour, ["announced_date"], True),
+    (set_grid, ["grid"], True),
+    (set_point, ["points.lat"], True),
+    (set_icao, ["ICAO"], True),
+    (set_nested_string, ["nested.s"], True),
+    (set_remarks, ["remarks"], False),
+    (resize_grid, ["m", "grid"], False),
+    (append_tail, ["tail"], False),
+]
+
+SETTINGS = [
+    {"compiled": True},
+    {"compiled": False},
+    {"compiled": True, "use_numpy": True, "columnar": True},
+]
+
+
+def needs_numpy(settings):
+    if settings.get("use_numpy"):
+        pytest.importorskip("numpy")
+
+
+def save(ru):
+    out = io.BytesIO()
+    ru.save(out)
+    return out.getvalue()
+
+
+def reencode(data, *edits):
+    ## the edits saved by the whole encode
+    ru = RU.RU()
+    root = ru.load(io.BytesIO(data))
+    for edit in edits:
+        edit(root)
+    return save(ru)
+
+
+@pytest.fixture(scope="module")
+def sample():
+    return ru_samples.make_tss(SEED)
+
+
+@pytest.mark.parametrize("settings", SETTINGS)
+@pytest.mark.parametrize("lazy", [False, True])
+@pytest.mark.parametrize("edit,fields,patched", EDITS)
+def test_keep_source_save_matches_reencode(sample, settings, lazy, edit,
+                                           fields, patched):
+    needs_numpy(settings)
+    ru = RU.RU()
+    for name, value in settings.items():
+        setattr(ru, name, value)
+    ru.keep_source = True
+    root = ru.load(io.BytesIO(sample), lazy=lazy)
+    edit(root)
+    data = save(ru)
+    assert data == reencode(sample, edit)
+    ## the patches are made on the copy of the body, the whole encode is bytes
+    assert isinstance(ru.source[0], bytearray) == patched
+    assert ru_samples.load_values(data) == \
+        ru_samples.load_values(reencode(sample, edit))
+    ## the body kept is patched again by the next save
+    set_edition(root)
+    assert save(ru) == reencode(sample, edit, set_edition)
+
+
+@pytest.mark.parametrize("settings", SETTINGS)
+@pytest.mark.parametrize("edit,fields,patched", EDITS)
+def test_keep_source_save_with_fields(sample, settings, edit, fields, patched):
+    needs_numpy(settings)
+    ru = RU.RU()
+    for name, value in settings.items():
+        setattr(ru, name, value)
+    ru.keep_source = True
+    root = ru.load(io.BytesIO(sample), fields=fields)
+    edit(root)
+    if not patched:
+        with pytest.raises(RuntimeError, match="loaded with fields"):
+            save(ru)
+        return
+    assert save(ru) == reencode(sample, edit)
+
+
+def test_keep_source_save_without_changes(sample):
+    ru = RU.RU()
+    ru.keep_source = True
+    ru.load(io.BytesIO(sample))
+    assert save(ru) == sample
+
+
+def test_save_with_fields_needs_keep_source(sample):
+    ru = RU.RU()
+    root = ru.load(io.BytesIO(sample), fields=["edition"])
+    root["edition"] = 7
+    with pytest.raises(RuntimeError, match="without keep_source"):
+        save(ru)
+
+
+def test_changes_belong_to_their_tree(sample):
+    first = RU.RU()
+    first.keep_source = True
+    first.load(io.BytesIO(sample))
+    second = RU.RU()
+    second.keep_source = True
+    set_edition(second.load(io.BytesIO(sample)))
+    ## the change of the other tree of the same format isn't patched
+    assert save(first) == sample
+    assert save(second) == reencode(sample, set_edition)
+
+
+def test_compressed_keep_source_save(sample):
+    ru = RU.RU()
+    root = ru.load(io.BytesIO(sample))
+    ru.header["compress_type"] = "gzip"
+    data = save(ru)
+    ru = RU.RU()
+    ru.keep_source = True
+    root = ru.load(io.BytesIO(data), fields=["ICAO"])
+    set_icao(root)
+    assert ru_samples.load_values(save(ru)) == \
+        ru_samples.load_values(reencode(sample, set_icao))
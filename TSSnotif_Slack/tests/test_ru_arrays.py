@@ -0,0 +1,138 @@
+import array
+import io
+
+import pytest
+
+from utils import RU
+
+import ru_samples
+
+FORMAT = ru_samples.FORMATS["columns"]
+
+
+@pytest.fixture(scope="module")
+def sample():
+    ## n = 4 and 5 elements of tail
+    return ru_samples.make_ru(FORMAT, seed=6)
+
+
+def load(data, **settings):
+    ru = RU.RU()
+    for name, value in settings.items():
+        setattr(ru, name, value)
+    ru.keep_source = True
+    return ru, ru.load(io.BytesIO(data))
+
+
+def save(ru):
+    out = io.BytesIO()
+    ru.save(out)
+    return out.getvalue()
+
+
+def test_elements_are_types_by_default(sample):
+    ru, root = load(sample)
+    w = root["w"]
+    assert w.get_ndarray() is None
+    assert root["pts"].get_column("x") is None
+    element = w.get_ref(0)
+    assert isinstance(element, RU.Type)
+    copied = element.copy()
+    assert copied.get_value() == element.get_value()
+    copied.set_value(1)
+    assert w[0] == element.get_value()
+
+
+def test_ndarray_elements(sample):
+    numpy = pytest.importorskip("numpy")
+    ru, root = load(sample, use_numpy=True)
+    w = root["w"]
+    assert isinstance(w.get_ndarray(), numpy.ndarray)
+    assert len(w) == 4
+    values = w.get_ndarray().tolist()
+    assert [w[i] for i in range(len(w))] == values
+    element = w.get_ref(1)
+    assert isinstance(element, RU.ElementRef)
+    assert element.get_name() == w.get_ref(0).get_name() == w.member.name
+    assert element.get_type() == "INT32"
+    assert element.is_integer() and element.is_scalar()
+    assert element.get_value() == values[1]
+    ## the copy is the Type of the member, not tied to the array
+    copied = element.copy()
+    assert isinstance(copied, RU.Type)
+    assert copied.get_value() == values[1]
+    copied.set_value(values[1] + 1)
+    assert w[1] == values[1]
+    ## the view on the body is copied before the change
+    assert not w.get_ndarray().flags.writeable
+    element.set_value(-5)
+    assert w.get_ndarray().flags.writeable
+    assert w[1] == -5 and element.value == -5
+    data = save(ru)
+    assert ru_samples.load_values(data)[2] == \
+        ("w", values[0:1] + [-5] + values[2:])
+
+
+def test_ndarray_append_converts_to_list(sample):
+    pytest.importorskip("numpy")
+    ru, root = load(sample, use_numpy=True)
+    tail = root["tail"]
+    values = tail.get_ndarray().tolist()
+    tail.append(3)
+    assert tail.get_ndarray() is None
+    assert [tail[i] for i in range(len(tail))] == values + [3]
+    assert ru_samples.load_values(save(ru))[-1] == ("tail", values + [3])
+
+
+def check_rows(root):
+    pts = root["pts"]
+    rows = list(pts)
+    assert len(rows) == 4
+    row = pts.get_ref(2)
+    assert isinstance(row, RU.StructRow)
+    assert sorted(row.keys()) == ["v", "x", "y"]
+    assert row["x"] == pts.get_column("x")[2]
+    struct = row.copy()
+    assert struct.is_struct()
+    assert [(member.name, member.get_value()) for member in struct.members] \
+        == [(name, row[name]) for name in ("x", "y", "v")]
+    assert row.to_struct()["v"] == row["v"]
+    ## the copy is not tied to the row
+    struct["v"] = 0 if row["v"] else 1
+    assert struct["v"] != row["v"]
+    row["v"] = 12
+    assert pts.get_column("v")[2] == 12
+
+
+def test_columnar_with_numpy(sample):
+    numpy = pytest.importorskip("numpy")
+    ru, root = load(sample, use_numpy=True, columnar=True)
+    assert isinstance(root["pts"].get_column("x"), numpy.ndarray)
+    check_rows(root)
+    values = ru_samples.load_values(sample)
+    values[1][1][2][2] = ("v", 12)
+    assert ru_samples.load_values(save(ru)) == values
+
+
+def test_columnar_without_numpy(sample):
+    ru, root = load(sample, columnar=True)
+    assert isinstance(root["pts"].get_column("x"), array.array)
+    check_rows(root)
+    values = ru_samples.load_values(sample)
+    values[1][1][2][2] = ("v", 12)
+    assert ru_samples.load_values(save(ru)) == values
+
+
+@pytest.mark.parametrize("name", sorted(ru_samples.FORMATS))
+@pytest.mark.parametrize("settings", [
+    {"use_numpy": True},
+    {"columnar": True},
+    {"use_numpy": True, "columnar": True},
+])
+def test_arrays_match_the_list_of_types(name, settings):
+    if settings.get("use_numpy"):
+        pytest.importorskip("numpy")
+    for seed in range(3):
+        data = ru_samples.make_ru(ru_samples.FORMATS[name], seed)
+        assert ru_samples.load_values(data, settings=settings) == \
+            ru_samples.load_values(data)
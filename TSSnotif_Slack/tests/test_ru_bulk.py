@@ -0,0 +1,89 @@
+import io
+
+import pytest
+
+from utils import RU
+
+import ru_samples
+
+FIELDS = [
+    None,
+    ["ICAO", "edition"],
+    ["announced_date.hour", "points.lat", "grid", "tail"],
+    ["nested.s", "jp", "u"],
+]
+
+
+@pytest.fixture(scope="module")
+def inputs():
+    ## two formats mixed, one of them compressed
+    return [
+        ru_samples.make_tss(0),
+        ru_samples.make_ru(ru_samples.FORMATS["flat"], 1),
+        ru_samples.make_tss(1, compress_type="gzip"),
+        ru_samples.make_tss(2, ICAO="RJAA"),
+        ru_samples.make_ru(ru_samples.FORMATS["flat"], 2),
+    ]
+
+
+def load_many(inputs, fields=None, errors=None, **settings):
+    ru = RU.RU()
+    for name, value in settings.items():
+        setattr(ru, name, value)
+    return ru.load_many([io.BytesIO(data) for data in inputs], fields=fields,
+                        errors=errors)
+
+
+@pytest.mark.parametrize("compiled", [True, False])
+def test_load_many_groups_formats(inputs, compiled):
+    results = load_many(inputs, compiled=compiled)
+    assert list(results) == [ru_samples.TSS_FORMAT, ru_samples.FORMATS["flat"]]
+    tss = results[ru_samples.TSS_FORMAT]
+    assert tss.indexes == [0, 2, 3] and len(tss) == 3
+    assert [header["data_id"] for header in tss.headers] == ["41102380"] * 3
+    assert results[ru_samples.FORMATS["flat"]].indexes == [1, 4]
+    for result in results.values():
+        ru_samples.check_bulk_result(result, inputs)
+
+
+@pytest.mark.parametrize("fields", FIELDS)
+@pytest.mark.parametrize("compiled", [True, False])
+def test_load_many_matches_load(inputs, fields, compiled):
+    ## the fields are of the TSS format
+    tss_inputs = [inputs[0], inputs[2], inputs[3]]
+    results = load_many(tss_inputs, fields, compiled=compiled)
+    result = results[ru_samples.TSS_FORMAT]
+    assert result.indexes == [0, 1, 2]
+    ru_samples.check_bulk_result(result, tss_inputs, fields)
+
+
+def test_load_many_with_numpy(inputs):
+    numpy = pytest.importorskip("numpy")
+    tss_inputs = [inputs[0], inputs[2], inputs[3]]
+    results = load_many(tss_inputs, ["edition", "grid"], use_numpy=True)
+    result = results[ru_samples.TSS_FORMAT]
+    assert isinstance(result.columns["edition"], numpy.ndarray)
+    ru_samples.check_bulk_result(result, tss_inputs, ["edition", "grid"])
+
+
+def test_load_many_errors(inputs):
+    errors = []
+    broken = inputs[0][0:len(inputs[0]) - 10]
+    results = load_many([inputs[0], b"not a Reusable", broken, inputs[1]],
+                        errors=errors)
+    assert [index for index, e in errors] == [1, 2]
+    assert all(isinstance(e, RuntimeError) for index, e in errors)
+    assert results[ru_samples.TSS_FORMAT].indexes == [0]
+    assert results[ru_samples.FORMATS["flat"]].indexes == [3]
+
+
+def test_load_many_raises_without_errors(inputs):
+    with pytest.raises(RuntimeError, match="no RU header"):
+        load_many([inputs[0], b"not a Reusable"])
+
+
+def test_load_many_keeps_header_and_root(inputs):
+    ru = RU.RU()
+    root = ru.load(io.BytesIO(inputs[3]))
+    ru.load_many([io.BytesIO(data) for data in inputs])
+    assert ru.root is root and ru.get_header()["format"] == ru_samples.TSS_FORMAT
@@ -0,0 +1,175 @@
+import bz2
+import gzip
+import io
+import zlib
+
+import pytest
+
+from utils import RU
+
+import ru_samples
+
+
+def codec_param(compress_type):
+    return pytest.param(compress_type, marks=pytest.mark.skipif(
+        not RU.get_codec(compress_type).is_available(),
+        reason="no module for %s" % compress_type))
+
+
+COMPRESS_TYPES = [codec_param(name) for name in ("gzip", "bzip2", "zstd", "lz4")]
+
+
+class ChunkStream(object):
+    ## non-seekable stream recording the sizes read
+    def __init__(self, data):
+        self.io_obj = io.BytesIO(data)
+        self.sizes = []
+
+    def read(self, size=-1):
+        self.sizes.append(size)
+        return self.io_obj.read(size)
+
+
+def save(ru):
+    out = io.BytesIO()
+    ru.save(out)
+    return out.getvalue()
+
+
+@pytest.fixture(scope="module")
+def plain():
+    return ru_samples.make_tss(seed=2)
+
+
+@pytest.mark.parametrize("compress_type", COMPRESS_TYPES)
+@pytest.mark.parametrize("compiled", [True, False])
+def test_save_load_round_trip(plain, compress_type, compiled):
+    data = ru_samples.make_tss(seed=2, compress_type=compress_type)
+    ru = RU.RU()
+    ru.compiled = compiled
+    root = ru.load(io.BytesIO(data))
+    assert ru.get_header()["compress_type"] == compress_type
+    assert ru_samples.tree_values(root) == ru_samples.load_values(plain)
+    ## saved again with the same compress_type
+    again = save(ru)
+    assert ru_samples.load_values(again) == ru_samples.load_values(plain)
+    ru.get_header()["compress_type"] = None
+    assert save(ru) == plain
+
+
+@pytest.mark.parametrize("compress_type", COMPRESS_TYPES)
+def test_load_from_stream(plain, compress_type):
+    data = ru_samples.make_tss(seed=2, compress_type=compress_type)
+    stream = ChunkStream(data)
+    ru = RU.RU()
+    root = ru.load(stream)
+    assert ru_samples.tree_values(root) == ru_samples.load_values(plain)
+    assert max(stream.sizes) <= RU.DECOMPRESS_READ_SIZE
+
+
+@pytest.mark.parametrize("compress_type", COMPRESS_TYPES)
+@pytest.mark.parametrize("compiled", [True, False])
+def test_fields_on_compressed_body(plain, compress_type, compiled):
+    data = ru_samples.make_tss(seed=2, compress_type=compress_type)
+    fields = ["ICAO", "edition", "points.lat", "tail"]
+    settings = {"compiled": compiled}
+    assert ru_samples.load_values(data, settings=settings, fields=fields) == \
+        ru_samples.load_values(plain, settings=settings, fields=fields)
+
+
+@pytest.mark.parametrize("compress_type", COMPRESS_TYPES)
+def test_lazy_compressed_body(plain, compress_type):
+    data = ru_samples.make_tss(seed=2, compress_type=compress_type)
+    assert ru_samples.load_values(data, lazy=True) == \
+        ru_samples.load_values(plain)
+
+
+@pytest.mark.parametrize("compress_type", COMPRESS_TYPES)
+def test_keep_source_save_of_compressed_body(plain, compress_type):
+    data = ru_samples.make_tss(seed=2, compress_type=compress_type)
+    ru = RU.RU()
+    ru.keep_source = True
+    root = ru.load(io.BytesIO(data), fields=["edition"])
+    root["edition"] = 9
+    expected = ru_samples.make_tss(seed=2, edition=9)
+    assert ru_samples.load_values(save(ru)) == ru_samples.load_values(expected)
+
+
+def decompress_reader(data, codec):
+    stream = ChunkStream(data)
+    return stream, RU.DecompressReader(stream, len(data), codec.decompressor)
+
+
+@pytest.mark.parametrize("compress_type", COMPRESS_TYPES)
+def test_decompress_reader_reads_by_chunk(compress_type):
+    body = bytes(range(256)) * 2000
+    codec = RU.get_codec(compress_type)
+    stream, reader = decompress_reader(codec.compress(body), codec)
+    reader.unread(reader.read(1))
+    pos = 0
+    for size in (1, 1000, 70000, 3):
+        assert reader.read(size) == body[pos:pos + size]
+        pos += size
+    reader.skip(100000, "skipped")
+    pos += 100000
+    assert bytes(reader.read()) == body[pos:]
+    assert reader.read(1) == b""
+    ## the compressed data is never read at once
+    assert max(stream.sizes) <= RU.DECOMPRESS_READ_SIZE
+
+
+def test_decompress_reader_multi_member_gzip():
+    data = gzip.compress(b"first ") + gzip.compress(b"second")
+    stream, reader = decompress_reader(data, RU.get_codec("gzip"))
+    assert bytes(reader.read()) == b"first second"
+
+
+def test_decompress_reader_truncated_data():
+    data = bz2.compress(bytes(range(256)) * 100)
+    stream, reader = decompress_reader(data[0:-10], RU.get_codec("bzip2"))
+    with pytest.raises(RuntimeError, match="unexpected EOF of compressed data"):
+        reader.read()
+
+
+def test_decompress_reader_close_reads_the_rest():
+    ## the data after the body is left on the stream
+    data = gzip.compress(bytes(range(256)) * 1000)
+    stream = ChunkStream(data + b"next")
+    reader = RU.DecompressReader(stream, len(data),
+                                 RU.get_codec("gzip").decompressor)
+    reader.read(10)
+    reader.close()
+    assert stream.read() == b"next"
+
+
+class ZlibCodec(RU.Codec):
+    ## the codec which compresses the whole body only
+    def compress(self, data, level=None):
+        return zlib.compress(data)
+
+    def decompressor(self):
+        return zlib.decompressobj()
+
+
+def test_register_codec(monkeypatch, plain):
+    monkeypatch.setitem(RU.CODECS, "zlib", ZlibCodec())
+    assert isinstance(RU.get_codec("zlib"), ZlibCodec)
+    ru = RU.RU()
+    ru.load(io.BytesIO(plain))
+    ru.get_header()["compress_type"] = "zlib"
+    data = save(ru)
+    assert ru_samples.load_values(data) == ru_samples.load_values(plain)
+    assert ru_samples.load_values(data, settings={"compiled": False}) == \
+        ru_samples.load_values(plain)
+
+
+def test_register_codec_adds_to_registry(monkeypatch):
+    monkeypatch.setattr(RU, "CODECS", dict(RU.CODECS))
+    codec = ZlibCodec()
+    RU.register_codec("zlib", codec)
+    assert RU.get_codec("zlib") is codec
+
+
+def test_unknown_codec():
+    with pytest.raises(RuntimeError, match="no support compress_type xz"):
+        RU.get_codec("xz")
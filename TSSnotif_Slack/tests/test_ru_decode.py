@@ -0,0 +1,49 @@
+import pytest
+
+import ru_samples
+
+## the members selected by the fields= of RU.load for each of the formats
+FIELDS = {
+    "tss": [
+        None,
+        ["ICAO", "edition"],
+        ["announced_date.hour", "points.lat", "tail"],
+        ["nested.s", "nested.sub.d.e", "jp"],
+        ["grid", "u"],
+    ],
+    "flat": [None, ["s", "nu"], ["a", "h", "ns"]],
+    "columns": [None, ["pts.y"], ["w", "tail"]],
+    ## the unselected struct of variable size before the selected members
+    "var_struct": [None, ["ICAO", "edition"], ["hdr.s"], ["hdr.v", "edition"]],
+    "deep": [None, ["a.b.c.d"], ["a.b.c.e.f.y"]],
+}
+
+CASES = [(name, fields) for name in sorted(FIELDS) for fields in FIELDS[name]]
+
+
+## the unselected members keep their initial value on both paths, the
+## size members too
+@pytest.mark.parametrize("name,fields", CASES)
+@pytest.mark.parametrize("seed", range(5))
+def test_compiled_matches_recursive(name, fields, seed):
+    data = ru_samples.make_ru(ru_samples.FORMATS[name], seed)
+    compiled = ru_samples.load_values(data, settings={"compiled": True},
+                                      fields=fields)
+    recursive = ru_samples.load_values(data, settings={"compiled": False},
+                                       fields=fields)
+    assert compiled == recursive
+
+
+@pytest.mark.parametrize("name,fields", CASES)
+def test_fields_match_the_whole_load(name, fields):
+    ## the selected members have the values of the whole load
+    if fields is None:
+        return
+    data = ru_samples.make_ru(ru_samples.FORMATS[name], 1)
+    whole = dict(ru_samples.load_values(data))
+    for compiled in (True, False):
+        values = dict(ru_samples.load_values(
+            data, settings={"compiled": compiled}, fields=fields))
+        for field in fields:
+            if not "." in field:
+                assert values[field] == whole[field]
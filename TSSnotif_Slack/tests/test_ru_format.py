@@ -0,0 +1,130 @@
+import pytest
+
+from utils import RU
+
+import ru_samples
+
+
+def parse(format_):
+    return RU.FormatParser().parse(format_)
+
+
+def describe(obj):
+    ## (name, type, size in bytes) of the tree, the array with its member
+    if obj.is_array():
+        return (obj.name, "Array", obj.size, describe(obj.member))
+    if obj.is_struct():
+        return (obj.name, "Struct", [describe(member) for member in obj.members])
+    return (obj.name, obj.get_type(), obj.get_size())
+
+
+def test_scalar_and_string_types():
+    root, size_members = parse("a:INT8,b:UINT32,c:FLOAT64,s:STR,u:USTR,"
+                               "ns:<4>NSTR,nu:<12>NUSTR")
+    assert describe(root) == ("/", "Struct", [
+        ("a", "INT8", 1), ("b", "UINT32", 4), ("c", "FLOAT64", 8),
+        ("s", "STR", None), ("u", "USTR", None), ("ns", "NSTR", 4),
+        ("nu", "NUSTR", 12),
+    ])
+    assert size_members == {}
+
+
+def test_nested_structs():
+    root, size_members = parse("a:[b:INT8,c:[d:INT16,e:[f:STR]]],g:UINT8")
+    assert describe(root) == ("/", "Struct", [
+        ("a", "Struct", [
+            ("b", "INT8", 1),
+            ("c", "Struct", [
+                ("d", "INT16", 2),
+                ("e", "Struct", [("f", "STR", None)]),
+            ]),
+        ]),
+        ("g", "UINT8", 1),
+    ])
+
+
+def test_arrays():
+    root, size_members = parse("n:INT32,a:{n}INT16,b:{3}<4>NSTR,"
+                               "c:{n}[x:FLOAT32,y:{2}INT8],d:+UINT8,"
+                               "e:+[k:UINT8,v:{k}INT16]")
+    assert describe(root) == ("/", "Struct", [
+        ("n", "INT32", 4),
+        ("a", "Array", "n", ("", "INT16", 2)),
+        ("b", "Array", 3, ("", "NSTR", 4)),
+        ("c", "Array", "n", ("", "Struct", [
+            ("x", "FLOAT32", 4),
+            ("y", "Array", 2, ("", "INT8", 1)),
+        ])),
+        ("d", "Array", None, ("", "UINT8", 1)),
+        ("e", "Array", None, ("", "Struct", [
+            ("k", "UINT8", 1),
+            ("v", "Array", "k", ("", "INT16", 2)),
+        ])),
+    ])
+    ## only the {name} arrays make the size members
+    assert sorted(size_members) == ["k", "n"]
+
+
+def test_blanks_between_tokens():
+    root, size_members = parse("  a : INT8 , b :\t+ UINT8 , c : { 2 } [ d : STR ]")
+    assert root.get_name_type() == "a:INT8,b:+UINT8,c:{2}[d:STR]"
+
+
+def test_deep_nesting():
+    ## the struct types are parsed without the recursion
+    depth = 2000
+    root, size_members = parse("a:[" * depth + "b:INT8" + "]" * depth)
+    obj = root
+    for i in range(depth):
+        assert len(obj.members) == 1
+        obj = obj.members[0]
+        assert obj.is_struct() and obj.name == "a"
+    assert describe(obj.members[0]) == ("b", "INT8", 1)
+
+
+@pytest.mark.parametrize("name", sorted(ru_samples.FORMATS))
+def test_name_type_round_trip(name):
+    format_ = ru_samples.FORMATS[name]
+    root, size_members = parse(format_)
+    assert root.get_name_type() == format_
+    assert describe(parse(root.get_name_type())[0]) == describe(root)
+
+
+@pytest.mark.parametrize("format_,left", [
+    ## '+' is followed by the member's type, and it is not an array
+    ("a:+", "a:+"),
+    ("a:+{3}INT8", "a:+{"),
+    ("a:++INT8", "a:++"),
+    ("a:{3}+INT8", "a:{3}+"),
+    ("a:{n}{m}INT8", "a:{n}{"),
+    ("a:{n}", "a:{n}"),
+    ("a:{n]INT8", "a:{n]"),
+    ("a:{}INT8", "a:{}"),
+    ("", ""),
+    ("a INT8", "a INT8"),
+    ("1:INT8", "1"),
+    ("a:INT9", "a:INT9"),
+    ("a:INT8,", "a:INT8,"),
+    ("a:INT8;b:INT8", "a:INT8;"),
+    ("a:[]", "a:[]"),
+    ("a:[b:INT8", "a:[b:INT8"),
+    ("a:[b:INT8]]", "a:[b:INT8]]"),
+    ("a:<4>STR", "a:<4>STR"),
+    ("a:<x>NSTR", "a:<x"),
+    ("a:<4NSTR", "a:<4NSTR"),
+])
+def test_syntax_error(format_, left):
+    ## the error is reported at the end of the last token read
+    with pytest.raises(RuntimeError) as info:
+        parse(format_)
+    assert str(info.value) == "syntax error at %s" % left
+
+
+def test_parse_format_returns_fresh_trees():
+    format_ = ru_samples.FORMATS["columns"]
+    first, first_sizes = RU.parse_format(format_)
+    first.members[0].set_value(3)
+    first_sizes["x"] = True
+    second, second_sizes = RU.parse_format(format_)
+    assert second.members[0].get_value() != 3
+    assert sorted(second_sizes) == ["n"]
@@ -0,0 +1,71 @@
+import io
+
+import pytest
+
+from utils import RU
+
+import ru_samples
+
+
+class RawStream(object):
+    ## non-seekable stream without unread(), like StreamingBody of boto3
+    def __init__(self, data):
+        self.io_obj = io.BytesIO(data)
+        self.sizes = []
+
+    def read(self, size=-1):
+        self.sizes.append(size)
+        return self.io_obj.read(size)
+
+
+def make_data(comment_size=10000):
+    header = ru_samples.make_header("a:INT8")
+    header.header_comment = "c" * comment_size
+    out = io.BytesIO()
+    header.save(out)
+    return out.getvalue(), b"body bytes"
+
+
+def test_load_from_raw_stream():
+    header_data, body = make_data()
+    stream = RawStream(header_data + body)
+    header = RU.Header()
+    reader = header.load(stream)
+    assert header["header_comment"] == "c" * 10000
+    ## the bytes read after the header are kept by the PushbackReader
+    assert isinstance(reader, RU.PushbackReader)
+    assert reader.read() == body
+    ## read by chunk, not byte by byte
+    assert min(size for size in stream.sizes if size >= 0) >= \
+        len(RU.HEADER_SIGNATURE)
+    assert max(stream.sizes) == RU.HEADER_READ_SIZE
+
+
+def test_load_from_seekable_stream():
+    header_data, body = make_data()
+    io_obj = io.BytesIO(header_data + body)
+    assert RU.Header().load(io_obj) is io_obj
+    assert io_obj.tell() == len(header_data)
+
+
+def test_load_from_pushback_reader():
+    header_data, body = make_data(10)
+    reader = RU.PushbackReader(RawStream(header_data + body))
+    assert RU.Header().load(reader) is reader
+    assert reader.read() == body
+
+
+def test_ru_load_from_raw_stream():
+    data = ru_samples.make_tss(3)
+    assert ru_samples.tree_values(RU.RU().load(RawStream(data))) == \
+        ru_samples.load_values(data)
+
+
+@pytest.mark.parametrize("make_io", [io.BytesIO, RawStream])
+def test_load_errors(make_io):
+    header_data, body = make_data(10)
+    with pytest.raises(RuntimeError, match="no RU header"):
+        RU.Header().load(make_io(b"XX" + header_data))
+    ## the end of the header is not found
+    with pytest.raises(RuntimeError, match="no end of RU header"):
+        RU.Header().load(make_io(header_data[0:-3]))
@@ -0,0 +1,70 @@
+import io
+
+import pytest
+
+from utils import RU
+
+import ru_samples
+
+
+@pytest.fixture(scope="module")
+def inputs():
+    return [ru_samples.make_tss(seed) for seed in range(5)] + \
+        [ru_samples.make_ru(ru_samples.FORMATS["flat"], 1)]
+
+
+def write_files(tmp_path, inputs):
+    paths = []
+    for i, data in enumerate(inputs):
+        path = tmp_path / ("%d.ru" % i)
+        path.write_bytes(data)
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize("fields", [None, ["ICAO", "points.lat", "tail"]])
+def test_decode_matches_load(tmp_path, inputs, fields):
+    if fields is not None:
+        ## the fields are of the TSS format
+        inputs = inputs[0:5]
+    ## the bytes and the paths mixed over the chunks of 2
+    paths = write_files(tmp_path, inputs)
+    mixed = [paths[i] if i % 2 else inputs[i] for i in range(len(inputs))]
+    decoder = RU.ParallelRUDecoder(max_workers=2, fields=fields, chunk_size=2)
+    results, errors = decoder.decode(mixed)
+    assert errors == []
+    expected = RU.RU().load_many([io.BytesIO(data) for data in inputs],
+                                 fields=fields)
+    assert list(results) == list(expected)
+    for format_, result in results.items():
+        assert result.indexes == expected[format_].indexes
+        assert result.names == expected[format_].names
+        ru_samples.check_bulk_result(result, inputs, fields)
+
+
+def test_decode_with_numpy(inputs):
+    numpy = pytest.importorskip("numpy")
+    ru = RU.RU()
+    ru.use_numpy = True
+    decoder = RU.ParallelRUDecoder(max_workers=2, fields=["edition", "grid"],
+                                   chunk_size=2, ru=ru)
+    results, errors = decoder.decode(inputs[0:5])
+    result = results[ru_samples.TSS_FORMAT]
+    assert isinstance(result.columns["edition"], numpy.ndarray)
+    ru_samples.check_bulk_result(result, inputs[0:5], ["edition", "grid"])
+
+
+def test_decode_reports_errors(tmp_path, inputs):
+    ## the errors of the workers are sent back as (type name, message)
+    missing = str(tmp_path / "missing.ru")
+    decoder = RU.ParallelRUDecoder(max_workers=2, chunk_size=2)
+    results, errors = decoder.decode([inputs[0], b"not a Reusable", missing,
+                                      inputs[1], inputs[2][0:-10]])
+    assert [index for index, e in errors] == [1, 2, 4]
+    assert all(type(e) is RuntimeError for index, e in errors)
+    assert str(errors[0][1]) == "RuntimeError: no RU header"
+    assert str(errors[1][1]).startswith("FileNotFoundError: ")
+    assert str(errors[2][1]).startswith("RuntimeError: ")
+    assert results[ru_samples.TSS_FORMAT].indexes == [0, 3]
+    ru_samples.check_bulk_result(results[ru_samples.TSS_FORMAT],
+                                 [inputs[0], None, None, inputs[1]])
@@ -0,0 +1,91 @@
+import io
+
+import pytest
+
+from utils import RU
+
+import ru_samples
+
+
+@pytest.fixture(scope="module")
+def sample():
+    return ru_samples.make_tss(4)
+
+
+def write(tmp_path, data, name="sample.ru"):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def load_path(path, settings={}, **kwargs):
+    ru = RU.RU()
+    for name, value in settings.items():
+        setattr(ru, name, value)
+    return ru, ru.load_path(path, **kwargs)
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+@pytest.mark.parametrize("compiled", [True, False])
+@pytest.mark.parametrize("fields", [None, ["ICAO", "points.lat", "tail"]])
+def test_load_path_matches_load(tmp_path, sample, mmap, compiled, fields):
+    path = write(tmp_path, sample)
+    settings = {"compiled": compiled}
+    ru, root = load_path(path, settings, mmap=mmap, fields=fields)
+    assert ru_samples.tree_values(root) == \
+        ru_samples.load_values(sample, settings=settings, fields=fields)
+    assert ru.get_header()["data_size"] == \
+        RU.RU().load_header(io.BytesIO(sample))["data_size"]
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_load_path_lazy(tmp_path, sample, mmap):
+    path = write(tmp_path, sample)
+    ru, root = load_path(path, mmap=mmap, lazy=True)
+    assert not root.is_loaded()
+    assert ru_samples.tree_values(root) == ru_samples.load_values(sample)
+
+
+def test_load_path_compressed(tmp_path, sample):
+    path = write(tmp_path, ru_samples.make_tss(4, compress_type="gzip"))
+    ru, root = load_path(path)
+    assert ru_samples.tree_values(root) == ru_samples.load_values(sample)
+
+
+def test_load_path_with_numpy(tmp_path, sample):
+    numpy = pytest.importorskip("numpy")
+    path = write(tmp_path, sample)
+    ru, root = load_path(path, {"use_numpy": True, "columnar": True})
+    grid = root["grid"].get_ndarray()
+    assert isinstance(grid, numpy.ndarray)
+    ## the array is a view on the mapping
+    assert not grid.flags.writeable
+    assert ru_samples.tree_values(root) == ru_samples.load_values(sample)
+    ## changed on the copy, the file is not
+    root["grid"][0] = 1.5
+    assert root["grid"][0] == 1.5
+    with open(path, "rb") as fp:
+        assert fp.read() == sample
+
+
+def test_load_path_keep_source_save(tmp_path, sample):
+    path = write(tmp_path, sample)
+    ru = RU.RU()
+    ru.keep_source = True
+    root = ru.load_path(path)
+    root["edition"] = 5
+    out = io.BytesIO()
+    ru.save(out)
+    expected = RU.RU()
+    expected_root = expected.load(io.BytesIO(sample))
+    expected_root["edition"] = 5
+    expected_out = io.BytesIO()
+    expected.save(expected_out)
+    assert out.getvalue() == expected_out.getvalue()
+
+
+def test_load_path_empty_file(tmp_path):
+    path = write(tmp_path, b"")
+    ## the empty file can't be memory-mapped, it is read
+    with pytest.raises(RuntimeError, match="no RU header"):
+        load_path(path)
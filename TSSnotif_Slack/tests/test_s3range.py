@@ -0,0 +1,162 @@
+import contextlib
+import io
+import re
+
+import pytest
+
+from utils import s3range
+
+
+class PreconditionFailed(Exception):
+    pass
+
+
+class FakeS3Client(object):
+    ## serves the Range GETs of one object like S3 and records the ranges
+    def __init__(self, data, etag='"v1"'):
+        self.data = data
+        self.etag = etag
+        self.ranges = []
+
+    def get_object(self, Bucket, Key, Range = None, IfMatch = None):
+        if IfMatch is not None and IfMatch != self.etag:
+            raise PreconditionFailed(IfMatch)
+        size = len(self.data)
+        m = re.match(r"bytes=(\d+)-(\d+)", Range)
+        first = int(m.group(1))
+        last = min(int(m.group(2)), size - 1)
+        self.ranges.append((first, last))
+        return {
+            "Body" : io.BytesIO(self.data[first:last + 1]),
+            "ContentRange" : "bytes %d-%d/%d" % (first, last, size),
+            "ETag" : self.etag,
+        }
+
+
+DATA = bytes(range(256)) * 8
+
+
+def make_reader(client, **kwargs):
+    kwargs.setdefault("block_size", 100)
+    kwargs.setdefault("read_ahead", 0)
+    return s3range.S3RangeReader(client, "bucket", "key", **kwargs)
+
+
+def test_read_returns_bytes_of_object():
+    reader = make_reader(FakeS3Client(DATA), read_ahead = 2)
+    out = []
+    for size in (1, 99, 150, 7, 1000, 2000):
+        out.append(reader.read(size))
+    assert b"".join(out) == DATA
+    assert reader.read(10) == b""
+    assert reader.tell() == len(DATA)
+
+
+def test_size_and_etag_from_first_response():
+    client = FakeS3Client(DATA)
+    reader = make_reader(client)
+    assert reader.get_size() == len(DATA)
+    assert reader.etag == '"v1"'
+    assert client.ranges == [(0, 99)]
+
+
+def test_seek_and_skip_fetch_only_blocks_read():
+    client = FakeS3Client(DATA)
+    reader = make_reader(client, size = len(DATA))
+    reader.seek(1000)
+    assert reader.read(10) == DATA[1000:1010]
+    reader.skip(500, "skipped")
+    assert reader.read(10) == DATA[1510:1520]
+    reader.seek(-5, io.SEEK_END)
+    assert reader.read() == DATA[-5:]
+    assert client.ranges == [(1000, 1099), (1500, 1599), (2000, 2047)]
+    assert reader.bytes_fetched == 248
+
+
+def test_skip_past_end_raises():
+    reader = make_reader(FakeS3Client(DATA))
+    with pytest.raises(RuntimeError, match="unexpected EOF at tail"):
+        reader.skip(len(DATA) + 1, "tail")
+
+
+def test_cached_blocks_are_not_fetched_again():
+    client = FakeS3Client(DATA)
+    reader = make_reader(client, size = len(DATA))
+    reader.seek(500)
+    reader.read(100)
+    del client.ranges[:]
+    ## blocks 3-7 with block 5 cached, only the runs around it are fetched
+    reader.seek(300)
+    assert reader.read(500) == DATA[300:800]
+    assert client.ranges == [(300, 499), (600, 799)]
+
+
+def test_read_ahead_doubles_while_sequential():
+    client = FakeS3Client(DATA)
+    reader = make_reader(client, size = len(DATA), read_ahead = 1,
+                         max_read_ahead = 4)
+    while reader.read(100):
+        pass
+    ## the first read isn't sequential, then 1 + 1, 1 + 2, 1 + 4 and 1 + 4
+    ## blocks by the request
+    assert client.ranges == [(0, 99), (100, 299), (300, 599), (600, 1099),
+                             (1100, 1599), (1600, 2047)]
+
+
+def test_read_ahead_resets_on_random_read():
+    client = FakeS3Client(DATA)
+    reader = make_reader(client, size = len(DATA), read_ahead = 1,
+                         max_read_ahead = 4)
+    reader.read(100)
+    reader.read(100)
+    reader.read(100)
+    reader.seek(1500)
+    reader.read(100)
+    reader.read(100)
+    ## the read ahead is back to 1 block after the seek
+    assert client.ranges == [(0, 99), (100, 299), (1500, 1599), (1600, 1799)]
+
+
+def test_lru_cache_is_bounded():
+    client = FakeS3Client(DATA)
+    reader = make_reader(client, size = len(DATA), cache_blocks = 2)
+    for i in range(5):
+        reader.seek(i * 100)
+        reader.read(1)
+    assert len(reader._blocks) == 2
+    reader.seek(0)
+    reader.read(1)
+    assert client.ranges[-1] == (0, 99)
+    assert len(client.ranges) == 6
+
+
+def test_replaced_object_is_reported():
+    client = FakeS3Client(DATA)
+    reader = make_reader(client)
+    reader.read(10)
+    client.etag = '"v2"'
+    reader.seek(1000)
+    with pytest.raises(PreconditionFailed):
+        reader.read(10)
+
+
+def test_given_etag_is_checked_from_first_request():
+    client = FakeS3Client(DATA)
+    reader = make_reader(client, size = len(DATA), etag = '"v0"')
+    with pytest.raises(PreconditionFailed):
+        reader.read(10)
+
+
+def test_requests_are_recorded_as_s3get_stage():
+    stages = []
+
+    class Recorder(object):
+        def stage(self, name):
+            stages.append(name)
+            return contextlib.nullcontext()
+
+    client = FakeS3Client(DATA)
+    reader = make_reader(client, recorder = Recorder())
+    reader.read(250)
+    assert stages == ["S3Get"] * reader.requests
+    assert reader.requests == len(client.ranges)